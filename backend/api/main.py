@@ -1,12 +1,22 @@
-from io import BytesIO
+import asyncio
 import json
 import logging
-import pandas as pd
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+import os
+import shutil
+import tempfile
+from itertools import chain
+from typing import Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Header
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from rag_pipeline import run_rag_pipeline
+from rag_pipeline import run_rag_pipeline, stream_rag_pipeline, llm_clients, corpus, CORPUS_WATCH_INTERVAL_SECONDS, ComplianceStatus
+from bulk_engine import stream_bulk
+from bulk_io import CONTENT_TYPES, OUTPUT_EXTENSIONS, create_writer, detect_format, iter_rows
+from jobs import JobStore, JobManager
+from tracing import request_context, new_trace_id, current_request_id, metrics_payload
+from corpus import SUPPORTED_EXTENSIONS
 from pydantic import BaseModel
 
 
@@ -29,8 +39,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Errors-Count", "X-Job-Status", "X-Rows-Completed", "X-Rows-Total"],
 )
 
+job_manager = JobManager(JobStore())
+
+EXCEL_CONTENT_TYPES = ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel']
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "") # When set, /admin endpoints require a matching X-Admin-Token header
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tags the request's logs and pipeline traces with an id, echoed in the X-Request-ID header."""
+    request_id = request.headers.get("X-Request-ID") or new_trace_id()
+    with request_context(request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.on_event("startup")
+async def resume_jobs():
+    """Picks up bulk jobs that were still running when the server last stopped, now or once their heartbeat goes stale."""
+    job_manager.watch()
+
+@app.on_event("shutdown")
+async def stop_resuming_jobs():
+    job_manager.stop_watching()
+
+@app.on_event("startup")
+async def watch_corpus():
+    """Re-indexes regulations added to, changed in or removed from the corpus directory."""
+    if CORPUS_WATCH_INTERVAL_SECONDS > 0:
+        corpus.watch(CORPUS_WATCH_INTERVAL_SECONDS)
+
+@app.on_event("shutdown")
+async def stop_watching_corpus():
+    corpus.stop_watching()
+
+@app.get("/health/llm")
+async def llm_health(probe: bool = False):
+    """
+    Per-endpoint call counts, error rates and latency percentiles for the Ollama servers.
+    With probe=true each endpoint is also pinged.
+    """
+    response = {"endpoints": llm_clients.stats()}
+    if probe:
+        response["probe"] = await asyncio.to_thread(llm_clients.check_health)
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, token counts, retries, validator verdicts and cache hits."""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
 class AskRequest(BaseModel):
     question: str
     memory: list[str]
@@ -38,96 +99,246 @@ class AskRequest(BaseModel):
 @app.post("/ask")
 async def ask_question(request: AskRequest):
     try:
-        answer = run_rag_pipeline(request.question, request.memory)
-        return {"question": request.question, "answer": answer}
+        trace_id = current_request_id()
+        answer = run_rag_pipeline(request.question, request.memory, trace_id=trace_id)
+        return {"question": request.question, "answer": answer, "trace_id": trace_id}
     except Exception as e:
         return {"error": str(e), "message": "An error occurred while processing your request."}, 500
     
+@app.post("/ask/stream")
+async def ask_question_stream(request: AskRequest):
+    """
+    Server-sent events for a single question: stage start/end, generated tokens and
+    validator verdicts as they happen, then a terminal 'result' (or 'error') event with
+    the validated compliance status.
+    """
+    async def event_stream():
+        async for event in stream_rag_pipeline(request.question, request.memory, trace_id=current_request_id()):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/excel")
-async def upload_and_process_excel(file: UploadFile = File(...), memory: str = Form(...)):
+async def upload_and_process_excel(file: UploadFile = File(...), memory: str = Form(...), output_format: str = Form("")):
     """
-    Endpoint to upload an Excel file, process each row with the RAG pipeline,
-    and return a new Excel file with the results.
+    Endpoint to upload a feature sheet (.xlsx, .xls, .csv or .ndjson), process each row
+    with the RAG pipeline, and return the sheet with the results. Rows are read one at a
+    time and written in order as they finish. CSV and NDJSON output (`output_format`,
+    defaulting to the input format) is streamed to the client row by row; an Excel
+    workbook is built on disk and sent once complete, with the X-Errors-Count header.
     """
     logger.info(f"Received file upload: {file.filename}")
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded.")
-    
-    allowed_types = ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel']
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid file type. Only Excel files (.xlsx, .xls) are allowed.")
 
+    input_format = detect_format(file.filename) or ("xlsx" if file.content_type in EXCEL_CONTENT_TYPES else None)
+    if input_format is None:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only Excel (.xlsx, .xls), CSV and NDJSON files are allowed.")
+    output_format = output_format or (input_format if input_format in CONTENT_TYPES else "xlsx")
+    if output_format not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid output format. Use one of: {', '.join(CONTENT_TYPES)}.")
+
+    # FastAPI closes the upload when this function returns, before a streamed body is
+    # done with it, so rows are read from a copy owned by the response (spooled to disk)
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
     try:
-        # Read the uploaded Excel file into a pandas DataFrame
-        excel_data = await file.read()
-        df = pd.read_excel(BytesIO(excel_data))
-        logger.debug(f"Successfully read Excel file with {len(df.index)} rows.")
-        
+        await asyncio.to_thread(shutil.copyfileobj, file.file, upload)
+        upload.seek(0)
         memory = json.loads(memory)
-        results = []
-        errors = []
-        errors_idx = []
+        rows = iter_rows(upload, input_format)
+        first_row = await asyncio.to_thread(next, rows, None)
+    except Exception as e:
+        upload.close()
+        logger.error(f"Could not read {file.filename}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read the uploaded file: {str(e)}")
+    if first_row is None:
+        upload.close()
+        raise HTTPException(status_code=400, detail="The uploaded file has no rows.")
+
+    rows = chain([first_row], rows)
+    result_columns = list(ComplianceStatus.model_fields)
+    filename = f"processed_{os.path.splitext(file.filename)[0]}{OUTPUT_EXTENSIONS[output_format]}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+
+    if output_format != "xlsx":
+        writer = create_writer(output_format, list(first_row), result_columns)
 
-        for index, row in df.iterrows():
+        async def body():
+            yield writer.header()
             try:
-                # Get the relevant data from the row
-                feature_name = str(row.get("feature_name", "")) if pd.notna(row.get("feature_name")) else ""
-                feature_description = str(row.get("feature_description", "")) if pd.notna(row.get("feature_description")) else ""
-                
-                # Call the RAG pipeline with concatenated data
-                pipeline_result_json = run_rag_pipeline(feature_name + feature_description, memory)
-
-                # Append the pipeline result to our results list
-                pipeline_result = json.loads(pipeline_result_json)
-                results.append(pipeline_result)
+                async for position, row, (result, error) in stream_bulk(rows, memory):
+                    yield writer.write(position, row, result, error)
             except Exception as e:
-                # If an error occurs, record it with the row index
-                logger.error(f"Error processing row {index}: {str(e)}")
-                errors.append(str(e))
-                errors_idx.append(index)
-
-        # If any rows were processed successfully, create a DataFrame from the results
-        if results:
-            results_df = pd.DataFrame(results)
-            # Ensure columns are aligned if the pipeline output varies
-            results_df = results_df.reindex(columns=list(results[0].keys()))
-
-            # Concatenate the original DataFrame with the results DataFrame
-            processed_df = pd.concat([df, results_df], axis=1)
-        else:
-            # If no results, return the original DataFrame with a message
-            processed_df = df
-            logger.warning("No rows were successfully processed.")
-
-        for column in processed_df.columns:
-            if processed_df[column].apply(lambda x: isinstance(x, list)).any():
-                logger.info(f"Converting list data in column '{column}' to string format.")
-                processed_df[column] = processed_df[column].apply(lambda x: "\n".join(x) if isinstance(x, list) else x)
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            processed_df.to_excel(writer, index=False, sheet_name='Processed_Data')
-            # Add a second sheet for errors if any occurred
-            if errors:
-                error_df = pd.DataFrame({"row_index": errors_idx, "error_message": errors})
-                error_df.to_excel(writer, index=False, sheet_name='Errors')
-        
-        output.seek(0)
-        logger.info("Successfully created processed Excel file.")
-
-        # Return the new Excel file as a StreamingResponse
-        headers = {
-            'Content-Disposition': f'attachment; filename="processed_{file.filename}"',
-            'X-Errors-Count': str(len(errors))
-        }
+                # The response has started; ending it early tells the client the output is incomplete
+                logger.critical(f"An unexpected error occurred during file processing: {str(e)}", exc_info=True)
+                raise
+            finally:
+                upload.close()
+            logger.info(f"Successfully streamed processed {output_format} file ({writer.errors} errors).")
 
-        return StreamingResponse(
-            content=output, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-            headers=headers
-        )
+        return StreamingResponse(body(), media_type=CONTENT_TYPES[output_format], headers=headers)
 
+    fd, output_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        # Rows run concurrently in a worker pool and are written to disk in row order
+        writer = create_writer("xlsx", list(first_row), result_columns, output_path)
+        async for position, row, (result, error) in stream_bulk(rows, memory):
+            writer.write(position, row, result, error)
+        writer.close()
+        logger.info("Successfully created processed Excel file.")
     except Exception as e:
         # General error handling for the entire process
+        os.remove(output_path)
         logger.critical(f"An unexpected error occurred during file processing: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    finally:
+        upload.close()
+
+    headers['X-Errors-Count'] = str(writer.errors)
+    return FileResponse(output_path, media_type=CONTENT_TYPES["xlsx"], headers=headers,
+                        background=BackgroundTask(os.remove, output_path))
+
+
+def check_admin_token(token: str) -> None:
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+def corpus_file_path(doc_id: str) -> str:
+    """Validates a document id (a plain file name) and returns its path in the corpus directory."""
+    if os.path.basename(doc_id) != doc_id or doc_id.startswith(".") or not doc_id.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"Document ids must be file names ending in {', '.join(SUPPORTED_EXTENSIONS)}.")
+    return os.path.join(corpus.directory, doc_id)
+
+@app.get("/admin/documents")
+async def list_documents(x_admin_token: str = Header("")):
+    """Indexed regulations with their fingerprints and chunk counts, and the corpus version."""
+    check_admin_token(x_admin_token)
+    return corpus.describe()
+
+@app.put("/admin/documents/{doc_id}")
+async def put_document(doc_id: str, file: UploadFile = File(...), x_admin_token: str = Header("")):
+    """
+    Adds or replaces a regulation. The file is saved to the corpus directory, embedded,
+    and swapped into the live index; in-flight queries finish on the previous snapshot.
+    If it cannot be indexed, the directory is left as it was, so a rejected upload is not
+    picked up on the next restart.
+    """
+    check_admin_token(x_admin_token)
+    path = corpus_file_path(doc_id)
+    logger.info(f"Received regulation upload: {doc_id}")
+    content = await file.read()
+    # The file is indexed under its final path (chunks cite it), so it has to be in place
+    # first; the version it replaces is kept aside (hidden, so not indexed) until then
+    os.makedirs(corpus.directory, exist_ok=True)
+    backup_path = None
+    try:
+        # Write next to the target and rename, so the watcher never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=corpus.directory, prefix=".upload-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        if os.path.exists(path):
+            backup_path = tmp_path + ".previous"
+            os.replace(path, backup_path)
+        os.replace(tmp_path, path)
+        snapshot = await asyncio.to_thread(corpus.upsert, path)
+    except Exception as e:
+        restore_corpus_file(path, backup_path)
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=409, detail=str(e))
+        logger.critical(f"Failed to ingest {doc_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    if backup_path is not None:
+        os.remove(backup_path)
+    return {"changed": snapshot is not None, **corpus.describe()}
+
+def restore_corpus_file(path: str, backup_path: Optional[str]) -> None:
+    """Puts back the file an upload replaced, or removes the upload if it was new."""
+    try:
+        if backup_path is not None:
+            os.replace(backup_path, path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.error(f"Failed to restore {path} after a rejected upload: {str(e)}")
+
+@app.delete("/admin/documents/{doc_id}")
+async def delete_document(doc_id: str, x_admin_token: str = Header("")):
+    """Removes a regulation from the live index and from the corpus directory."""
+    check_admin_token(x_admin_token)
+    path = corpus_file_path(doc_id)
+    if doc_id not in corpus.snapshot.documents and not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Document not found.")
+    try:
+        await asyncio.to_thread(corpus.remove, doc_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if os.path.exists(path):
+        os.remove(path)
+    logger.info(f"Removed regulation: {doc_id}")
+    return corpus.describe()
+
+@app.post("/admin/documents/sync")
+async def sync_documents(x_admin_token: str = Header("")):
+    """Re-scans the corpus directory immediately instead of waiting for the watcher."""
+    check_admin_token(x_admin_token)
+    snapshot = await asyncio.to_thread(corpus.sync)
+    return {"changed": snapshot is not None, **corpus.describe()}
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), memory: str = Form(...)):
+    """
+    Endpoint to submit an Excel file as a background job. Returns the job id immediately;
+    progress is available from /jobs/{job_id}/events and results from /jobs/{job_id}/result.
+    """
+    logger.info(f"Received job upload: {file.filename}")
+    if file.content_type not in EXCEL_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only Excel files (.xlsx, .xls) are allowed.")
+
+    try:
+        return await job_manager.submit(file.filename, await file.read(), json.loads(memory))
+    except Exception as e:
+        logger.critical(f"Failed to create job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events with job status and each finished row's compliance result."""
+    if job_manager.store.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def event_stream():
+        async for event in job_manager.events(job_id):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: str):
+    """Returns the processed Excel file for the rows finished so far."""
+    job = job_manager.store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    output, errors_count, job = await asyncio.to_thread(job_manager.build_result, job_id)
+    headers = {
+        'Content-Disposition': f'attachment; filename="processed_{job["filename"]}"',
+        'X-Errors-Count': str(errors_count),
+        'X-Job-Status': job["status"],
+        'X-Rows-Completed': str(job["completed"]),
+        'X-Rows-Total': str(job["total"]),
+    }
+    return StreamingResponse(
+        content=output,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers
+    )
@@ -0,0 +1,56 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from tracing import log_event
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to `run_batch` together, in
+    groups of up to `max_batch` items that share a key. The first thread to join a group
+    waits at most `max_wait` seconds for it to fill and then makes the call; the others
+    block until their item's result is ready. `run_batch` returns one result per item, or
+    None for items it could not answer; if it raises, every item in the group gets None.
+    """
+
+    def __init__(self, name: str, run_batch: Callable[[List[Any]], List[Optional[Any]]], max_batch: int, max_wait: float):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._open: Dict[Hashable, List[Tuple[Any, Future]]] = {}
+
+    def submit(self, key: Hashable, item: Any) -> Tuple[Optional[Any], int]:
+        """Returns the item's result (or None) and the size of the batch it was sent in."""
+        future: Future = Future()
+        with self._condition:
+            group = self._open.setdefault(key, [])
+            group.append((item, future))
+            leader = len(group) == 1
+            if len(group) >= self.max_batch:
+                del self._open[key]
+                self._condition.notify_all()
+            elif leader:
+                deadline = time.monotonic() + self.max_wait
+                while self._open.get(key) is group and (remaining := deadline - time.monotonic()) > 0:
+                    self._condition.wait(remaining)
+                if self._open.get(key) is group:
+                    del self._open[key]
+
+        if leader:
+            self._run(group)
+        return future.result(), len(group)
+
+    def _run(self, group: List[Tuple[Any, Future]]) -> None:
+        try:
+            results = list(self.run_batch([item for item, _ in group]))
+        except Exception as e:
+            log_event("batch_failed", level=logging.WARNING, batch=self.name, size=len(group), error=f"{type(e).__name__}: {e}")
+            results = []
+        results += [None] * (len(group) - len(results))
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
@@ -0,0 +1,317 @@
+"""
+Offline evaluation of answer quality against cost across pipeline configurations.
+
+Runs every row of a labelled sheet (feature_name, feature_description, feature_type,
+compliance_status, supporting_regulations; e.g. processed_sample_data.xlsx) through the
+pipeline once per configuration. A configuration is a set of environment overrides for
+rag_pipeline (RETRIEVAL_K, LLM_VALIDATOR, CHUNK_SIZE, MAX_RETRIES, ...), so each one runs
+in its own spawned process. For each configuration the report has per-class accuracy for
+feature_type and compliance_status, precision and recall of the cited regulations, LLM calls,
+tokens and latency per row, and which configurations are Pareto-optimal (no other one is at
+least as accurate and at least as cheap on every axis).
+
+The models are FakeOllamaServers. With --replay, they answer from recorded responses of a
+real model (recorded on an earlier run with --record-from), so configurations can be compared
+without one; requests that were never recorded get synthetic answers and are reported as
+replay misses. Latencies always follow the fake server's timing model.
+
+Run from the backend directory:
+    python -m benchmarks.evaluate --sheet ../processed_sample_data.xlsx
+    python -m benchmarks.evaluate --sweep RETRIEVAL_K=2,4,8 --sweep LLM_VALIDATOR=qwen3:0.6b,qwen3:1.7b
+    python -m benchmarks.evaluate --configs sweep.json --replay recordings.sqlite --record-from http://gpu-host:11434
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from benchmarks.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+from benchmarks.run_benchmark import BACKEND_DIR, RESULTS_DIR, git_revision, prepare_environment, summarize
+
+DEFAULT_SHEET = os.path.join(os.path.dirname(BACKEND_DIR), "processed_sample_data.xlsx")
+EVAL_RESULTS_DIR = os.path.join(RESULTS_DIR, "eval")
+LABELS = ["feature_type", "compliance_status"]
+CITATION_MATCH_OVERLAP = 0.6 # Share of the shorter name's terms two regulation names must have in common to match
+
+# Speed-oriented changes, each compared with the defaults
+DEFAULT_CONFIGS = [
+    {"name": "baseline", "env": {}},
+    {"name": "retrieval_k_2", "env": {"RETRIEVAL_K": "2"}},
+    {"name": "validator_context_400", "env": {"VALIDATOR_CONTEXT_TOKENS": "400"}},
+    {"name": "max_retries_1", "env": {"MAX_RETRIES": "1"}},
+    {"name": "chunk_size_500", "env": {"CHUNK_SIZE": "500", "CHUNK_OVERLAP": "100"}},
+    # Every rule decision is taken, so the report measures each rule's agreement (see fast_path.load_calibration)
+    {"name": "fast_path", "env": {"FAST_PATH_ENABLED": "1", "FAST_PATH_MIN_CONFIDENCE": "0", "FAST_PATH_CALIBRATION_PATH": ""}},
+    {"name": "batch_4", "env": {"BULK_BATCH_SIZE": "4"}},
+]
+# Lower is better for each of these; accuracy is the one axis where higher is better
+COST_METRICS = ["llm_calls_per_row", "tokens_per_row", "latency_mean_s"]
+QUALITY_METRIC = "compliance_status_accuracy"
+
+
+def split_regulations(value) -> List[str]:
+    """Regulation names from a cell: one per line, or comma-separated outside parentheses."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    text = str(value)
+    parts = re.split(r"[\n;]+", text) if re.search(r"[\n;]", text) else re.split(r",\s*(?![^()]*\))", text)
+    return [part.strip(" -•\t") for part in parts if part.strip(" -•\t")]
+
+
+def load_labelled_rows(path: str) -> List[Dict]:
+    from bulk_io import detect_format, iter_rows
+
+    rows = []
+    with open(path, "rb") as f:
+        for row in iter_rows(f, detect_format(path)):
+            if row.get("feature_type") and row.get("compliance_status"):
+                # As bulk_engine.row_to_question, which would load the pipeline in this process
+                question = str(row.get("feature_name") or "") + str(row.get("feature_description") or "")
+                rows.append({"question": question, "feature_type": row["feature_type"],
+                             "compliance_status": row["compliance_status"],
+                             "supporting_regulations": split_regulations(row.get("supporting_regulations"))})
+    return rows
+
+
+def citations_matching(cited: Sequence[str], labelled: Sequence[str]) -> int:
+    """How many of `cited` name one of the `labelled` regulations (by shared terms, not exact wording)."""
+    from retrieval import tokenize
+
+    labelled_terms = [set(tokenize(name)) for name in labelled]
+    matched = 0
+    for name in cited:
+        terms = set(tokenize(name))
+        if any(terms and other and len(terms & other) / min(len(terms), len(other)) >= CITATION_MATCH_OVERLAP
+               for other in labelled_terms):
+            matched += 1
+    return matched
+
+
+def fast_path_agreement(rows: List[Dict], answers: List[Dict]) -> Dict:
+    """{"<source>:<label>": {"answered": n, "agreed": m}} for the rows the fast path answered."""
+    from fast_path import answer_source, label_of
+
+    agreement: Dict = {}
+    for row, answer in zip(rows, answers):
+        source = answer_source(answer)
+        if source:
+            stats = agreement.setdefault(f"{source}:{label_of(answer)}", {"answered": 0, "agreed": 0})
+            stats["answered"] += 1
+            stats["agreed"] += int(label_of(row) == label_of(answer))
+    return agreement
+
+
+def score(rows: List[Dict], outputs: List[Optional[str]]) -> Dict:
+    """Accuracy per label and per class, and precision/recall of the cited regulations."""
+    answers = []
+    for output in outputs:
+        try:
+            answers.append(json.loads(output) if output else {})
+        except ValueError:
+            answers.append({})
+
+    quality: Dict = {"rows_scored": len(rows)}
+    for label in LABELS:
+        truth = [row[label] for row in rows]
+        predicted = [answer.get(label) for answer in answers]
+        correct = [t == p for t, p in zip(truth, predicted)]
+        quality[f"{label}_accuracy"] = round(sum(correct) / len(rows), 3) if rows else None
+        per_class = {}
+        for cls in sorted(set(truth) | {p for p in predicted if p}):
+            support = sum(1 for t in truth if t == cls)
+            predicted_count = sum(1 for p in predicted if p == cls)
+            hits = sum(1 for t, p in zip(truth, predicted) if t == p == cls)
+            per_class[cls] = {"support": support,
+                              "accuracy": round(hits / support, 3) if support else None,
+                              "precision": round(hits / predicted_count, 3) if predicted_count else None}
+        quality[f"{label}_per_class"] = per_class
+
+    cited = matched = recalled = labelled = 0
+    for row, answer in zip(rows, answers):
+        regulations = [str(name) for name in answer.get("supporting_regulations") or []]
+        cited += len(regulations)
+        matched += citations_matching(regulations, row["supporting_regulations"])
+        labelled += len(row["supporting_regulations"])
+        recalled += citations_matching(row["supporting_regulations"], regulations)
+    quality["fast_path"] = fast_path_agreement(rows, answers)
+    quality["citations"] = cited
+    quality["citation_precision"] = round(matched / cited, 3) if cited else None
+    quality["citation_recall"] = round(recalled / labelled, 3) if labelled else None
+    return quality
+
+
+def server_calls(urls: Sequence[str]) -> Dict:
+    totals: Counter = Counter()
+    for url in urls:
+        with urllib.request.urlopen(f"{url}/fake/stats") as response:
+            totals.update(json.loads(response.read())["calls"])
+    return dict(totals)
+
+
+def run_config(env: Dict[str, str], questions: List[str], concurrency: int) -> Dict:
+    """Runs in a fresh process: applies the overrides, loads the pipeline and answers every question."""
+    os.environ.update(env)
+    started = time.perf_counter()
+    from rag_pipeline import run_rag_pipeline
+    startup = time.perf_counter() - started
+    urls = [os.environ["OLLAMA_BASE_URL"], os.environ["OLLAMA_VERIFICATION_BASE_URL"]]
+
+    def run(question: str):
+        start = time.perf_counter()
+        try:
+            output = run_rag_pipeline(question, [], batched=True)
+        except Exception as e:
+            print(f"Row failed: {e}")
+            output = None
+        return time.perf_counter() - start, output
+
+    before = server_calls(urls)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, questions))
+    wall = time.perf_counter() - start
+    return {"startup_s": startup, "wall": wall, "latencies": [r[0] for r in results], "outputs": [r[1] for r in results],
+            "before": before, "after": server_calls(urls)}
+
+
+def evaluate_config(config: Dict, rows: List[Dict], concurrency: int, servers: List[FakeOllamaServer]) -> Dict:
+    # Same replay sequence for every configuration
+    for server in servers:
+        server.fake.reset()
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        run = executor.submit(run_config, config["env"], [row["question"] for row in rows], concurrency).result()
+
+    result = summarize(config["name"], run["latencies"], run["wall"], len(rows), run["outputs"], run["before"], run["after"])
+    calls = result["calls"]
+    result.update({
+        "env": config["env"],
+        "startup_s": round(run["startup_s"], 3),
+        "latency_mean_s": round(float(np.mean(run["latencies"])), 4) if rows else None,
+        "tokens_per_row": round((calls.get("prompt_tokens", 0) + calls.get("completion_tokens", 0)) / len(rows), 1) if rows else None,
+        "replay_misses": calls.get("replay:miss", 0) + calls.get("replay:embed_miss", 0),
+        **score(rows, run["outputs"]),
+    })
+    return result
+
+
+def pareto_front(results: List[Dict]) -> List[str]:
+    """Configurations no other one beats: at least as accurate and no more costly on every axis, and better on one."""
+    def vector(result):
+        return [result.get(QUALITY_METRIC) or 0.0] + [-(result.get(metric) or 0.0) for metric in COST_METRICS]
+
+    front = []
+    for result in results:
+        mine = vector(result)
+        dominated = any(all(o >= m for o, m in zip(other, mine)) and other != mine
+                        for other in (vector(r) for r in results if r is not result))
+        if not dominated:
+            front.append(result["mode"])
+    return front
+
+
+def sweep_configs(sweeps: List[str]) -> List[Dict]:
+    """The grid of every combination of `VAR=v1,v2,...` values."""
+    axes = []
+    for sweep in sweeps:
+        name, _, values = sweep.partition("=")
+        if not name or not values:
+            raise ValueError(f"Expected VAR=v1,v2,... but got {sweep!r}")
+        axes.append([(name.strip(), value.strip()) for value in values.split(",")])
+    return [{"name": " ".join(f"{k}={v}" for k, v in combination), "env": dict(combination)}
+            for combination in itertools.product(*axes)]
+
+
+def print_table(results: List[Dict], front: List[str]) -> None:
+    columns = [("config", "mode", 28), ("cs_acc", "compliance_status_accuracy", 7), ("ft_acc", "feature_type_accuracy", 7),
+               ("cite_p", "citation_precision", 7), ("cite_r", "citation_recall", 7), ("calls", "llm_calls_per_row", 7),
+               ("tokens", "tokens_per_row", 8), ("lat_s", "latency_mean_s", 7), ("p95_s", "latency_p95_s", 7),
+               ("misses", "replay_misses", 7)]
+    print("\n" + " ".join(f"{title:<{width}}" for title, _, width in columns) + " pareto")
+    for result in sorted(results, key=lambda r: r.get("latency_mean_s") or 0):
+        cells = [str(result.get(key) if result.get(key) is not None else "-")[:width] for _, key, width in columns]
+        print(" ".join(f"{cell:<{width}}" for cell, (_, _, width) in zip(cells, columns)) + (" *" if result["mode"] in front else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare accuracy and cost of pipeline configurations on a labelled sheet.")
+    parser.add_argument("--sheet", default=DEFAULT_SHEET, help="Labelled sheet (xlsx, csv or ndjson)")
+    parser.add_argument("--rows", type=int, default=0, help="Only evaluate the first N rows; 0 uses them all")
+    parser.add_argument("--configs", default=None, help='JSON file with a list of {"name": ..., "env": {VAR: value}}')
+    parser.add_argument("--sweep", action="append", default=[], help="VAR=v1,v2,... (repeatable; the grid of all combinations is run)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Rows in flight per configuration (and BULK_MAX_CONCURRENCY)")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Per-endpoint in-flight limit")
+    parser.add_argument("--label", default="", help="Appended to the report file name")
+    parser.add_argument("--no-save", action="store_true")
+    for name, default in asdict(FakeOllamaConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    # Read by prepare_environment; configurations override BULK_BATCH_SIZE themselves
+    parser.set_defaults(batch_size=1, result_cache=False)
+    args = parser.parse_args()
+
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    elif args.sweep:
+        configs = sweep_configs(args.sweep)
+    else:
+        configs = DEFAULT_CONFIGS
+    if not any(not config["env"] for config in configs):
+        configs = [{"name": "baseline", "env": {}}] + configs
+
+    sheet = os.path.abspath(args.sheet)
+    fake_config = FakeOllamaConfig(**{name: getattr(args, name) for name in asdict(FakeOllamaConfig())})
+    if fake_config.replay:
+        fake_config.replay = os.path.abspath(fake_config.replay)
+
+    with FakeOllamaServer(fake_config) as generation, FakeOllamaServer(fake_config) as verification:
+        prepare_environment(generation, verification, args)
+        rows = load_labelled_rows(sheet)
+        rows = rows[:args.rows] if args.rows else rows
+        if not rows:
+            raise SystemExit(f"No labelled rows in {sheet}")
+
+        results = []
+        for config in configs:
+            print(f"---EVALUATING {config['name']} ({len(rows)} rows)---")
+            try:
+                results.append(evaluate_config(config, rows, args.concurrency, [generation, verification]))
+            except Exception as e:
+                print(f"Configuration {config['name']} failed: {type(e).__name__}: {e}")
+                results.append({"mode": config["name"], "env": config["env"], "error": f"{type(e).__name__}: {e}"})
+
+    scored = [result for result in results if "error" not in result]
+    front = pareto_front(scored)
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sheet": sheet,
+        "args": {key: value for key, value in vars(args).items() if key not in ("no_save",)},
+        "pareto": front,
+        "results": results,
+    }
+    print(json.dumps({**report, "results": [{k: v for k, v in r.items() if k != "calls"} for r in results]}, indent=2))
+    print_table(scored, front)
+
+    if not args.no_save:
+        os.makedirs(EVAL_RESULTS_DIR, exist_ok=True)
+        name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{report['revision']}{'_' + args.label if args.label else ''}.json"
+        with open(os.path.join(EVAL_RESULTS_DIR, name), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {os.path.join(EVAL_RESULTS_DIR, name)}")
+
+
+if __name__ == "__main__":
+    main()
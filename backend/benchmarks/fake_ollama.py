@@ -0,0 +1,412 @@
+"""
+Deterministic stand-in for an Ollama server, for benchmarking the pipeline without GPUs.
+
+Implements the endpoints the backend uses (/api/chat, /api/embed, /api/embeddings,
+/api/version, /api/tags) with configurable latency, token rate and failure rates.
+Structured-output requests (a JSON schema in `format`) get a schema-valid answer; the
+compliance and hallucination-check schemas get plausible values derived from the prompt.
+Every response is a pure function of (seed, request, number of identical earlier requests),
+so sequential runs are reproducible while repeated samples of one prompt still differ.
+
+With `replay` set, requests recorded earlier are answered with the recorded response, and
+with `record_from` also set, unrecorded ones are forwarded to that live Ollama server and
+recorded (see benchmarks/replay.py). Requests with no recording fall back to the synthetic
+answers and are counted as `replay:miss`.
+
+Run standalone:
+    python -m benchmarks.fake_ollama --port 11434 --latency 0.2 --token-rate 50
+    python -m benchmarks.fake_ollama --replay recordings.sqlite --record-from http://gpu-host:11434
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from benchmarks.replay import ReplayStore, Upstream, request_key
+
+EMBEDDING_DIM = 256
+
+
+@dataclass
+class FakeOllamaConfig:
+    latency: float = 0.05 # Seconds before the first token (stands in for model load + prompt prefill)
+    token_rate: float = 200.0 # Generated tokens per second
+    embed_latency: float = 0.005 # Seconds per /api/embed request
+    not_supported_rate: float = 0.1 # Probability a hallucination check answers "Not Supported"
+    error_rate: float = 0.0 # Probability any chat request fails with HTTP 500
+    seed: int = 0
+    replay: str = "" # Recorded-response store (SQLite); recorded requests are answered from it
+    record_from: str = "" # Live Ollama URL; requests missing from `replay` are forwarded there and recorded
+
+
+def _rng(config: FakeOllamaConfig, *parts: Any) -> random.Random:
+    digest = hashlib.sha256(json.dumps([config.seed, *parts], sort_keys=True, default=str).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """Hashed bag-of-words vector, so texts sharing words land close together."""
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        h = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "big")
+        vector[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def synthesize(schema: Dict, rng: random.Random, defs: Optional[Dict] = None) -> Any:
+    """Produces a value that validates against a (pydantic-generated) JSON schema."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return synthesize(defs[schema["$ref"].split("/")[-1]], rng, defs)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if "const" in schema:
+        return schema["const"]
+    if "anyOf" in schema:
+        return synthesize(rng.choice(schema["anyOf"]), rng, defs)
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return {name: synthesize(prop, rng, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        count = max(schema.get("minItems", 1), 1)
+        return [synthesize(schema.get("items", {}), rng, defs) for _ in range(count)]
+    if kind == "number":
+        return round(rng.uniform(0.5, 1.0), 2)
+    if kind == "integer":
+        return rng.randint(0, 10)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return f"synthetic {schema.get('title', 'text').lower()} {rng.randint(0, 9999)}"
+
+
+def classify_feature(text: str) -> Dict:
+    """Keyword heuristic standing in for the generator model's judgement."""
+    lowered = text.lower()
+    regulations = []
+    for pattern, regulation in ((r"utah", "Utah Social Media Regulation Act"),
+                                (r"california|sb976", "California SB976"),
+                                (r"florida", "Florida Online Protections for Minors"),
+                                (r"ncmec|2258a|child sexual abuse", "18 U.S.C. 2258A"),
+                                (r"\beu\b|europe|dsa", "EU Digital Services Act")):
+        if re.search(pattern, lowered):
+            regulations.append(regulation)
+    if re.search(r"comply|compliance with|regulation|law|act\b|legal", lowered) and regulations:
+        return {"feature_type": "Legal Requirement", "compliance_status": "Compliance Logic Needed",
+                "supporting_regulations": regulations,
+                "reasoning": "The feature is introduced to meet jurisdiction-specific legal obligations."}
+    if re.search(r"market testing|a/b|experiment|engagement|performance|business", lowered):
+        return {"feature_type": "Business Driven", "compliance_status": "No Compliance Logic Needed",
+                "supporting_regulations": [],
+                "reasoning": "The geographic targeting is a business decision, not a regulatory one."}
+    return {"feature_type": "Unclassified", "compliance_status": "Requires Further Review",
+            "supporting_regulations": regulations,
+            "reasoning": "The intention behind the geo-specific behaviour is not stated."}
+
+
+class FakeOllama:
+    """Request handling and call accounting, independent of the HTTP layer."""
+
+    def __init__(self, config: FakeOllamaConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self._repeats = Counter()
+        if config.record_from and not config.replay:
+            raise ValueError("record_from needs a replay store to record into")
+        self.replay = ReplayStore(config.replay) if config.replay else None
+        self.upstream = Upstream(config.record_from) if config.record_from else None
+        self._embedding_dim = EMBEDDING_DIM
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.calls[key] += amount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self._repeats.clear()
+
+    def occurrence(self, key: str) -> int:
+        """How many times this exact request was seen before; stands in for sampling randomness."""
+        with self._lock:
+            self._repeats[key] += 1
+            return self._repeats[key] - 1
+
+    def chat_content(self, request: Dict) -> str:
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        schema = request.get("format")
+        key = json.dumps([request.get("model"), prompt, request.get("options", {}).get("temperature")])
+        occurrence = self.occurrence(key)
+        if self.replay is not None:
+            content = self.recorded_chat(request, request_key(key, schema), occurrence)
+            if content is not None:
+                self.count_recorded(schema, content)
+                return content
+        rng = _rng(self.config, key, occurrence)
+
+        if not isinstance(schema, dict):
+            self.count("chat:text")
+            # Echo the feature so later stages (which only see the rewrite) keep its signal
+            feature = re.split(r"---[A-Z ]+---", prompt.split("---FEATURE DESCRIPTION---")[-1])[0].strip()
+            bullets = [f"- {area}: the feature may be affected depending on the user's region."
+                       for area in rng.sample(["Age Verification", "Data Privacy", "Parental Consent",
+                                               "Content Moderation", "Data Retention"], 3)]
+            return "\n".join([f"- Feature summary: {feature[:400]}"] + bullets)
+
+        properties = schema.get("properties", {})
+        item_ref = properties.get("results", {}).get("items", {}).get("$ref")
+        if item_ref:
+            # Batched request: one block per item, answered in order
+            item_schema = {**schema.get("$defs", {})[item_ref.split("/")[-1]], "$defs": schema.get("$defs", {})}
+            blocks = re.split(r"---(?:FEATURE|ITEM) \d+---", prompt)[1:]
+            kind = "check" if "verdict" in item_schema.get("properties", {}) else "generate"
+            self.count(f"chat:{kind}_batch")
+            self.count(f"{kind}:batched_items", len(blocks))
+            return json.dumps({"results": [self.structured_value(item_schema, block, rng, counted=False) for block in blocks]})
+        return json.dumps(self.structured_value(schema, prompt, rng))
+
+    def recorded_chat(self, request: Dict, key: str, occurrence: int) -> Optional[str]:
+        """The recorded answer to a chat request, recording it first in record mode; None if there is none."""
+        if self.upstream is None:
+            content = self.replay.get("chat", key, occurrence)
+        else:
+            # Each repeat of a prompt is recorded as its own sample
+            content = self.replay.get("chat", key, occurrence, cycle=False)
+            if content is None:
+                content = self.upstream.chat(request)
+                self.replay.put("chat", key, occurrence, content)
+                self.count("replay:recorded")
+                return content
+        self.count("replay:hit" if content is not None else "replay:miss")
+        return content
+
+    def count_recorded(self, schema: Any, content: str) -> None:
+        """Counts a recorded answer under the same keys a synthesized one would use."""
+        if not isinstance(schema, dict):
+            self.count("chat:text")
+            return
+        try:
+            value = json.loads(content)
+        except ValueError:
+            self.count("chat:structured")
+            return
+        properties = schema.get("properties", {})
+        if "results" in properties:
+            items = [item for item in (value.get("results") or []) if isinstance(item, dict)]
+            kind = "check" if "verdict" in json.dumps(schema.get("$defs", {})) else "generate"
+            self.count(f"chat:{kind}_batch")
+            self.count(f"{kind}:batched_items", len(items))
+        elif "verdict" in properties:
+            self.count("chat:check")
+            items = [value]
+        else:
+            self.count("chat:generate" if "feature_type" in properties else "chat:structured")
+            return
+        for item in items:
+            if "verdict" in item:
+                self.count("check:supported" if item["verdict"] == "Supported" else "check:not_supported")
+
+    def embed(self, model: str, texts: List[str]) -> List[list]:
+        """Recorded vectors where there are any (recording missing ones in record mode), synthetic ones otherwise."""
+        if self.replay is None:
+            return [fake_embedding(text) for text in texts]
+        vectors = {}
+        for text in texts:
+            body = self.replay.get("embed", request_key(model, text))
+            if body is not None:
+                vectors[text] = json.loads(body)
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing and self.upstream is not None:
+            for text, vector in zip(missing, self.upstream.embed(model, missing)):
+                self.replay.put("embed", request_key(model, text), 0, json.dumps(vector))
+                vectors[text] = vector
+            self.count("replay:embed_recorded", len(missing))
+        elif missing:
+            self.count("replay:embed_miss", len(missing))
+        self.count("replay:embed_hit", len(texts) - len(missing))
+        if vectors:
+            # Synthetic stand-ins must match the recorded vectors' dimension to share an index
+            self._embedding_dim = len(next(iter(vectors.values())))
+        return [vectors[text] if text in vectors else fake_embedding(text, self._embedding_dim) for text in texts]
+
+    def structured_value(self, schema: Dict, prompt: str, rng: random.Random, counted: bool = True) -> Dict:
+        value = synthesize(schema, rng)
+        properties = schema.get("properties", {})
+        if "verdict" in properties:
+            if counted:
+                self.count("chat:check")
+            rejected = rng.random() < self.config.not_supported_rate
+            self.count("check:not_supported" if rejected else "check:supported")
+            value.update({"verdict": "Not Supported" if rejected else "Supported",
+                          "confidence": 0.3 if rejected else 0.9})
+        elif "feature_type" in properties:
+            if counted:
+                self.count("chat:generate")
+            value.update(classify_feature(prompt.split("---USER QUESTION---")[-1]))
+            # Vary the wording with the sampling seed and temperature like a real model would,
+            # so retried or parallel candidates get independent validator verdicts
+            value["reasoning"] += rng.choice(["", " This follows from the stated rollout scope.",
+                                              " The description names the affected region.",
+                                              " See the cited provisions for details."])
+            value["reasoning"] += f" [draft {rng.randint(0, 9999)}]"
+        elif counted:
+            self.count("chat:structured")
+        return value
+
+
+def make_handler(fake: FakeOllama):
+    config = fake.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload: Dict, status: int = 200) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> Dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/api/version":
+                self._send_json({"version": "0.0.0-fake"})
+            elif self.path == "/api/tags":
+                self._send_json({"models": []})
+            elif self.path == "/fake/stats":
+                self._send_json({"calls": fake.stats(), "config": asdict(config)})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            request = self._read_json()
+            if self.path == "/api/embed":
+                texts = request.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                fake.count("embed")
+                fake.count("embed:texts", len(texts))
+                time.sleep(config.embed_latency)
+                self._send_json({"model": request.get("model"), "embeddings": fake.embed(request.get("model"), texts)})
+            elif self.path == "/api/embeddings":
+                fake.count("embed")
+                time.sleep(config.embed_latency)
+                self._send_json({"embedding": fake.embed(request.get("model"), [request.get("prompt", "")])[0]})
+            elif self.path == "/api/chat":
+                self._chat(request)
+            elif self.path == "/fake/reset":
+                fake.reset()
+                self._send_json({"ok": True})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def _chat(self, request: Dict) -> None:
+            fake.count("chat")
+            fake.count(f"model:{request.get('model')}")
+            prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+            fake.count("prompt_tokens", prompt_tokens)
+            if _rng(config, "error", request).random() < config.error_rate:
+                fake.count("chat:error")
+                time.sleep(config.latency)
+                self._send_json({"error": "fake server error"}, 500)
+                return
+
+            try:
+                content = fake.chat_content(request)
+            except OSError as e:
+                # Record mode could not reach the live server
+                fake.count("chat:error")
+                self._send_json({"error": f"upstream: {e}"}, 502)
+                return
+            # Roughly four characters per token
+            tokens = [content[i:i + 4] for i in range(0, len(content), 4)] or [""]
+            fake.count("completion_tokens", len(tokens))
+            time.sleep(config.latency)
+
+            final = {"model": request.get("model"), "created_at": "1970-01-01T00:00:00Z",
+                     "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop",
+                     "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)}
+            if not request.get("stream", True):
+                time.sleep(len(tokens) / config.token_rate)
+                final["message"]["content"] = content
+                self._send_json(final)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # Flush in groups of tokens so high token rates are not dominated by sleep granularity
+            group = max(1, int(config.token_rate // 50))
+            for start in range(0, len(tokens), group):
+                time.sleep(len(tokens[start:start + group]) / config.token_rate)
+                self._write_chunk({"model": request.get("model"), "created_at": "1970-01-01T00:00:00Z",
+                                   "message": {"role": "assistant", "content": "".join(tokens[start:start + group])},
+                                   "done": False})
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, payload: Dict) -> None:
+            data = (json.dumps(payload) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+class FakeOllamaServer:
+    """Runs a FakeOllama on a background thread. Use port 0 to pick a free port."""
+
+    def __init__(self, config: FakeOllamaConfig, host: str = "127.0.0.1", port: int = 0):
+        self.fake = FakeOllama(config)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.fake))
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeOllamaServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    for name, default in asdict(FakeOllamaConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+    config = FakeOllamaConfig(**{name: getattr(args, name) for name in asdict(FakeOllamaConfig())})
+    with FakeOllamaServer(config, args.host, args.port) as server:
+        print(f"Fake Ollama listening on {server.url}")
+        server._thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Recall and speed of the VECTOR_INDEX_TYPE options against the exact flat index.
+
+Vectors come from the shard store of a built index (`--cache-dir`, e.g. cache/index after
+the backend has started once) or from a seeded synthetic corpus (`--synthetic N`) to see
+how the options behave at sizes beyond the bundled regulations. `--queries` vectors are
+held out of the index and used as queries; recall@k is the overlap of each index's top k
+with the exact top k. Every index is built with index_store.create_index and tuned with
+configure_search, so the numbers describe what the server would run.
+
+Run from the backend directory:
+    python -m benchmarks.index_benchmark --cache-dir cache/index
+    python -m benchmarks.index_benchmark --synthetic 200000 --dim 768 --types flat,hnsw,sq8,ivfpq
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from benchmarks.run_benchmark import RESULTS_DIR, git_revision
+from index_store import SHARDS_DIR, configure_search, create_index, index_factory_string
+
+# Kept apart from the pipeline reports so `run_benchmark --compare latest` never picks one up
+INDEX_RESULTS_DIR = os.path.join(RESULTS_DIR, "index")
+
+
+def load_shard_vectors(cache_dir: str) -> np.ndarray:
+    """Concatenates the embeddings of every complete shard under an index cache directory."""
+    blocks = []
+    for meta_path in sorted(glob.glob(os.path.join(cache_dir, SHARDS_DIR, "*", "meta.json"))):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["count"]:
+            vectors_path = os.path.join(os.path.dirname(meta_path), "vectors.f32")
+            blocks.append(np.fromfile(vectors_path, dtype="float32").reshape(meta["count"], meta["dim"]))
+    if not blocks:
+        raise SystemExit(f"No shards found under {cache_dir}; start the backend once or use --synthetic.")
+    return np.concatenate(blocks)
+
+
+def synthetic_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    """Clustered Gaussian vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(max(count // 100, 1), dim)).astype("float32")
+    assignments = rng.integers(len(centroids), size=count)
+    return centroids[assignments] + rng.normal(scale=0.3, size=(count, dim)).astype("float32")
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(row[row != -1]) & set(expected)) for row, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict:
+    # One query at a time, as HybridRetriever.dense_search issues them
+    latencies = []
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        found[i] = index.search(query[None, :], k)[1][0]
+        latencies.append(time.perf_counter() - start)
+    return {
+        "recall_at_k": round(recall_at_k(found, truth), 4),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "qps": round(len(queries) / sum(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector index types against the exact flat index.")
+    parser.add_argument("--cache-dir", default=os.path.join("cache", "index"), help="Index cache to read shard vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use this many synthetic vectors instead of the cache")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--types", default="flat,hnsw,sq8,ivfpq", help="Comma-separated VECTOR_INDEX_TYPE values")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as queries")
+    parser.add_argument("--k", type=int, default=20, help="Neighbours compared (RETRIEVAL_FETCH_K)")
+    parser.add_argument("--nprobe", default="1,4,16,64", help="VECTOR_INDEX_NPROBE values tried on IVF indexes")
+    parser.add_argument("--ef-search", default="16,64,256", help="VECTOR_INDEX_EF_SEARCH values tried on HNSW indexes")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--label", default="", help="Appended to the report file name")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic, args.dim, args.seed) if args.synthetic else load_shard_vectors(args.cache_dir)
+    rng = np.random.default_rng(args.seed)
+    held_out = rng.permutation(len(vectors))
+    n_queries = min(args.queries, len(vectors) // 10 or 1)
+    queries = np.ascontiguousarray(vectors[held_out[:n_queries]])
+    base = np.ascontiguousarray(vectors[held_out[n_queries:]])
+    k = min(args.k, len(base))
+    print(f"---{len(base)} VECTORS x {base.shape[1]} DIMS, {n_queries} QUERIES, k={k}---")
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, k)
+
+    results: List[Dict] = []
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        start = time.perf_counter()
+        index = create_index(index_type, base)
+        build_s = time.perf_counter() - start
+        built = type(faiss.downcast_index(index)).__name__
+        sweep = [(None, None)]
+        if faiss.try_extract_index_ivf(index) is not None:
+            sweep = [(int(n), None) for n in args.nprobe.split(",")]
+        elif hasattr(faiss.downcast_index(index), "hnsw"):
+            sweep = [(None, int(ef)) for ef in args.ef_search.split(",")]
+        for nprobe, ef_search in sweep:
+            configure_search(index, nprobe or 1, ef_search or 16)
+            result = {
+                "index_type": index_type,
+                "factory": index_factory_string(index_type, len(base), base.shape[1]),
+                "built": built,
+                "nprobe": nprobe,
+                "ef_search": ef_search,
+                "build_s": round(build_s, 3),
+                "index_mb": round(faiss.serialize_index(index).nbytes / 2**20, 2),
+                **measure(index, queries, truth, k),
+            }
+            results.append(result)
+            knob = f"nprobe={nprobe}" if nprobe else f"efSearch={ef_search}" if ef_search else ""
+            print(f"  {index_type:<8} {knob:<13} recall@{k}={result['recall_at_k']:<7} p50={result['latency_p50_ms']}ms "
+                  f"p95={result['latency_p95_ms']}ms qps={result['qps']:<9} size={result['index_mb']}MB build={result['build_s']}s")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "vectors": len(base),
+        "dim": int(base.shape[1]),
+        "queries": n_queries,
+        "k": k,
+        "args": {key: value for key, value in vars(args).items() if key != "no_save"},
+        "results": results,
+    }
+    if not args.no_save:
+        os.makedirs(INDEX_RESULTS_DIR, exist_ok=True)
+        name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{report['revision']}{'_' + args.label if args.label else ''}.json"
+        with open(os.path.join(INDEX_RESULTS_DIR, name), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {os.path.join(INDEX_RESULTS_DIR, name)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Recorded model responses for offline runs.
+
+A FakeOllama with a ReplayStore answers chat and embedding requests that were recorded
+earlier instead of synthesizing them. In record mode it forwards requests it has no
+recording for to a live Ollama server and stores the answers, so a run against a real
+model can be repeated later (with any number of configurations) without one.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+
+def request_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ReplayStore:
+    """
+    Responses keyed by (kind, request key, occurrence). The same request sent several times
+    (e.g. repeated samples of one prompt) is answered with its recordings in order, cycling
+    if it is sent more often than it was recorded.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                occurrence INTEGER NOT NULL,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (kind, key, occurrence)
+            )
+        """)
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, key: str, occurrence: int = 0, cycle: bool = True) -> Optional[str]:
+        """The recording for this occurrence of the request; with `cycle`, any of its recordings if there are fewer."""
+        with self._lock:
+            if not cycle:
+                row = self._conn.execute("SELECT body FROM responses WHERE kind = ? AND key = ? AND occurrence = ?",
+                                         (kind, key, occurrence)).fetchone()
+                return row[0] if row else None
+            count = self._conn.execute("SELECT COUNT(*) FROM responses WHERE kind = ? AND key = ?", (kind, key)).fetchone()[0]
+            if not count:
+                return None
+            row = self._conn.execute("SELECT body FROM responses WHERE kind = ? AND key = ? ORDER BY occurrence LIMIT 1 OFFSET ?",
+                                     (kind, key, occurrence % count)).fetchone()
+        return row[0]
+
+    def put(self, kind: str, key: str, occurrence: int, body: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (kind, key, occurrence, body, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (kind, key, occurrence, body, time.time()))
+
+    def size(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT kind, COUNT(*) FROM responses GROUP BY kind").fetchall())
+
+
+class Upstream:
+    """Minimal client for the live Ollama server that recordings are taken from."""
+
+    def __init__(self, base_url: str, timeout: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path: str, payload: Dict) -> Dict:
+        request = urllib.request.Request(self.base_url + path, data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def chat(self, request: Dict) -> str:
+        return self._post("/api/chat", {**request, "stream": False})["message"]["content"]
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        return self._post("/api/embed", {"model": model, "input": texts})["embeddings"]
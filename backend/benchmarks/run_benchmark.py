@@ -0,0 +1,319 @@
+"""
+End-to-end benchmark of the compliance pipeline against fake Ollama servers.
+
+Starts two FakeOllamaServers (generation and verification), points the backend at them
+through the OLLAMA_* environment variables, and drives run_rag_pipeline, /ask and /excel
+with a synthetic feature spreadsheet. Reports latency percentiles, throughput, LLM calls
+per row and retry rates, and stores the report under benchmarks/results/ so runs from
+different commits can be compared.
+
+Run from the backend directory:
+    python -m benchmarks.run_benchmark --rows 200 --concurrency 8 --latency 0.3 --token-rate 60
+    python -m benchmarks.run_benchmark --compare latest
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+DEFAULT_SEED_SHEET = os.path.join(os.path.dirname(BACKEND_DIR), "sample_data.xlsx")
+COMPARED_METRICS = ["latency_p50_s", "latency_p95_s", "latency_p99_s", "rows_per_min", "llm_calls_per_row",
+                    "retry_rate", "no_solution_rate", "fast_path_rate"]
+
+JURISDICTIONS = ["Utah", "California", "Florida", "the EU", "the US", "Canada", "Japan"]
+INTENTS = [
+    "to comply with local regulations for minors",
+    "for market testing",
+    "to improve engagement",
+    "as required by law",
+    "",
+]
+
+
+def make_feature_sheet(rows: int, seed: int, seed_sheet: str = DEFAULT_SEED_SHEET, duplicate_rate: float = 0.0) -> pd.DataFrame:
+    """
+    Builds a synthetic feature spreadsheet with the same columns as sample_data.xlsx by
+    varying rows of a seed sheet (region and stated intent). `duplicate_rate` of the rows
+    repeat an earlier row verbatim, as happens in real PRD exports.
+    """
+    rng = np.random.default_rng(seed)
+    base = pd.read_excel(seed_sheet)[["feature_name", "feature_description"]].fillna("")
+    records: List[Dict] = []
+    for i in range(rows):
+        if records and rng.random() < duplicate_rate:
+            records.append(dict(records[int(rng.integers(len(records)))]))
+            continue
+        row = base.iloc[int(rng.integers(len(base)))]
+        region = JURISDICTIONS[int(rng.integers(len(JURISDICTIONS)))]
+        intent = INTENTS[int(rng.integers(len(INTENTS)))]
+        records.append({
+            "feature_name": f"{row['feature_name']} ({region})",
+            "feature_description": f"{row['feature_description']} Rollout is limited to {region} {intent}.".replace(" .", "."),
+        })
+    return pd.DataFrame(records)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 4) if values else None
+
+
+def summarize(name: str, latencies: List[float], wall: float, rows: int, outputs: List[Optional[str]],
+              calls_before: Dict, calls_after: Dict) -> Dict:
+    calls = {key: calls_after.get(key, 0) - calls_before.get(key, 0) for key in set(calls_after) | set(calls_before)}
+    # Rows answered inside a batched call count as one generation each
+    generations = calls.get("chat:generate", 0) + calls.get("generate:batched_items", 0)
+    no_solution = sum(1 for output in outputs if output and "Unable to provide a verified compliance status" in output)
+    fast_path = sum(1 for output in outputs if output and "Fast path (" in output)
+    graph_rows = rows - fast_path
+    return {
+        "mode": name,
+        "rows": rows,
+        "errors": sum(1 for output in outputs if output is None),
+        "wall_s": round(wall, 3),
+        "rows_per_min": round(rows / wall * 60, 2) if wall else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "llm_calls_per_row": round(calls.get("chat", 0) / rows, 3) if rows else None,
+        "embed_calls_per_row": round(calls.get("embed", 0) / rows, 3) if rows else None,
+        # Every generation beyond the first for a row is a retry; fast-path rows never generate
+        "retry_rate": round(max(generations - graph_rows, 0) / graph_rows, 3) if graph_rows else None,
+        "no_solution_rate": round(no_solution / rows, 3) if rows else None,
+        "fast_path_rate": round(fast_path / rows, 3) if rows else None,
+        "prompt_tokens_per_row": round(calls.get("prompt_tokens", 0) / rows, 1) if rows else None,
+        "completion_tokens_per_row": round(calls.get("completion_tokens", 0) / rows, 1) if rows else None,
+        "calls": calls,
+    }
+
+
+def merged_calls(servers: List[FakeOllamaServer]) -> Dict:
+    totals: Dict[str, int] = {}
+    for server in servers:
+        for key, value in server.fake.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def bench_pipeline(df: pd.DataFrame, concurrency: int, servers: List[FakeOllamaServer], batched: bool = False) -> Dict:
+    from rag_pipeline import run_rag_pipeline
+    from bulk_engine import row_to_question
+
+    questions = [row_to_question(row) for _, row in df.iterrows()]
+
+    def run(question: str):
+        start = time.perf_counter()
+        try:
+            output = run_rag_pipeline(question, [], batched=batched)
+        except Exception as e:
+            print(f"Row failed: {e}")
+            output = None
+        return time.perf_counter() - start, output
+
+    before = merged_calls(servers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, questions))
+    wall = time.perf_counter() - start
+    outputs = [r[1] for r in results]
+    summary = summarize("batched" if batched else "pipeline", [r[0] for r in results], wall, len(questions), outputs,
+                        before, merged_calls(servers))
+    # Kept out of the report; main() compares the rows of the batched and single-row runs
+    summary["outputs"] = outputs
+    return summary
+
+
+def row_agreement(reference: List[Optional[str]], outputs: List[Optional[str]]) -> Dict:
+    """How often two runs over the same rows reached the same feature type and compliance status."""
+    def label(output: Optional[str]):
+        answer = json.loads(output) if output else {}
+        return answer.get("feature_type"), answer.get("compliance_status")
+
+    pairs = [(label(a), label(b)) for a, b in zip(reference, outputs) if a and b]
+    same = sum(1 for a, b in pairs if a == b)
+    return {"rows_compared": len(pairs), "agreement": round(same / len(pairs), 3) if pairs else None,
+            "feature_type_agreement": round(sum(1 for a, b in pairs if a[0] == b[0]) / len(pairs), 3) if pairs else None}
+
+
+def bench_ask(df: pd.DataFrame, concurrency: int, servers: List[FakeOllamaServer]) -> Dict:
+    from fastapi.testclient import TestClient
+    from api.main import app
+    from bulk_engine import row_to_question
+
+    questions = [row_to_question(row) for _, row in df.iterrows()]
+    with TestClient(app) as client:
+        def run(question: str):
+            start = time.perf_counter()
+            response = client.post("/ask", json={"question": question, "memory": []})
+            answer = response.json().get("answer") if response.status_code == 200 and isinstance(response.json(), dict) else None
+            return time.perf_counter() - start, answer
+
+        before = merged_calls(servers)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(run, questions))
+        wall = time.perf_counter() - start
+    return summarize("ask", [r[0] for r in results], wall, len(questions), [r[1] for r in results],
+                     before, merged_calls(servers))
+
+
+def bench_excel(df: pd.DataFrame, servers: List[FakeOllamaServer]) -> Dict:
+    from fastapi.testclient import TestClient
+    from api.main import app
+
+    upload = BytesIO()
+    df.to_excel(upload, index=False)
+    with TestClient(app) as client:
+        before = merged_calls(servers)
+        start = time.perf_counter()
+        response = client.post(
+            "/excel",
+            files={"file": ("bench.xlsx", upload.getvalue(),
+                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")},
+            data={"memory": "[]"},
+        )
+        wall = time.perf_counter() - start
+    response.raise_for_status()
+    processed = pd.read_excel(BytesIO(response.content))
+    outputs = [row.to_json() if pd.notna(row.get("feature_type")) else None for _, row in processed.iterrows()]
+    # A single request: the only latency sample is the whole upload
+    return summarize("excel", [wall], wall, len(df.index), outputs, before, merged_calls(servers))
+
+
+def git_revision() -> str:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet"], cwd=BACKEND_DIR) != 0
+        return f"{sha}{'-dirty' if dirty else ''}"
+    except Exception:
+        return "unknown"
+
+
+def previous_report(path: str) -> Optional[str]:
+    if path != "latest":
+        return path
+    reports = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+    return reports[-1] if reports else None
+
+
+def compare(report: Dict, baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison with {os.path.basename(baseline_path)} ({baseline.get('revision')}):")
+    baseline_modes = {result["mode"]: result for result in baseline["results"]}
+    for result in report["results"]:
+        old = baseline_modes.get(result["mode"])
+        if old is None:
+            continue
+        print(f"  [{result['mode']}]")
+        for metric in COMPARED_METRICS:
+            new_value, old_value = result.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else "n/a"
+            print(f"    {metric:<20} {old_value:>10} -> {new_value:<10} ({change})")
+
+
+def prepare_environment(generation: FakeOllamaServer, verification: FakeOllamaServer, args) -> str:
+    """Points the backend at the fake servers and isolates its caches and logs in a temp dir."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    for name in ("regulations", "terminologies"):
+        os.symlink(os.path.join(BACKEND_DIR, name), os.path.join(workdir, name))
+    os.environ.update({
+        "OLLAMA_BASE_URL": generation.url,
+        "OLLAMA_VERIFICATION_BASE_URL": verification.url,
+        "OLLAMA_MAX_IN_FLIGHT": str(args.max_in_flight),
+        "OLLAMA_VERIFICATION_MAX_IN_FLIGHT": str(args.max_in_flight),
+        "BULK_MAX_CONCURRENCY": str(args.concurrency),
+        "BULK_BATCH_SIZE": str(args.batch_size),
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "RESULT_CACHE_ENABLED": "1" if args.result_cache else "0",
+    })
+    # The backend resolves document paths and app.log relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a fake Ollama server.")
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--modes", default="pipeline,ask,excel", help="Comma-separated: pipeline, batched, ask, excel")
+    parser.add_argument("--batch-size", type=int, default=1, help="BULK_BATCH_SIZE for the batched and excel modes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Rows in flight for pipeline/ask (and BULK_MAX_CONCURRENCY)")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Per-endpoint in-flight limit")
+    parser.add_argument("--seed-sheet", default=DEFAULT_SEED_SHEET)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--result-cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--label", default="", help="Appended to the report file name")
+    parser.add_argument("--compare", default=None, help="Baseline report path, or 'latest'")
+    parser.add_argument("--no-save", action="store_true")
+    for name, default in asdict(FakeOllamaConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    baseline = previous_report(args.compare) if args.compare else None
+    config = FakeOllamaConfig(**{name: getattr(args, name) for name in asdict(FakeOllamaConfig())})
+    df = make_feature_sheet(args.rows, config.seed, args.seed_sheet, args.duplicate_rate)
+
+    with FakeOllamaServer(config) as generation, FakeOllamaServer(config) as verification:
+        prepare_environment(generation, verification, args)
+        servers = [generation, verification]
+
+        startup = time.perf_counter()
+        import rag_pipeline  # noqa: F401 -- builds the index against the fake embedding server
+        startup = time.perf_counter() - startup
+
+        results = []
+        outputs = {}
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            print(f"---BENCHMARKING {mode.upper()} ({args.rows} rows)---")
+            if mode in ("pipeline", "batched"):
+                results.append(bench_pipeline(df, args.concurrency, servers, batched=mode == "batched"))
+                outputs[mode] = results[-1].pop("outputs")
+            elif mode == "ask":
+                results.append(bench_ask(df, args.concurrency, servers))
+            elif mode == "excel":
+                results.append(bench_excel(df, servers))
+            else:
+                parser.error(f"Unknown mode: {mode}")
+        if "pipeline" in outputs and "batched" in outputs:
+            # Per-row check that batching does not change the answers
+            next(r for r in results if r["mode"] == "batched")["vs_pipeline"] = row_agreement(outputs["pipeline"], outputs["batched"])
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "startup_s": round(startup, 3),
+        "args": {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")},
+        "results": results,
+    }
+    print(json.dumps({**report, "results": [{k: v for k, v in r.items() if k != "calls"} for r in results]}, indent=2))
+
+    if baseline:
+        compare(report, baseline)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{report['revision']}{'_' + args.label if args.label else ''}.json"
+        with open(os.path.join(RESULTS_DIR, name), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {os.path.join(RESULTS_DIR, name)}")
+
+
+if __name__ == "__main__":
+    main()
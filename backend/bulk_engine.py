@@ -0,0 +1,138 @@
+import asyncio
+import contextvars
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import AsyncIterator, Awaitable, Callable, Deque, Iterator, List, Mapping, Optional, Tuple
+
+import pandas as pd
+from rag_pipeline import run_rag_pipeline, BULK_MAX_CONCURRENCY, BULK_STREAM_WINDOW
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+file_handler = logging.FileHandler('app.log', mode='a')
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+# (result, error) for a single row; exactly one of the two is set.
+RowOutcome = Tuple[Optional[dict], Optional[str]]
+
+# Shared by every bulk request so concurrent uploads still respect BULK_MAX_CONCURRENCY.
+# The per-endpoint limits inside rag_pipeline cap what actually reaches each Ollama server.
+_bulk_executor = ThreadPoolExecutor(max_workers=BULK_MAX_CONCURRENCY, thread_name_prefix="bulk-row")
+
+
+def row_to_question(row: Mapping) -> str:
+    """Builds the pipeline input for a spreadsheet row (feature name followed by description)."""
+    feature_name = str(row.get("feature_name", "")) if pd.notna(row.get("feature_name")) else ""
+    feature_description = str(row.get("feature_description", "")) if pd.notna(row.get("feature_description")) else ""
+    return feature_name + feature_description
+
+
+def _process_row(row: Mapping, memory: list) -> dict:
+    # Concurrent rows share generate/check calls when BULK_BATCH_SIZE > 1
+    return json.loads(run_rag_pipeline(row_to_question(row), memory, batched=True))
+
+
+async def _run_row(index, row: Mapping, memory: list) -> RowOutcome:
+    try:
+        # Run in a copy of the caller's context so row traces carry the request id
+        return (await asyncio.get_running_loop().run_in_executor(
+            _bulk_executor, contextvars.copy_context().run, _process_row, row, memory), None)
+    except Exception as e:
+        logger.error(f"Error processing row {index}: {str(e)}")
+        return None, str(e)
+
+
+async def run_bulk(df: pd.DataFrame, memory: list,
+                   on_result: Optional[Callable[[int, RowOutcome], Awaitable[None]]] = None) -> List[RowOutcome]:
+    """
+    Runs the RAG pipeline over every row of the DataFrame concurrently, without blocking
+    the event loop. Outcomes are returned in row order regardless of completion order.
+    `on_result(position, outcome)` is awaited as each row finishes.
+    """
+    outcomes: List[Optional[RowOutcome]] = [None] * len(df.index)
+
+    async def process(position: int, index, row: pd.Series) -> None:
+        outcome = await _run_row(index, row, memory)
+        outcomes[position] = outcome
+        if on_result is not None:
+            await on_result(position, outcome)
+
+    await asyncio.gather(*(process(position, index, row)
+                           for position, (index, row) in enumerate(df.iterrows())))
+    return outcomes
+
+
+async def stream_bulk(rows: Iterator[Mapping], memory: list,
+                      window: int = BULK_STREAM_WINDOW) -> AsyncIterator[Tuple[int, Mapping, RowOutcome]]:
+    """
+    Runs the RAG pipeline over rows pulled lazily from `rows` and yields
+    (position, row, outcome) in input order as soon as a row and every row before it
+    have finished. At most `window` rows are read ahead of the oldest unfinished one,
+    which bounds both the reorder buffer and memory regardless of the input size.
+    """
+    pending: Deque[Tuple[int, Mapping, asyncio.Task]] = deque()
+    position = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                # Parsing the next row (e.g. workbook XML) stays off the event loop
+                row = await asyncio.to_thread(next, rows, None)
+                if row is None:
+                    exhausted = True
+                    break
+                pending.append((position, row, asyncio.create_task(_run_row(position, row, memory))))
+                position += 1
+            if not pending:
+                return
+            head_position, row, task = pending.popleft()
+            yield head_position, row, await task
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+
+
+def build_processed_workbook(df: pd.DataFrame, outcomes: List[RowOutcome]) -> Tuple[BytesIO, int]:
+    """
+    Appends the pipeline results to the original sheet and writes the processed workbook,
+    with an 'Errors' sheet listing failed rows. Returns the workbook and the error count.
+    """
+    results = [result for result, error in outcomes if error is None]
+    errors_idx = [index for index, (result, error) in zip(df.index, outcomes) if error is not None]
+    errors = [error for result, error in outcomes if error is not None]
+
+    # If any rows were processed successfully, create a DataFrame from the results
+    if results:
+        results_df = pd.DataFrame(results)
+        # Ensure columns are aligned if the pipeline output varies
+        results_df = results_df.reindex(columns=list(results[0].keys()))
+        # Line results up with the rows they came from so failed rows stay blank
+        results_df.index = [index for index, (result, error) in zip(df.index, outcomes) if error is None]
+
+        # Concatenate the original DataFrame with the results DataFrame
+        processed_df = pd.concat([df, results_df], axis=1)
+    else:
+        # If no results, return the original DataFrame with a message
+        processed_df = df
+        logger.warning("No rows were successfully processed.")
+
+    for column in processed_df.columns:
+        if processed_df[column].apply(lambda x: isinstance(x, list)).any():
+            logger.info(f"Converting list data in column '{column}' to string format.")
+            processed_df[column] = processed_df[column].apply(lambda x: "\n".join(x) if isinstance(x, list) else x)
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        processed_df.to_excel(writer, index=False, sheet_name='Processed_Data')
+        # Add a second sheet for errors if any occurred
+        if errors:
+            error_df = pd.DataFrame({"row_index": errors_idx, "error_message": errors})
+            error_df.to_excel(writer, index=False, sheet_name='Errors')
+
+    output.seek(0)
+    return output, len(errors)
@@ -0,0 +1,177 @@
+import abc
+import csv
+import io
+import json
+import os
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+import xlsxwriter
+from openpyxl import load_workbook
+
+# Upload and download formats for /excel, keyed by file extension
+FORMATS = {".xlsx": "xlsx", ".xls": "xls", ".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+CONTENT_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+OUTPUT_EXTENSIONS = {"xlsx": ".xlsx", "csv": ".csv", "ndjson": ".ndjson"}
+
+Row = Dict[str, Any]
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """Input format from the upload's file name, or None if it is not supported."""
+    return FORMATS.get(os.path.splitext(filename or "")[1].lower())
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip()) or (isinstance(value, float) and pd.isna(value))
+
+
+def iter_rows(source: IO[bytes], fmt: str) -> Iterator[Row]:
+    """
+    Yields the rows of an upload as {column: value} dicts, one at a time. Workbooks are
+    read with openpyxl in read-only mode and CSV/NDJSON line by line, so memory does not
+    grow with the sheet. Entirely blank rows are skipped.
+    """
+    if fmt == "xlsx":
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            values = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(next(values, ()))]
+            for row in values:
+                record = dict(zip(header, row))
+                if not all(_is_blank(value) for value in record.values()):
+                    yield record
+        finally:
+            workbook.close()
+    elif fmt == "csv":
+        for record in csv.DictReader(io.TextIOWrapper(source, encoding="utf-8-sig", newline="")):
+            if not all(_is_blank(value) for value in record.values()):
+                yield record
+    elif fmt == "ndjson":
+        for line in io.TextIOWrapper(source, encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "xls":
+        # Legacy workbooks have no streaming reader; they are small by construction (65k rows)
+        for record in pd.read_excel(source).to_dict(orient="records"):
+            if not all(_is_blank(value) for value in record.values()):
+                yield record
+    else:
+        raise ValueError(f"Unsupported input format: {fmt}")
+
+
+def _cell(value: Any) -> Any:
+    """Flattens pipeline output for a single cell: lists become one item per line."""
+    if isinstance(value, list):
+        return "\n".join(str(item) for item in value)
+    if value is not None and isinstance(value, float) and pd.isna(value):
+        return None
+    return value
+
+
+class RowWriter(abc.ABC):
+    """
+    Writes processed rows in order: the input columns, the pipeline result columns and,
+    for failed rows, the error. `write` returns any bytes that are ready to be sent.
+    """
+
+    def __init__(self, input_columns: List[str], result_columns: List[str]):
+        self.input_columns = input_columns
+        self.result_columns = result_columns
+        self.errors = 0
+
+    def header(self) -> bytes:
+        return b""
+
+    @abc.abstractmethod
+    def write(self, position: int, row: Row, result: Optional[dict], error: Optional[str]) -> bytes:
+        """Adds one row and returns the bytes that can be sent now."""
+
+    def close(self) -> None:
+        pass
+
+    def values(self, row: Row, result: Optional[dict]) -> List[Any]:
+        result = result or {}
+        return ([_cell(row.get(column)) for column in self.input_columns]
+                + [_cell(result.get(column)) for column in self.result_columns])
+
+
+class CsvRowWriter(RowWriter):
+    """CSV with an `error_message` column; each row is sent as soon as it is written."""
+
+    def header(self) -> bytes:
+        return self._line(self.input_columns + self.result_columns + ["error_message"])
+
+    def write(self, position, row, result, error) -> bytes:
+        self.errors += error is not None
+        return self._line(self.values(row, result) + [error or ""])
+
+    @staticmethod
+    def _line(values: List[Any]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(["" if value is None else value for value in values])
+        return buffer.getvalue().encode("utf-8")
+
+
+class NdjsonRowWriter(RowWriter):
+    """
+    One JSON object per row: {"input": {input fields}, "result": {result fields}, "error": ...}.
+    Input and result fields are kept apart, so an input column named like a result column
+    (e.g. a labelled `compliance_status`) keeps its value, as in the CSV and xlsx output.
+    Result fields are null for failed rows.
+    """
+
+    def write(self, position, row, result, error) -> bytes:
+        self.errors += error is not None
+        record = {
+            "input": {column: _cell(value) for column, value in row.items()},
+            "result": {column: _cell((result or {}).get(column)) for column in self.result_columns},
+            "error": error,
+        }
+        return (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class XlsxRowWriter(RowWriter):
+    """
+    The layout of build_processed_workbook ('Processed_Data' plus an 'Errors' sheet), written with
+    xlsxwriter in constant-memory mode: every row is flushed to a temp file as soon as it
+    is written. The workbook can only be sent once it is closed.
+    """
+
+    def __init__(self, input_columns: List[str], result_columns: List[str], path: str):
+        super().__init__(input_columns, result_columns)
+        self.path = path
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False,
+                                                   "strings_to_formulas": False, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+        self.sheet = self.workbook.add_worksheet("Processed_Data")
+        self.sheet.write_row(0, 0, input_columns + result_columns)
+        self.rows = 0
+        self.error_sheet = None
+
+    def write(self, position, row, result, error) -> bytes:
+        self.rows += 1
+        self.sheet.write_row(self.rows, 0, self.values(row, result))
+        if error is not None:
+            if self.error_sheet is None:
+                self.error_sheet = self.workbook.add_worksheet("Errors")
+                self.error_sheet.write_row(0, 0, ["row_index", "error_message"])
+            self.errors += 1
+            self.error_sheet.write_row(self.errors, 0, [position, error])
+        return b""
+
+    def close(self) -> None:
+        self.workbook.close()
+
+
+def create_writer(fmt: str, input_columns: List[str], result_columns: List[str], path: Optional[str] = None) -> RowWriter:
+    if fmt == "xlsx":
+        return XlsxRowWriter(input_columns, result_columns, path)
+    if fmt == "csv":
+        return CsvRowWriter(input_columns, result_columns)
+    if fmt == "ndjson":
+        return NdjsonRowWriter(input_columns, result_columns)
+    raise ValueError(f"Unsupported output format: {fmt}")
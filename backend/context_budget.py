@@ -0,0 +1,188 @@
+import math
+import re
+from collections import Counter
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from retrieval import tokenize
+
+# Sentence ends, clause breaks used in statutes ("; and"), and line breaks between list items
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;])\s+|\n+")
+BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+MIN_OVERLAP_CHARS = 20 # Shorter shared runs between chunks are treated as coincidence, not splitter overlap
+GAP_MARKER = " ... "
+
+
+def count_tokens(text: str) -> int:
+    """Estimated token count (about four characters per token for English text)."""
+    return len(text) // 4
+
+
+def _strip_overlap(previous: str, current: str, max_overlap: int) -> str:
+    """Drops the start of `current` that repeats the end of `previous`, as the text splitter's overlap does."""
+    for size in range(min(len(previous), len(current), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:].lstrip()
+    return current
+
+
+def dedupe_chunks(documents: Sequence[Document], max_overlap: int) -> List[str]:
+    """
+    Chunk texts in retrieval order without repeated text: exact and contained duplicates are
+    dropped, and when two chunks of the same source are neighbours, the overlap they share is
+    kept only once.
+    """
+    kept: List[Tuple[str, str]] = []
+    for doc in documents:
+        text = doc.page_content.strip()
+        source = str(doc.metadata.get("source", ""))
+        if not text or any(text in other for _, other in kept):
+            continue
+        for i, (other_source, other) in enumerate(kept):
+            if other_source != source:
+                continue
+            text = _strip_overlap(other, text, max_overlap)
+            # The earlier chunk may instead start with this chunk's tail
+            trimmed = _strip_overlap(text, other, max_overlap)
+            if trimmed != other:
+                kept[i] = (other_source, trimmed)
+        if text:
+            kept.append((source, text))
+    return [text for _, text in kept if text]
+
+
+def split_concerns(question: str) -> List[str]:
+    """The rewritten question is a bulleted list of concerns; each bullet is one query."""
+    concerns = [BULLET.sub("", line).strip() for line in question.splitlines()]
+    return [concern for concern in concerns if concern] or [question]
+
+
+def _sentences(chunks: Sequence[str]) -> List[Tuple[int, int, str, set]]:
+    """(chunk index, sentence index, sentence, terms) for each distinct sentence, in document order."""
+    sentences = []
+    seen = set()
+    for chunk_idx, chunk in enumerate(chunks):
+        for sentence_idx, sentence in enumerate(s.strip() for s in SENTENCE_BOUNDARY.split(chunk)):
+            key = " ".join(sentence.lower().split())
+            if sentence and key not in seen:
+                seen.add(key)
+                sentences.append((chunk_idx, sentence_idx, sentence, set(tokenize(sentence))))
+    return sentences
+
+
+def _pick(sentences: Sequence[Tuple], concerns: Sequence[str], budget: int) -> List[int]:
+    """Indices of the sentences most relevant to each concern, picked in turns until `budget` is spent, in pick order."""
+    document_frequency = Counter(term for *_, terms in sentences for term in terms)
+    idf = {term: math.log(1 + len(sentences) / df) for term, df in document_frequency.items()}
+
+    rankings = []
+    for concern in concerns:
+        concern_terms = set(tokenize(concern))
+        scores = [(sum(idf[t] for t in concern_terms & terms) / math.sqrt(len(terms) + 1), i)
+                  for i, (*_, terms) in enumerate(sentences)]
+        rankings.append([i for score, i in sorted(scores, reverse=True) if score > 0])
+
+    picked = []
+    used = 0
+    progress = True
+    while progress:
+        progress = False
+        for ranking in rankings:
+            while ranking and ranking[0] in picked:
+                ranking.pop(0)
+            if not ranking:
+                continue
+            i = ranking.pop(0)
+            cost = count_tokens(sentences[i][2]) + 1
+            if used + cost <= budget:
+                picked.append(i)
+                used += cost
+                progress = True
+            else:
+                progress = progress or bool(ranking)
+    return picked
+
+
+def _truncate(sentences: Sequence[Tuple], picked: Sequence[int], budget: int) -> List[int]:
+    """The earliest picks that fit in `budget`, keeping the pick order's priorities."""
+    kept = []
+    used = 0
+    for i in picked:
+        cost = count_tokens(sentences[i][2]) + 1
+        if used + cost <= budget:
+            kept.append(i)
+            used += cost
+    return kept
+
+
+def _assemble(sentences: Sequence[Tuple], picked: Sequence[int]) -> str:
+    """The picked sentences in document order, with gaps within a chunk marked."""
+    parts: List[str] = []
+    previous = None
+    for i in sorted(picked, key=lambda i: sentences[i][:2]):
+        chunk_idx, sentence_idx, sentence, _ = sentences[i]
+        if previous is None:
+            parts.append(sentence)
+        elif previous[0] != chunk_idx:
+            parts.append("\n\n" + sentence)
+        elif previous[1] + 1 == sentence_idx:
+            parts.append(" " + sentence)
+        else:
+            parts.append(GAP_MARKER + sentence)
+        previous = (chunk_idx, sentence_idx)
+    return "".join(parts)
+
+
+def _select(chunks: Sequence[str], concerns: Sequence[str], budget: int) -> Tuple[str, list, Optional[List[int]]]:
+    """
+    Fits the chunks into `budget` tokens, as (text, sentences, picked). If they already fit
+    they are returned whole and `picked` is None; otherwise the sentences most relevant to
+    each concern are picked in turns (so every concern is covered) and reassembled in
+    document order, with gaps marked. A budget of 0 disables the limit.
+    """
+    joined = "\n\n".join(chunks)
+    if budget <= 0 or count_tokens(joined) <= budget:
+        return joined, [], None
+    sentences = _sentences(chunks)
+    picked = _pick(sentences, concerns, budget)
+    # Nothing matched the concerns: keep the leading text of the best-ranked chunks
+    return (_assemble(sentences, picked) if picked else joined[:budget * 4]), sentences, picked
+
+
+def fit_to_budgets(documents: Sequence[Document], question: str, max_overlap: int, generation_budget: int,
+                   validator_budget: int) -> Tuple[str, str]:
+    """
+    The retrieved chunks as they appear in the generate and check prompts. The generator
+    gets the deduplicated chunks fitted to `generation_budget`. The validator gets the same
+    context, or if that is over `validator_budget`, the sentences the generator's selection
+    picked first, so every passage the validator sees is one the generator saw.
+    """
+    chunks = dedupe_chunks(documents, max_overlap)
+    concerns = split_concerns(question)
+    context, sentences, picked = _select(chunks, concerns, generation_budget)
+    if validator_budget <= 0 or count_tokens(context) <= validator_budget:
+        return context, context
+    if picked is None:
+        # The generator saw every chunk whole, so any selection from them is part of its context
+        return context, _select(chunks, concerns, validator_budget)[0]
+    picked = _truncate(sentences, picked, validator_budget)
+    return context, _assemble(sentences, picked) if picked else context[:validator_budget * 4]
+
+
+def cap_memory(memory: list, budget: int) -> list:
+    """Keeps the most recent memory entries that fit in `budget` tokens (0 disables the cap)."""
+    if budget <= 0:
+        return memory
+    kept = []
+    used = 0
+    for entry in reversed(memory):
+        cost = count_tokens(str(entry))
+        if used + cost > budget:
+            if not kept and isinstance(entry, str):
+                # A single oversized entry is cut rather than dropped
+                kept.append(entry[-budget * 4:])
+            break
+        kept.append(entry)
+        used += cost
+    return list(reversed(kept))
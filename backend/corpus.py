@@ -0,0 +1,246 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from index_store import (MmapDocstore, file_fingerprint, load_combined, load_or_build_vectorstore, load_shard,
+                         manifest_key, merge_shards, save_combined, supports_removal)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".docx")
+
+
+def list_corpus_files(directory: str) -> List[str]:
+    """Regulation files in the corpus directory, sorted so the manifest key is stable."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith(".")
+    )
+
+
+def document_id(file_path: str) -> str:
+    """Documents are addressed by file name within the corpus directory."""
+    return os.path.basename(file_path)
+
+
+@dataclass(frozen=True)
+class CorpusSnapshot:
+    """
+    An immutable view of the indexed corpus. Queries take one snapshot and use it
+    throughout, so an ingestion that lands mid-query cannot mix old and new chunks.
+    """
+    vectorstore: FAISS
+    retriever: object
+    version: str # Manifest key of the indexed files; changes whenever the content does
+    revision: int # Incremented on every swap within this process
+    documents: Dict[str, Tuple[str, int]] = field(default_factory=dict) # document id -> (fingerprint, chunk count)
+
+
+class Corpus:
+    """
+    The live regulation index. Writers (admin endpoints and the directory watcher) build
+    a new vector store and retriever off to the side and then swap the snapshot in a
+    single assignment; readers are never blocked.
+    """
+
+    def __init__(self, directory: str, embeddings: Embeddings,
+                 build_shards: Callable[[List[Tuple[str, str]]], None], index_settings: Dict, cache_dir: str,
+                 make_retriever: Callable[[FAISS], object], on_swap: Optional[Callable[[CorpusSnapshot], None]] = None,
+                 index_type: str = "flat"):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.build_shards = build_shards
+        self.index_settings = index_settings
+        self.cache_dir = cache_dir
+        self.make_retriever = make_retriever
+        self.on_swap = on_swap
+        self.index_type = index_type
+        self._write_lock = threading.Lock()
+        self._watch_stop = threading.Event()
+        self._watched: Dict[str, Tuple[float, int]] = {}
+
+        file_paths = list_corpus_files(directory)
+        vectorstore, version = load_or_build_vectorstore(
+            file_paths, embeddings, build_shards,
+            index_settings=index_settings, cache_dir=cache_dir, index_type=index_type
+        )
+        documents = {}
+        for file_path in file_paths:
+            fingerprint = file_fingerprint(file_path, index_settings)
+            shard = load_shard(cache_dir, fingerprint)
+            documents[document_id(file_path)] = (fingerprint, len(shard[0]) if shard else 0)
+        self.snapshot = CorpusSnapshot(vectorstore, make_retriever(vectorstore), version, 0, documents)
+        self._watched = self._stat_files()
+
+    def describe(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version,
+            "revision": snapshot.revision,
+            "chunks": snapshot.vectorstore.index.ntotal,
+            "documents": [{"doc_id": doc_id, "fingerprint": fingerprint, "chunks": count}
+                          for doc_id, (fingerprint, count) in sorted(snapshot.documents.items())],
+        }
+
+    @staticmethod
+    def _chunk_ids(fingerprint: str, count: int) -> List[str]:
+        # Same ids as index_store.merge_shards, so shards built at startup can be replaced
+        return [f"{fingerprint[:16]}-{i}" for i in range(count)]
+
+    def _copy_vectorstore(self, vectorstore: FAISS) -> FAISS:
+        # The index may be memory-mapped read-only; mutate an in-memory copy. clone_index can
+        # keep viewing the mapped storage, so the copy goes through a serialized buffer.
+        docstore = vectorstore.docstore
+        docstore = docstore.copy() if isinstance(docstore, MmapDocstore) else InMemoryDocstore(dict(docstore._dict))
+        index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+        return FAISS(embedding_function=self.embeddings, index=index,
+                     docstore=docstore, index_to_docstore_id=dict(vectorstore.index_to_docstore_id))
+
+    def _update_vectorstore(self, stale: List[Tuple[str, int]], added: Dict[str, Tuple[str, List[Document], np.ndarray]],
+                            documents: Dict[str, Tuple[str, int]]) -> FAISS:
+        """Applies the change to a copy of the current index, or rebuilds it if the index type cannot remove vectors."""
+        current = self.snapshot.vectorstore
+        if stale and not supports_removal(current.index):
+            shards = []
+            for doc_id in sorted(documents):
+                fingerprint = documents[doc_id][0]
+                if doc_id in added:
+                    shards.append(added[doc_id])
+                elif documents[doc_id][1]:
+                    shards.append((fingerprint, *load_shard(self.cache_dir, fingerprint)))
+            return merge_shards(shards, self.embeddings, self.index_type)
+
+        vectorstore = self._copy_vectorstore(current)
+        stale_ids = [chunk_id for fingerprint, count in stale for chunk_id in self._chunk_ids(fingerprint, count)]
+        if stale_ids:
+            vectorstore.delete(stale_ids)
+        for fingerprint, chunks, vectors in added.values():
+            if chunks:
+                vectorstore.add_embeddings(
+                    [(chunk.page_content, row.tolist()) for chunk, row in zip(chunks, np.asarray(vectors))],
+                    metadatas=[chunk.metadata for chunk in chunks],
+                    ids=self._chunk_ids(fingerprint, len(chunks)),
+                )
+        return vectorstore
+
+    def _apply(self, removed: List[str], added: Dict[str, Tuple[str, List[Document], np.ndarray]]) -> CorpusSnapshot:
+        """Builds and publishes a snapshot without the removed documents and with the added ones."""
+        current = self.snapshot
+        documents = dict(current.documents)
+
+        stale = [documents.pop(doc_id) for doc_id in removed + list(added) if doc_id in documents]
+        for doc_id, (fingerprint, chunks, _) in added.items():
+            duplicate = next((other for other, (other_fingerprint, _) in documents.items() if other_fingerprint == fingerprint), None)
+            if duplicate is not None:
+                raise ValueError(f"{doc_id} has the same content as {duplicate}.")
+            documents[doc_id] = (fingerprint, len(chunks))
+
+        # Same key a fresh start over the directory would compute, so the saved index is reused.
+        # Another server process may already have published it.
+        version = manifest_key([documents[doc_id][0] for doc_id in sorted(documents)], self.index_type)
+        vectorstore = load_combined(self.cache_dir, version, self.embeddings)
+        if vectorstore is None:
+            vectorstore = self._update_vectorstore(stale, added, documents)
+            if vectorstore.index.ntotal:
+                save_combined(self.cache_dir, version, vectorstore)
+                # Serve from the memory-mapped copy so processes share the chunks
+                vectorstore = load_combined(self.cache_dir, version, self.embeddings)
+        snapshot = CorpusSnapshot(vectorstore, self.make_retriever(vectorstore), version, current.revision + 1, documents)
+        self.snapshot = snapshot
+        print(f"---CORPUS REVISION {snapshot.revision}: INDEX {version[:12]} ({vectorstore.index.ntotal} chunks)---")
+        if self.on_swap is not None:
+            self.on_swap(snapshot)
+        return snapshot
+
+    def _build(self, files: List[Tuple[str, str]]) -> Dict[str, Tuple[str, List[Document], np.ndarray]]:
+        """Loads the shards for (file path, fingerprint) pairs, building the missing ones in one pass."""
+        self.build_shards([(file_path, fingerprint) for file_path, fingerprint in files
+                           if load_shard(self.cache_dir, fingerprint) is None])
+        built = {}
+        for file_path, fingerprint in files:
+            shard = load_shard(self.cache_dir, fingerprint)
+            if shard is None:
+                raise ValueError(f"{document_id(file_path)} could not be loaded.")
+            built[document_id(file_path)] = (fingerprint, *shard)
+        return built
+
+    def upsert(self, file_path: str) -> Optional[CorpusSnapshot]:
+        """Adds or replaces the document for a file. Returns the new snapshot, or None if nothing changed."""
+        with self._write_lock:
+            doc_id = document_id(file_path)
+            fingerprint = file_fingerprint(file_path, self.index_settings)
+            if self.snapshot.documents.get(doc_id, (None,))[0] == fingerprint:
+                return None
+            return self._apply([], self._build([(file_path, fingerprint)]))
+
+    def remove(self, doc_id: str) -> Optional[CorpusSnapshot]:
+        """Removes a document from the index. Returns the new snapshot, or None if it was not indexed."""
+        with self._write_lock:
+            if doc_id not in self.snapshot.documents:
+                return None
+            if len(self.snapshot.documents) == 1:
+                raise ValueError("Cannot remove the last document from the corpus.")
+            return self._apply([doc_id], {})
+
+    def _stat_files(self) -> Dict[str, Tuple[float, int]]:
+        stats = {}
+        for file_path in list_corpus_files(self.directory):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            stats[file_path] = (stat.st_mtime, stat.st_size)
+        return stats
+
+    def sync(self) -> Optional[CorpusSnapshot]:
+        """
+        Brings the index in line with the corpus directory: new or modified files are
+        (re-)indexed and deleted files are dropped, all in one swap.
+        """
+        with self._write_lock:
+            stats = self._stat_files()
+            present = {document_id(path): path for path in stats}
+            removed = [doc_id for doc_id in self.snapshot.documents if doc_id not in present]
+            changed = []
+            for doc_id, file_path in present.items():
+                fingerprint = file_fingerprint(file_path, self.index_settings)
+                if self.snapshot.documents.get(doc_id, (None,))[0] != fingerprint:
+                    changed.append((file_path, fingerprint))
+            added = self._build(changed)
+            self._watched = stats
+            if not removed and not added:
+                return None
+            if len(removed) == len(self.snapshot.documents) and not added:
+                print(f"Corpus directory {self.directory} is empty, keeping the current index.")
+                return None
+            return self._apply(removed, added)
+
+    def watch(self, interval_seconds: float) -> threading.Thread:
+        """Polls the corpus directory and syncs once a file's size or mtime has changed and settled."""
+        def run():
+            previous = None
+            while not self._watch_stop.wait(interval_seconds):
+                try:
+                    stats = self._stat_files()
+                    # Wait for one unchanged poll so files still being copied are not indexed half-written
+                    if stats != self._watched and stats == previous:
+                        self.sync()
+                    previous = stats
+                except Exception as e:
+                    print(f"Error syncing corpus directory {self.directory}: {e}")
+
+        self._watch_stop.clear()
+        thread = threading.Thread(target=run, name="corpus-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_watching(self) -> None:
+        self._watch_stop.set()
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from tracing import record_cache_lookup
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    In-process embedding backend running a sentence-transformers model on CPU, for
+    deployments without access to the Ollama embedding server. Requires the optional
+    `sentence-transformers` package.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 64, device: str = "cpu"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_BACKEND=sentence-transformers requires the sentence-transformers package "
+                "(pip install sentence-transformers)."
+            ) from e
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device=device)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                     normalize_embeddings=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedBatchEmbeddings(Embeddings):
+    """
+    Wraps another embedding backend with:
+      - de-duplication of identical texts within a call,
+      - a persistent vector cache keyed by a hash of (model id, text),
+      - fixed-size batches for the texts that still need embedding.
+
+    Queries go through the same cache, so repeated rewritten questions and repeated
+    chunks never reach the backend twice.
+    """
+
+    def __init__(self, inner: Embeddings, model_id: str, db_path: str, batch_size: int = 64):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.inner = inner
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector in self._conn.execute(
+                        f"SELECT key, vector FROM vectors WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(vector, dtype="float32").tolist()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes()) for key, vector in items.items()])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+
+        missing_keys = list(missing)
+        record_cache_lookup("embedding", hits=len(vectors), misses=len(missing_keys))
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            batch_vectors = self.inner.embed_documents([missing[key] for key in batch_keys])
+            computed = dict(zip(batch_keys, batch_vectors))
+            self._store(computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self._lookup([key])
+        record_cache_lookup("embedding", hits=len(cached), misses=1 - len(cached))
+        if key in cached:
+            return cached[key]
+        vector = self.inner.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+
+def create_embeddings(backend: str, model: str, base_url: str, cache_path: str, batch_size: int,
+                      client_kwargs: Optional[Dict] = None) -> Embeddings:
+    """
+    Builds the embedding layer used for both indexing and retrieval.
+    `backend` is "ollama" (remote server) or "sentence-transformers" (local CPU model);
+    `client_kwargs` are passed to the Ollama httpx client (timeouts, connection pool).
+    """
+    if backend == "ollama":
+        from langchain_ollama import OllamaEmbeddings
+        inner = OllamaEmbeddings(model=model, base_url=base_url, client_kwargs=client_kwargs or {})
+    elif backend == "sentence-transformers":
+        inner = SentenceTransformerEmbeddings(model, batch_size=batch_size)
+    else:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
+    return CachedBatchEmbeddings(inner, model_id=f"{backend}:{model}", db_path=cache_path, batch_size=batch_size)
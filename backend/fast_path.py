@@ -0,0 +1,385 @@
+import argparse
+import json
+import os
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bulk_io import detect_format, iter_rows
+from retrieval import tokenize
+from terminology import TermMatcher, load_terminology
+
+LEGAL = "legal"
+BUSINESS = "business"
+REVIEW = "review"
+CLASSES = [LEGAL, BUSINESS, REVIEW]
+# (feature_type, compliance_status) of the answers the fast path may give
+ANSWERS = {LEGAL: ("Legal Requirement", "Compliance Logic Needed"), BUSINESS: ("Business Driven", "No Compliance Logic Needed")}
+
+# A stated legal motive followed by what it refers to, up to the end of the clause
+LEGAL_INTENT = re.compile(r"\b(?:to comply with|in compliance with|compliance with|as required by|required under|in line with|"
+                          r"pursuant to)\s+(?P<target>[^.;:]{3,120})", re.IGNORECASE)
+# A legal motive that is denied: "not built to comply with", "no legal requirement", "not legally required"
+NEGATED_INTENT = re.compile(r"\b(?:not|never|no longer|(?:is|are|does|do)n['’]t)\s+(?:\w+\s+){0,3}?(?:to\s+)?"
+                            r"(?:comply|complian\w*|required|mandated|regulat\w*)\b|"
+                            r"\bno\s+(?:legal|regulatory|compliance)\s+(?:requirements?|obligations?|need|reason)\b|"
+                            r"\bnot\s+(?:a\s+)?legal(?:ly)?\b", re.IGNORECASE)
+# Glossary entries whose explanation names a law count as statutes alongside the regulation titles
+GLOSSARY_STATUTE = re.compile(r"\b(?:act|law|statute|regulation|directive|code)\b", re.IGNORECASE)
+BUSINESS_INTENT = re.compile(r"\b(?:market testing|a/b test(?:s|ing)?|a/b experiment|experiment(?:s|ation)?|variant test|"
+                             r"engagement|monetization|growth|conversion|click-through|trial run|pilot|beta|"
+                             r"usage metrics|feature health)\b", re.IGNORECASE)
+# Topics that can make even a business feature need compliance logic. Matched against the
+# description plus its glossary expansions, so "ASL" counts as age logic and "CDS" as compliance.
+SENSITIVE_TOPIC = re.compile(r"\b(?:minors?|underage|teens?|child(?:ren)?|kids?|age|aged|parent(?:al|s)?|guardians?|consent|"
+                             r"personal (?:data|information)|privacy|retention|biometric|location data|moderation|abuse|"
+                             r"reports?|reporting|laws?|legal|regulat\w*|complian\w*|statutes?|polic(?:y|ies)|safety|"
+                             r"jurisdiction\w*|censorship)\b", re.IGNORECASE)
+# row_to_question joins the feature name and description without a space ("...Utah minorsTo comply with")
+JOINED_WORDS = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+# Title words too common to identify a regulation on their own
+GENERIC_TITLE_WORDS = frozenset("act law laws code regulation regulations state us eu".split())
+FAST_PATH_TAG = "fast path"
+# "Fast path (rules): ..." / "Fast path (model, p=0.93): ..." at the start of a fast-path answer's reasoning
+FAST_PATH_REASONING = re.compile(r"^Fast path \((?P<source>rules|model)\b")
+
+
+@dataclass
+class FastPathDecision:
+    label: str
+    confidence: float
+    source: str
+    regulations: List[str] = field(default_factory=list)
+    reasoning: str = ""
+
+    def answer(self) -> Dict:
+        """Fields of a ComplianceStatus for this decision."""
+        feature_type, compliance_status = ANSWERS[self.label]
+        return {"feature_type": feature_type, "compliance_status": compliance_status,
+                "supporting_regulations": self.regulations, "reasoning": self.reasoning}
+
+
+def regulation_title(file_name: str) -> str:
+    """'Utah_Social_Media_Regulation_Act.pdf' -> 'Utah Social Media Regulation Act'."""
+    return os.path.splitext(os.path.basename(file_name))[0].replace("_", " ").strip()
+
+
+def _hashed_features(text: str, dim: int) -> np.ndarray:
+    """Bucket indices of the text's terms and adjacent term pairs."""
+    terms = tokenize(text)
+    grams = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    return np.unique(np.array([zlib.crc32(gram.encode("utf-8")) % dim for gram in grams], dtype="int64"))
+
+
+class IntentModel:
+    """
+    Multinomial logistic regression over hashed term and term-pair features, small enough to
+    train and run on the CPU with numpy. Predicts LEGAL, BUSINESS or REVIEW with a probability.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, dim: int):
+        self.weights = weights
+        self.bias = bias
+        self.dim = dim
+
+    @staticmethod
+    def _matrix(rows: Sequence[np.ndarray], dim: int) -> np.ndarray:
+        matrix = np.zeros((len(rows), dim), dtype="float32")
+        for i, indices in enumerate(rows):
+            if len(indices):
+                matrix[i, indices] = 1.0 / np.sqrt(len(indices))
+        return matrix
+
+    @classmethod
+    def train(cls, texts: Sequence[str], labels: Sequence[str], dim: int = 2 ** 14, epochs: int = 40,
+              learning_rate: float = 1.0, l2: float = 1e-4, batch_size: int = 256, seed: int = 7) -> "IntentModel":
+        rows = [_hashed_features(text, dim) for text in texts]
+        targets = np.array([CLASSES.index(label) for label in labels])
+        weights = np.zeros((dim, len(CLASSES)), dtype="float32")
+        bias = np.zeros(len(CLASSES), dtype="float32")
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(rows))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                x = cls._matrix([rows[i] for i in batch], dim)
+                probabilities = _softmax(x @ weights + bias)
+                probabilities[np.arange(len(batch)), targets[batch]] -= 1.0
+                weights -= learning_rate * (x.T @ probabilities / len(batch) + l2 * weights)
+                bias -= learning_rate * probabilities.mean(axis=0)
+        return cls(weights, bias, dim)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probabilities = _softmax(self._matrix([_hashed_features(text, self.dim)], self.dim) @ self.weights + self.bias)[0]
+        best = int(np.argmax(probabilities))
+        return CLASSES[best], float(probabilities[best])
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, classes=np.array(CLASSES))
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        with np.load(path) as data:
+            if list(data["classes"]) != CLASSES:
+                raise ValueError(f"{path} was trained for classes {list(data['classes'])}, expected {CLASSES}")
+            return cls(data["weights"], data["bias"], data["weights"].shape[0])
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def load_calibration(path: str) -> Dict[str, float]:
+    """
+    Confidence of each fast-path rule ("rules:legal", "rules:business") from a report of
+    `python -m benchmarks.evaluate`: the share of the rows it answered whose labels agree,
+    as (agreed + 1) / (answered + 2) so a rule seen on only a few rows is not trusted outright.
+    Uses the configuration in which the rule answered the most rows.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    best: Dict[str, Dict] = {}
+    for result in report.get("results", []):
+        for key, stats in (result.get("fast_path") or {}).items():
+            if stats["answered"] > best.get(key, {"answered": 0})["answered"]:
+                best[key] = stats
+    return {key: (stats["agreed"] + 1) / (stats["answered"] + 2) for key, stats in best.items()}
+
+
+class FastPathClassifier:
+    """
+    Answers rows whose classification is obvious without calling the LLMs.
+
+    Rules come first: a stated legal motive that names a statute (one of the loaded regulation
+    titles, or a glossary term explained as a law) is a legal requirement; a business motive
+    (market testing, A/B tests, engagement...) with no statute and no sensitive topic is
+    business driven. Rows where both or neither apply go to the optional IntentModel. A rule's
+    confidence is its measured agreement from `calibration` (see load_calibration), 0 if it was
+    never measured. Rows that deny a legal motive, and anything below `min_confidence`, return
+    None and take the full pipeline.
+    """
+
+    def __init__(self, regulation_titles: Iterable[str], term_matcher: Optional[TermMatcher] = None,
+                 model: Optional[IntentModel] = None, min_confidence: float = 0.9,
+                 calibration: Optional[Dict[str, float]] = None):
+        self.term_matcher = term_matcher
+        self.model = model
+        self.min_confidence = min_confidence
+        self.calibration = calibration or {}
+        self.glossary_statutes = [term for term, explanation in (term_matcher.glossary if term_matcher else {}).items()
+                                  if GLOSSARY_STATUTE.search(str(explanation))]
+        self.titles: Dict[str, set] = {}
+        self.set_titles(regulation_titles)
+
+    @classmethod
+    def from_directory(cls, regulations_dir: str, term_matcher: Optional[TermMatcher] = None,
+                       model: Optional[IntentModel] = None, min_confidence: float = 0.9,
+                       calibration: Optional[Dict[str, float]] = None) -> "FastPathClassifier":
+        titles = [regulation_title(name) for name in sorted(os.listdir(regulations_dir)) if not name.startswith(".")]
+        return cls(titles, term_matcher, model, min_confidence, calibration)
+
+    def set_titles(self, regulation_titles: Iterable[str]) -> None:
+        """Replaces the known regulations, e.g. after the corpus changes."""
+        # Each title is recognised by its distinctive words, all of which must appear
+        titles = {}
+        for title in list(regulation_titles) + self.glossary_statutes:
+            words = {word for word in tokenize(title) if word not in GENERIC_TITLE_WORDS}
+            if words:
+                titles[title] = words
+        self.titles = titles
+
+    def expand(self, text: str) -> str:
+        """The text followed by glossary explanations of the internal terms it uses."""
+        if self.term_matcher is None:
+            return text
+        return "\n".join([text] + self.term_matcher.expand(text))
+
+    def regulations_in(self, text: str) -> List[str]:
+        """Loaded regulation titles and glossary statutes that the text refers to."""
+        words = set(tokenize(text))
+        return [title for title, title_words in self.titles.items() if title_words <= words]
+
+    def classify(self, text: str) -> Optional[FastPathDecision]:
+        if NEGATED_INTENT.search(JOINED_WORDS.sub(" ", text)):
+            return None
+        decision = self._rules(text) or self._model(text)
+        if decision is None or decision.confidence < self.min_confidence:
+            return None
+        return decision
+
+    def _rules(self, text: str) -> Optional[FastPathDecision]:
+        text = JOINED_WORDS.sub(" ", text)
+        regulations = self.regulations_in(text)
+        cited = [target for target in (m.group("target") for m in LEGAL_INTENT.finditer(text))
+                 if self.regulations_in(target)]
+        business = sorted({match.group(0).lower() for match in BUSINESS_INTENT.finditer(text)})
+
+        if cited and not business:
+            return FastPathDecision(LEGAL, self.calibration.get(f"rules:{LEGAL}", 0.0), "rules", regulations,
+                                    f"Fast path (rules): the feature is stated to be built for {', '.join(regulations)}, "
+                                    f"so geo-specific compliance logic is needed.")
+        if business and not regulations and not LEGAL_INTENT.search(text) and not SENSITIVE_TOPIC.search(self.expand(text)):
+            return FastPathDecision(BUSINESS, self.calibration.get(f"rules:{BUSINESS}", 0.0), "rules", [],
+                                    f"Fast path (rules): the feature is motivated by {', '.join(business)} and involves no "
+                                    f"law, minors, personal data or other regulated topic, so no compliance logic is needed.")
+        return None
+
+    def _model(self, text: str) -> Optional[FastPathDecision]:
+        if self.model is None:
+            return None
+        label, probability = self.model.predict(self.expand(text))
+        if label == REVIEW:
+            return None
+        regulations = self.regulations_in(text)
+        # A legal answer must cite something; without a named statute the pipeline finds one
+        if label == LEGAL and not regulations:
+            return None
+        feature_type, _ = ANSWERS[label]
+        return FastPathDecision(label, probability, "model", regulations if label == LEGAL else [],
+                                f"Fast path (model, p={probability:.2f}): classified as {feature_type} from "
+                                f"previously reviewed features with similar wording.")
+
+
+def label_of(answer: Dict) -> str:
+    """LEGAL, BUSINESS or REVIEW for a pipeline answer."""
+    pair = (answer.get("feature_type"), answer.get("compliance_status"))
+    return next((label for label, expected in ANSWERS.items() if pair == expected), REVIEW)
+
+
+def answer_source(answer: Dict) -> Optional[str]:
+    """"rules" or "model" if the fast path gave this answer, else None."""
+    match = FAST_PATH_REASONING.match(str(answer.get("reasoning") or ""))
+    return match.group("source") if match else None
+
+
+# "<timestamp> - INFO - Feature: <question>, Answer[ (cached)]: <JSON>" as written by record_final_state
+AUDIT_ENTRY = re.compile(r"^\d{4}-\d{2}-\d{2} [\d:,]+ - INFO - Feature: (?P<question>.*?), Answer(?: \((?P<tag>[^)]*)\))?: "
+                         r"(?P<answer>.*?)(?=^\d{4}-\d{2}-\d{2} [\d:,]+ - |\Z)", re.DOTALL | re.MULTILINE)
+
+
+def load_audit_log(path: str) -> Dict[str, str]:
+    """
+    {question: label} from the answers the full pipeline logged. Fast path answers are left
+    out so the model never learns from its own output; a question answered more than once
+    keeps its latest answer.
+    """
+    examples = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    for entry in AUDIT_ENTRY.finditer(content):
+        if entry.group("tag") == FAST_PATH_TAG:
+            continue
+        try:
+            answer = json.loads(entry.group("answer").strip())
+            # Older entries logged the answer as a JSON-encoded string
+            if isinstance(answer, str):
+                answer = json.loads(answer)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(answer, dict):
+            examples[entry.group("question")] = label_of(answer)
+    return examples
+
+
+def load_labelled_sheet(path: str) -> Dict[str, str]:
+    """{question: label} from a processed sheet (the /excel output, or one reviewed by hand)."""
+    examples = {}
+    with open(path, "rb") as f:
+        for row in iter_rows(f, detect_format(path)):
+            question = str(row.get("feature_name") or "") + str(row.get("feature_description") or "")
+            if question and row.get("feature_type"):
+                examples[question] = label_of(row)
+    return examples
+
+
+def load_examples(logs: Sequence[str], sheets: Sequence[str]) -> Dict[str, str]:
+    examples = {}
+    for path in logs:
+        examples.update(load_audit_log(path))
+    for path in sheets:
+        examples.update(load_labelled_sheet(path))
+    return examples
+
+
+def evaluate(classifier: FastPathClassifier, examples: Dict[str, str]) -> Dict:
+    """Bypass rate, and agreement of the bypassed rows with the reference labels."""
+    by_source: Dict[str, List[bool]] = {}
+    disagreements = []
+    for question, expected in examples.items():
+        decision = classifier.classify(question)
+        if decision is None:
+            continue
+        agrees = decision.label == expected
+        by_source.setdefault(decision.source, []).append(agrees)
+        if not agrees:
+            disagreements.append({"question": question[:160], "predicted": decision.label, "expected": expected,
+                                  "source": decision.source, "confidence": round(decision.confidence, 3)})
+    bypassed = sum(len(results) for results in by_source.values())
+    correct = sum(sum(results) for results in by_source.values())
+    return {
+        "rows": len(examples),
+        "labels": {label: sum(1 for value in examples.values() if value == label) for label in CLASSES},
+        "bypassed": bypassed,
+        "bypass_rate": round(bypassed / len(examples), 3) if examples else None,
+        "accuracy": round(correct / bypassed, 3) if bypassed else None,
+        "by_source": {source: {"bypassed": len(results), "accuracy": round(sum(results) / len(results), 3)}
+                      for source, results in by_source.items()},
+        "disagreements": disagreements,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the fast-path classifier on past results.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--log", action="append", default=[], help="Audit log with past answers (repeatable), e.g. app.log")
+    parser.add_argument("--sheet", action="append", default=[], help="Processed sheet with feature_type/compliance_status columns (repeatable)")
+    parser.add_argument("--model", default=os.path.join(os.getenv("CACHE_DIR", "cache"), "fast_path_model.npz"),
+                        help="Model file written by train and read by evaluate (FAST_PATH_MODEL_PATH)")
+    parser.add_argument("--regulations", default=os.getenv("REGULATIONS_DIR", "regulations"))
+    parser.add_argument("--terminology", default="terminologies/terminologies.xlsx")
+    parser.add_argument("--min-confidence", type=float, default=float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.9")))
+    parser.add_argument("--calibration", default=os.getenv("FAST_PATH_CALIBRATION_PATH", ""),
+                        help="benchmarks.evaluate report the rule confidences are read from (FAST_PATH_CALIBRATION_PATH)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of examples kept out of training to report accuracy")
+    parser.add_argument("--epochs", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    examples = load_examples(args.log or (["app.log"] if not args.sheet else []), args.sheet)
+    if not examples:
+        raise SystemExit("No labelled examples found; pass --log and/or --sheet.")
+    term_matcher = load_terminology(args.terminology)
+    calibration = load_calibration(args.calibration) if args.calibration else {}
+
+    if args.command == "train":
+        questions = list(examples)
+        order = np.random.default_rng(args.seed).permutation(len(questions))
+        cut = int(len(questions) * args.holdout)
+        held_out = {questions[i]: examples[questions[i]] for i in order[:cut]}
+        training = [questions[i] for i in order[cut:]]
+        classifier = FastPathClassifier.from_directory(args.regulations, term_matcher, min_confidence=args.min_confidence,
+                                                    calibration=calibration)
+        print(f"---TRAINING ON {len(training)} EXAMPLES, {len(held_out)} HELD OUT---")
+        model = IntentModel.train([classifier.expand(q) for q in training], [examples[q] for q in training],
+                                  epochs=args.epochs, seed=args.seed)
+        model.save(args.model)
+        print(f"Saved model to {args.model}")
+        if held_out:
+            classifier.model = model
+            report = evaluate(classifier, held_out)
+            report.pop("disagreements")
+            print(json.dumps(report, indent=2))
+    else:
+        model = IntentModel.load(args.model) if os.path.exists(args.model) else None
+        classifier = FastPathClassifier.from_directory(args.regulations, term_matcher, model, args.min_confidence, calibration)
+        print(f"---EVALUATING {'RULES AND MODEL' if model else 'RULES'} ON {len(examples)} EXAMPLES---")
+        print(json.dumps(evaluate(classifier, examples), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+import copy
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# On-disk layout (all paths relative to the cache directory):
+#   shards/<fingerprint>/chunks.jsonl   one JSON object per chunk (page_content + metadata)
+#   shards/<fingerprint>/vectors.f32    raw float32 embeddings, row-major, one row per chunk
+#   shards/<fingerprint>/meta.json      written last; marks the shard as complete
+#   combined/<manifest>/index.faiss     merged FAISS index for a full set of shards
+#   combined/<manifest>/docs.jsonl      chunk records in index order, memory-mapped by every process
+#   combined/<manifest>/docs.offsets.npy  byte offset of each record in docs.jsonl, plus the end
+#   combined/<manifest>/docs.ids.json   docstore id of each index position
+SHARDS_DIR = "shards"
+COMBINED_DIR = "combined"
+INDEX_NAME = "index"
+DOCS_NAME = "docs"
+
+# Shorthands accepted for VECTOR_INDEX_TYPE; any other value is used as a FAISS index_factory string.
+# "ivfpq" is sized from the corpus in index_factory_string.
+INDEX_TYPES = {"flat": "Flat", "hnsw": "HNSW32", "sq8": "SQ8"}
+
+
+def file_fingerprint(file_path: str, index_settings: Dict) -> str:
+    """
+    Hashes a source file's bytes together with the settings that shape its chunks
+    and vectors (chunk size, overlap, embedding model). Any change produces a new key.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(index_settings, sort_keys=True).encode("utf-8"))
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_key(fingerprints: List[str], index_type: str = "flat") -> str:
+    """Key for the merged index of the given type built from an ordered list of shard fingerprints."""
+    return hashlib.sha256("\n".join([index_type.lower()] + fingerprints).encode("utf-8")).hexdigest()
+
+
+def _atomic_publish(tmp_dir: str, final_dir: str) -> None:
+    """Moves a fully written directory into place, discarding it if another worker won the race."""
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _shard_path(cache_dir: str, fingerprint: str) -> str:
+    return os.path.join(cache_dir, SHARDS_DIR, fingerprint)
+
+
+class ShardWriter:
+    """
+    Writes a shard incrementally, so a large file's chunks and vectors never have to be
+    held in memory at once. Nothing is visible to readers until `close()` publishes it.
+    """
+
+    def __init__(self, cache_dir: str, fingerprint: str, source: str):
+        self.source = source
+        self.final_dir = _shard_path(cache_dir, fingerprint)
+        self.tmp_dir = f"{self.final_dir}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._chunks = open(os.path.join(self.tmp_dir, "chunks.jsonl"), "w", encoding="utf-8")
+        self._vectors = open(os.path.join(self.tmp_dir, "vectors.f32"), "wb")
+        self.count = 0
+        self.dim = 0
+
+    def append(self, chunks: List[Document], vectors) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        for chunk in chunks:
+            self._chunks.write(json.dumps({"page_content": chunk.page_content, "metadata": chunk.metadata}, default=str) + "\n")
+        if len(chunks):
+            self.dim = int(vectors.shape[1])
+            self._vectors.write(vectors.tobytes())
+        self.count += len(chunks)
+
+    def close(self) -> None:
+        self._chunks.close()
+        self._vectors.close()
+        with open(os.path.join(self.tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "count": self.count, "dim": self.dim}, f)
+        _atomic_publish(self.tmp_dir, self.final_dir)
+
+    def abort(self) -> None:
+        self._chunks.close()
+        self._vectors.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def save_shard(cache_dir: str, fingerprint: str, source: str, chunks: List[Document], vectors: np.ndarray) -> None:
+    """Writes the chunks and embeddings of a single source file to the shard store."""
+    writer = ShardWriter(cache_dir, fingerprint, source)
+    writer.append(chunks, vectors)
+    writer.close()
+
+
+def load_shard(cache_dir: str, fingerprint: str) -> Optional[Tuple[List[Document], np.ndarray]]:
+    """Returns (chunks, memory-mapped vectors) for a cached shard, or None if it is not on disk."""
+    shard_dir = _shard_path(cache_dir, fingerprint)
+    meta_path = os.path.join(shard_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(os.path.join(shard_dir, "chunks.jsonl"), "r", encoding="utf-8") as f:
+        chunks = [Document(**json.loads(line)) for line in f]
+
+    if meta["count"] == 0:
+        return chunks, np.empty((0, 0), dtype="float32")
+    vectors = np.memmap(os.path.join(shard_dir, "vectors.f32"), dtype="float32", mode="r",
+                        shape=(meta["count"], meta["dim"]))
+    return chunks, vectors
+
+
+def index_factory_string(index_type: str, count: int, dim: int) -> str:
+    """Resolves a VECTOR_INDEX_TYPE value to a FAISS index_factory string for `count` vectors of `dim`."""
+    key = index_type.strip().lower().replace("-", "").replace("_", "")
+    if key == "ivfpq":
+        # About 4*sqrt(n) lists with at least 39 training points each, and one PQ byte per 8 dimensions
+        nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+        m = next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+        return f"IVF{nlist},PQ{m}"
+    return INDEX_TYPES.get(key, index_type)
+
+
+def create_index(index_type: str, vectors: np.ndarray) -> faiss.Index:
+    """
+    Builds an index of the configured type over `vectors` (L2 metric, positions 0..n-1).
+    Types that need training fall back to a flat index when there are too few vectors.
+    """
+    count, dim = vectors.shape
+    factory = index_factory_string(index_type, count, dim)
+    index = faiss.index_factory(dim, factory)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ):
+        # Only polysemous search needs it, and it dominates PQ training time
+        faiss.downcast_index(ivf).do_polysemous_training = False
+    if not index.is_trained:
+        try:
+            index.train(vectors)
+        except RuntimeError:
+            print(f"Too few chunks ({count}) to train a {factory} index, using a flat index instead.")
+            index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    return index
+
+
+def configure_search(index: faiss.Index, nprobe: int, ef_search: int) -> None:
+    """Sets the query-time recall knobs of IVF (nprobe) and HNSW (efSearch) indexes; other types have none."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+
+
+def filtered_search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Per-query parameters that restrict a search to the vectors `selector` accepts, carrying
+    over the index's own nprobe/efSearch (search parameters replace them rather than inherit).
+    The caller must keep `selector` alive while the parameters are in use.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    """
+    Whether removing vectors keeps the remaining positions contiguous, which the
+    position -> docstore id mapping relies on. True for flat and scalar-quantized indexes.
+    """
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlatCodes)
+
+
+class MmapDocstore(Docstore, AddableMixin):
+    """
+    Chunk text and metadata of a merged index, decoded on demand from a memory-mapped
+    file. Every process that opens the same index shares one copy through the page cache.
+    Additions and deletions are kept in memory until the index is saved again.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, f"{DOCS_NAME}.jsonl"), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = np.load(os.path.join(directory, f"{DOCS_NAME}.offsets.npy"), mmap_mode="r")
+        with open(os.path.join(directory, f"{DOCS_NAME}.ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._added: Dict[str, Document] = {}
+        self._deleted = set()
+
+    def _contains(self, doc_id: str) -> bool:
+        return doc_id in self._added or (doc_id in self._rows and doc_id not in self._deleted)
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search not in self._rows or search in self._deleted:
+            return f"ID {search} not found."
+        row = self._rows[search]
+        return Document(**json.loads(self._data[int(self._offsets[row]):int(self._offsets[row + 1])]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [doc_id for doc_id in texts if self._contains(doc_id)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        if not any(self._contains(doc_id) for doc_id in ids):
+            raise ValueError(f"Tried to delete ids that does not exist: {ids}")
+        for doc_id in ids:
+            if self._added.pop(doc_id, None) is None:
+                self._deleted.add(doc_id)
+
+    def copy(self) -> "MmapDocstore":
+        """A store sharing the same mapped file with its own pending changes."""
+        clone = copy.copy(self)
+        clone._added = dict(self._added)
+        clone._deleted = set(self._deleted)
+        return clone
+
+
+def write_docstore(directory: str, vectorstore: FAISS) -> None:
+    """Writes the chunks of a vector store in index order, one record at a time."""
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    offsets = np.zeros(len(ids) + 1, dtype="int64")
+    with open(os.path.join(directory, f"{DOCS_NAME}.jsonl"), "wb") as f:
+        for row, doc_id in enumerate(ids):
+            doc = vectorstore.docstore.search(doc_id)
+            f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, default=str).encode("utf-8") + b"\n")
+            offsets[row + 1] = f.tell()
+    np.save(os.path.join(directory, f"{DOCS_NAME}.offsets.npy"), offsets)
+    with open(os.path.join(directory, f"{DOCS_NAME}.ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+
+
+def _read_index_mmap(index_path: str) -> faiss.Index:
+    """Memory-maps a saved FAISS index, falling back to a regular read if mmap is unsupported."""
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(index_path, flags)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def load_combined(cache_dir: str, key: str, embeddings: Embeddings) -> Optional[FAISS]:
+    """Opens a previously merged index without touching the embedding model."""
+    combined_dir = os.path.join(cache_dir, COMBINED_DIR, key)
+    index_path = os.path.join(combined_dir, f"{INDEX_NAME}.faiss")
+    if not (os.path.exists(index_path) and os.path.exists(os.path.join(combined_dir, f"{DOCS_NAME}.ids.json"))):
+        return None
+
+    index = _read_index_mmap(index_path)
+    docstore = MmapDocstore(combined_dir)
+    return FAISS(embedding_function=embeddings, index=index, docstore=docstore,
+                 index_to_docstore_id=dict(enumerate(docstore.ids)))
+
+
+def save_combined(cache_dir: str, key: str, vectorstore: FAISS) -> None:
+    """Persists a merged index and removes merged indexes for older manifests."""
+    combined_root = os.path.join(cache_dir, COMBINED_DIR)
+    final_dir = os.path.join(combined_root, key)
+    tmp_dir = f"{final_dir}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(tmp_dir, f"{INDEX_NAME}.faiss"))
+    write_docstore(tmp_dir, vectorstore)
+    _atomic_publish(tmp_dir, final_dir)
+
+    for name in os.listdir(combined_root):
+        if name != key and ".tmp-" not in name:
+            shutil.rmtree(os.path.join(combined_root, name), ignore_errors=True)
+
+
+def merge_shards(shards: List[Tuple[str, List[Document], np.ndarray]], embeddings: Embeddings,
+                 index_type: str = "flat") -> FAISS:
+    """Merges per-file shards into one index of the given type, keeping the order of the source list."""
+    shards = [shard for shard in shards if shard[1]]
+    if not shards:
+        raise ValueError("No chunks were produced from the configured documents.")
+
+    index = create_index(index_type, np.concatenate([np.asarray(vectors, dtype="float32") for _, _, vectors in shards]))
+    docs = {}
+    index_to_docstore_id = {}
+    for fingerprint, chunks, vectors in shards:
+        for i, chunk in enumerate(chunks):
+            doc_id = f"{fingerprint[:16]}-{i}"
+            docs[doc_id] = chunk
+            index_to_docstore_id[len(index_to_docstore_id)] = doc_id
+
+    return FAISS(embedding_function=embeddings, index=index, docstore=InMemoryDocstore(docs),
+                 index_to_docstore_id=index_to_docstore_id)
+
+
+def load_or_build_vectorstore(file_paths: List[str], embeddings: Embeddings,
+                              build_shards: Callable[[List[Tuple[str, str]]], None],
+                              index_settings: Dict, cache_dir: str, index_type: str = "flat") -> Tuple[FAISS, str]:
+    """
+    Returns the vector store for the given files together with its manifest key
+    (a version id for the indexed corpus).
+
+    If the exact set of files has been indexed before, the merged index is memory-mapped
+    from disk. Otherwise only files whose fingerprint has no shard yet are passed to
+    `build_shards` as (path, fingerprint) pairs, and the merged index is rebuilt from the
+    shards and saved for the next start. Files that still have no shard are left out.
+    Either way the returned store reads its chunks from the memory-mapped saved copy.
+    """
+    fingerprints = []
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            print(f"Error loading {file_path}: file not found, skipping.")
+            continue
+        fingerprints.append((file_path, file_fingerprint(file_path, index_settings)))
+
+    key = manifest_key([fingerprint for _, fingerprint in fingerprints], index_type)
+    vectorstore = load_combined(cache_dir, key, embeddings)
+    if vectorstore is not None:
+        print(f"---LOADED CACHED INDEX {key[:12]} ({vectorstore.index.ntotal} chunks)---")
+        return vectorstore, key
+
+    build_shards([(file_path, fingerprint) for file_path, fingerprint in fingerprints
+                  if load_shard(cache_dir, fingerprint) is None])
+    shards = []
+    for file_path, fingerprint in fingerprints:
+        shard = load_shard(cache_dir, fingerprint)
+        if shard is not None:
+            shards.append((fingerprint, *shard))
+
+    vectorstore = merge_shards(shards, embeddings, index_type)
+    save_combined(cache_dir, key, vectorstore)
+    vectorstore = load_combined(cache_dir, key, embeddings)
+
+    referenced = {fingerprint for _, fingerprint in fingerprints}
+    shards_root = os.path.join(cache_dir, SHARDS_DIR)
+    for name in os.listdir(shards_root):
+        if name not in referenced and ".tmp-" not in name:
+            shutil.rmtree(os.path.join(shards_root, name), ignore_errors=True)
+
+    print(f"---BUILT INDEX {key[:12]} ({vectorstore.index.ntotal} chunks)---")
+    return vectorstore, key
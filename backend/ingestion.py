@@ -0,0 +1,173 @@
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+from typing import Deque, Iterator, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from index_store import ShardWriter
+from jurisdictions import document_jurisdiction
+
+# A unit of parsing work: (file path, first page, end page). Non-PDF files are one task.
+Task = Tuple[str, int, int]
+Chunk = Tuple[str, dict]
+
+
+@lru_cache(maxsize=4)
+def _splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _load_pages(file_path: str, start: int, stop: int) -> List[Document]:
+    """Loads pages [start, stop) of a PDF, or the whole file for other types, like the LangChain loaders do."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".pdf":
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        total_pages = len(reader.pages)
+        return [
+            Document(page_content=reader.pages[page].extract_text(extraction_mode="plain").strip(),
+                     metadata={"source": file_path, "total_pages": total_pages, "page": page,
+                               "page_label": reader.page_labels[page]})
+            for page in range(start, min(stop, total_pages))
+        ]
+    if extension == ".txt":
+        from langchain_community.document_loaders import TextLoader
+        return TextLoader(file_path).load()
+    if extension == ".docx":
+        from langchain_community.document_loaders import Docx2txtLoader
+        return Docx2txtLoader(file_path).load()
+    raise ValueError(f"Unsupported file type: {extension} for path: {file_path}")
+
+
+def chunk_task(task: Task, chunk_size: int, chunk_overlap: int) -> List[Chunk]:
+    """
+    Parses and splits one task. Runs in a worker process; returns plain tuples so the
+    result pickles cheaply. Pages are split independently, exactly like split_documents.
+    """
+    file_path, start, stop = task
+    chunks = _splitter(chunk_size, chunk_overlap).split_documents(_load_pages(file_path, start, stop))
+    return [(chunk.page_content, chunk.metadata) for chunk in chunks]
+
+
+def plan_tasks(file_path: str, pages_per_task: int) -> List[Task]:
+    """Splits a PDF into page windows; other files are a single task."""
+    if os.path.splitext(file_path)[1].lower() != ".pdf":
+        return [(file_path, 0, 1)]
+    from pypdf import PdfReader
+    total_pages = len(PdfReader(file_path).pages)
+    return [(file_path, start, start + pages_per_task) for start in range(0, max(total_pages, 1), pages_per_task)]
+
+
+class _InlineExecutor(Executor):
+    """Runs tasks in the calling thread; used when a process pool would not pay for itself."""
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class Ingestor:
+    """
+    Streaming ingestion: PDFs are parsed and chunked in page windows across a process
+    pool, chunks are consumed in document order as they arrive, embedded in bounded
+    batches and appended to their shard on disk. At most `max_pending` windows are
+    parsed ahead of the embedder, so peak memory does not grow with the corpus.
+    Every chunk is tagged with its document's jurisdiction (from the file name, or else the
+    document's first window of text).
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_dir: str, chunk_size: int, chunk_overlap: int,
+                 batch_size: int = 64, workers: int = 1, pages_per_task: int = 8):
+        self.embeddings = embeddings
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.workers = max(workers, 1)
+        self.pages_per_task = pages_per_task
+
+    def _iter_results(self, tasks: List[Task], executor: Executor) -> Iterator[Tuple[str, Future]]:
+        """Yields (file path, finished future) per task in submission order, keeping a bounded window in flight."""
+        max_pending = self.workers * 2
+        pending: Deque[Tuple[str, Future]] = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append((task[0], executor.submit(chunk_task, task, self.chunk_size, self.chunk_overlap)))
+            if len(pending) >= max_pending:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            future.exception()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append((next_task[0], executor.submit(chunk_task, next_task, self.chunk_size, self.chunk_overlap)))
+            yield file_path, future
+
+    def build_shards(self, files: List[Tuple[str, str]]) -> None:
+        """Builds a shard for every (file path, fingerprint) pair. A file that fails to load is skipped."""
+        if not files:
+            return
+        tasks = []
+        for file_path, _ in files:
+            try:
+                tasks.extend(plan_tasks(file_path, self.pages_per_task))
+            except Exception as e:
+                print(f"Error loading {file_path}: {e}")
+        fingerprints = dict(files)
+
+        workers = min(self.workers, len(tasks))
+        # Spawned workers only import this module, not the server that started them
+        executor = (ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+                    if workers > 1 else _InlineExecutor())
+        writer, batch, failed, jurisdiction = None, [], set(), None
+        try:
+            for file_path, future in self._iter_results(tasks, executor):
+                if file_path in failed:
+                    continue
+                if future.exception() is not None:
+                    # Never publish half a file; it has no shard until it loads cleanly
+                    print(f"Error loading {file_path}: {future.exception()}")
+                    failed.add(file_path)
+                    if writer is not None and writer.source == file_path:
+                        writer.abort()
+                        writer, batch = None, []
+                    continue
+                chunks = future.result()
+                if writer is None or writer.source != file_path:
+                    self._flush(writer, batch)
+                    batch = []
+                    if writer is not None:
+                        writer.close()
+                    print(f"---EMBEDDING {file_path}---")
+                    writer = ShardWriter(self.cache_dir, fingerprints[file_path], file_path)
+                    jurisdiction = document_jurisdiction(file_path, " ".join(text for text, _ in chunks))
+                for _, metadata in chunks:
+                    metadata["jurisdiction"] = jurisdiction
+                batch.extend(chunks)
+                while len(batch) >= self.batch_size:
+                    self._flush(writer, batch[:self.batch_size])
+                    batch = batch[self.batch_size:]
+            self._flush(writer, batch)
+            if writer is not None:
+                writer.close()
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _flush(self, writer: ShardWriter, batch: List[Chunk]) -> None:
+        if writer is None or not batch:
+            return
+        vectors = self.embeddings.embed_documents([text for text, _ in batch])
+        writer.append([Document(page_content=text, metadata=metadata) for text, metadata in batch], vectors)
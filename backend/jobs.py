@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from io import BytesIO
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import pandas as pd
+from rag_pipeline import CACHE_DIR
+from bulk_engine import RowOutcome, run_bulk, build_processed_workbook
+from tracing import request_context
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+file_handler = logging.FileHandler('app.log', mode='a')
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(formatter)
+logger.addHandler(file_handler)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(CACHE_DIR, "jobs.sqlite"))
+JOB_HEARTBEAT_SECONDS = 10 # How often a running job proves its worker is alive
+JOB_STALE_SECONDS = 60 # A running job without a heartbeat for this long is resumed by another worker
+JOB_SWEEP_SECONDS = 15 # How often unfinished jobs are checked for a stale heartbeat and resumed
+JOB_EVENTS_POLL_SECONDS = 1.0 # How often event streams look for newly finished rows
+
+_WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class JobStore:
+    """
+    SQLite-backed store for bulk jobs. The uploaded file, the memory and every finished
+    row are persisted, so a job can be resumed after a restart and partial results can
+    be read from any worker process.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    file BLOB NOT NULL,
+                    memory TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    owner TEXT,
+                    heartbeat_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job_rows (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    UNIQUE (job_id, position)
+                );
+            """)
+
+    def create_job(self, filename: str, file_bytes: bytes, memory: list, total: int) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, file, memory, total, status, heartbeat_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', 0, ?, ?)",
+                (job_id, filename, file_bytes, json.dumps(memory), total, now, now))
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Returns the job's status fields (without the uploaded file), or None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, total, status, error, created_at, updated_at, "
+                "(SELECT COUNT(*) FROM job_rows WHERE job_id = jobs.id) FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ["job_id", "filename", "total", "status", "error", "created_at", "updated_at", "completed"]
+        return dict(zip(keys, row))
+
+    def get_input(self, job_id: str) -> Tuple[str, bytes, list]:
+        with self._lock:
+            filename, file_bytes, memory = self._conn.execute(
+                "SELECT filename, file, memory FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return filename, file_bytes, json.loads(memory)
+
+    def claim(self, job_id: str) -> bool:
+        """Marks the job as running in this worker unless another live worker owns it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, updated_at = ? "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat_at < ?))",
+                (_WORKER_ID, now, now, job_id, now - JOB_STALE_SECONDS))
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ?",
+                               (time.time(), job_id, _WORKER_ID))
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (status, error, time.time(), job_id))
+
+    def unfinished_jobs(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+        return [row[0] for row in rows]
+
+    def save_row(self, job_id: str, position: int, outcome: RowOutcome) -> None:
+        result, error = outcome
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_rows (job_id, position, result, error) VALUES (?, ?, ?, ?)",
+                (job_id, position, json.dumps(result) if result is not None else None, error))
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def rows_after(self, job_id: str, seq: int = 0) -> List[Tuple[int, int, RowOutcome]]:
+        """Finished rows as (seq, position, outcome), in completion order, after the given seq."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, position, result, error FROM job_rows WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, seq)).fetchall()
+        return [(s, position, (json.loads(result) if result is not None else None, error))
+                for s, position, result, error in rows]
+
+
+class JobManager:
+    """Runs bulk jobs in the background and exposes their progress and results."""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def submit(self, filename: str, file_bytes: bytes, memory: list) -> Dict:
+        # Parsing and store writes run in threads so a large upload does not stall the event loop
+        df = await asyncio.to_thread(pd.read_excel, BytesIO(file_bytes))
+        job_id = await asyncio.to_thread(self.store.create_job, filename, file_bytes, memory, len(df.index))
+        logger.info(f"Created job {job_id} for {filename} with {len(df.index)} rows.")
+        self.start(job_id)
+        return await asyncio.to_thread(self.store.get_job, job_id)
+
+    def start(self, job_id: str) -> bool:
+        if job_id in self._tasks or not self.store.claim(job_id):
+            return False
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+        return True
+
+    def resume_unfinished(self) -> None:
+        """Restarts jobs that were queued or running when a previous server process stopped."""
+        for job_id in self.store.unfinished_jobs():
+            if self.start(job_id):
+                logger.info(f"Resuming job {job_id}.")
+
+    def watch(self, interval: float = JOB_SWEEP_SECONDS) -> None:
+        """
+        Resumes unfinished jobs now and then every `interval` seconds. A job whose worker
+        stopped keeps status 'running' until its heartbeat is JOB_STALE_SECONDS old, which
+        can be after this process started (e.g. a quick restart), so one check at startup
+        is not enough.
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep(interval))
+
+    def stop_watching(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep(self, interval: float) -> None:
+        while True:
+            try:
+                self.resume_unfinished()
+            except Exception as e:
+                logger.error(f"Failed to resume unfinished jobs: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            await asyncio.to_thread(self.store.heartbeat, job_id)
+
+    async def _run(self, job_id: str) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            # Parsing and store access run in threads so a large job does not stall the event loop
+            _, file_bytes, memory = await asyncio.to_thread(self.store.get_input, job_id)
+            df = await asyncio.to_thread(pd.read_excel, BytesIO(file_bytes))
+            done = {position for _, position, _ in await asyncio.to_thread(self.store.rows_after, job_id)}
+            pending_positions = [position for position in range(len(df.index)) if position not in done]
+
+            async def on_result(pending_position: int, outcome: RowOutcome) -> None:
+                await asyncio.to_thread(self.store.save_row, job_id, pending_positions[pending_position], outcome)
+
+            # Row traces are tagged with the job id, including after a resume
+            with request_context(job_id):
+                await run_bulk(df.iloc[pending_positions], memory, on_result=on_result)
+            await asyncio.to_thread(self.store.set_status, job_id, "completed")
+            logger.info(f"Job {job_id} completed.")
+        except Exception as e:
+            logger.critical(f"Job {job_id} failed: {str(e)}", exc_info=True)
+            await asyncio.to_thread(self.store.set_status, job_id, "failed", str(e))
+        finally:
+            heartbeat.cancel()
+            self._tasks.pop(job_id, None)
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict]:
+        """
+        Yields a status event, one 'row' event per finished row (already finished rows
+        first), and a final status event once the job completes or fails. Reads from the
+        store, so it works from any worker process.
+        """
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        yield {"type": "status", **job}
+        seq = 0
+        completed = 0
+        while True:
+            for seq, position, (result, error) in await asyncio.to_thread(self.store.rows_after, job_id, seq):
+                completed += 1
+                yield {"type": "row", "position": position, "result": result, "error": error,
+                       "completed": completed, "total": job["total"]}
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            if job["status"] in ("completed", "failed") and not await asyncio.to_thread(self.store.rows_after, job_id, seq):
+                yield {"type": "status", **job}
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    def build_result(self, job_id: str) -> Tuple[BytesIO, int, Dict]:
+        """Builds the processed workbook from the rows finished so far."""
+        _, file_bytes, _ = self.store.get_input(job_id)
+        df = pd.read_excel(BytesIO(file_bytes))
+        finished = sorted((position, outcome) for _, position, outcome in self.store.rows_after(job_id))
+        positions = [position for position, _ in finished]
+        output, errors_count = build_processed_workbook(df.iloc[positions], [outcome for _, outcome in finished])
+        return output, errors_count, self.store.get_job(job_id)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# code -> (names matched case-insensitively, abbreviations and statutes matched case-sensitively).
+# Sub-national codes are "<country>-<region>"; their parent is the part before the dash. Country
+# codes that double as common words or internal terms ("CA", "ID", "IN", "IT", and "FR", the
+# glossary's feature-rollout flag) are only recognized by name.
+JURISDICTIONS: Dict[str, Tuple[List[str], List[str]]] = {
+    "US": (["United States", "federal law", "U\\.S\\.C\\.?"], ["US", "USA", "U\\.S\\.", "COPPA", "NCMEC", "2258A", "CFAA"]),
+    "US-CA": (["California", "Cali"], ["CCPA", "CPRA", "SB ?976"]),
+    "US-UT": (["Utah"], []),
+    "US-FL": (["Florida"], ["HB ?3"]),
+    "US-TX": (["Texas"], ["SCOPE Act"]),
+    "US-NY": (["New York"], ["SAFE for Kids Act"]),
+    "US-VA": (["Virginia"], []),
+    "US-CO": (["Colorado"], []),
+    "US-CT": (["Connecticut"], []),
+    "US-AR": (["Arkansas"], []),
+    "US-LA": (["Louisiana"], []),
+    "EU": (["European Union", "Europe", "European", "Digital Services Act", "member states?"], ["EU", "EEA", "GDPR", "DSA", "DMA"]),
+    "EU-DE": (["Germany"], ["NetzDG"]),
+    "EU-FR": (["France"], []),
+    "EU-IE": (["Ireland"], []),
+    "EU-IT": (["Italy"], []),
+    "EU-ES": (["Spain"], []),
+    "EU-NL": (["Netherlands"], []),
+    "UK": (["United Kingdom", "Britain", "England"], ["UK", "Online Safety Act"]),
+    "CA": (["Canada", "Canadian"], []),
+    "BR": (["Brazil", "Brazilian"], ["BR", "LGPD"]),
+    "AU": (["Australia", "Australian"], ["AU"]),
+    "IN": (["India"], ["DPDP"]),
+    "CN": (["China", "PRC"], ["CN", "PIPL"]),
+    "JP": (["Japan"], ["JP", "APPI"]),
+    "KR": (["South Korea", "Korea"], ["KR"]),
+    "SG": (["Singapore"], ["SG", "PDPA"]),
+    "ID": (["Indonesia"], []),
+    "VN": (["Vietnam", "Viet Nam"], ["VN"]),
+    "TR": (["Türkiye", "Turkey"], []),
+    "RU": (["Russia", "Russian Federation"], ["RU"]),
+}
+GLOBAL = "" # Chunks of documents with no jurisdiction; every scoped search includes them
+# row_to_question joins the feature name and description without a space ("...Utah minorsTo comply with")
+JOINED_WORDS = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+# Identifies the tagging rules; part of the index settings, so changing them re-tags the corpus
+TAGGER_VERSION = hashlib.sha256(json.dumps(JURISDICTIONS, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def _pattern(aliases: List[str], flags: int) -> Optional[re.Pattern]:
+    if not aliases:
+        return None
+    return re.compile(r"(?<![\w.])(?:" + "|".join(aliases) + r")(?![\w])", flags)
+
+
+_PATTERNS = [(code, _pattern(names, re.IGNORECASE), _pattern(abbreviations, 0))
+             for code, (names, abbreviations) in JURISDICTIONS.items()]
+
+
+def parent(code: str) -> Optional[str]:
+    return code.rsplit("-", 1)[0] if "-" in code else None
+
+
+def with_parents(codes: Iterable[str]) -> List[str]:
+    """The codes and every enclosing jurisdiction (a Utah feature is also subject to US federal law)."""
+    expanded = []
+    for code in codes:
+        while code and code not in expanded:
+            expanded.append(code)
+            code = parent(code)
+    return expanded
+
+
+def mentions(text: str) -> Counter:
+    """How often each jurisdiction is mentioned in `text`."""
+    # Searched as written too, so camel-case names such as "NetzDG" are not split apart
+    variants = {text or "", JOINED_WORDS.sub(" ", text or "")}
+    counts = Counter()
+    for code, names, abbreviations in _PATTERNS:
+        found = max(sum(len(pattern.findall(variant)) for pattern in (names, abbreviations) if pattern is not None)
+                    for variant in variants)
+        if found:
+            counts[code] = found
+    return counts
+
+
+def extract(*texts: str) -> List[str]:
+    """Jurisdictions mentioned anywhere in `texts`, in table order. Empty means none were named."""
+    found = set()
+    for text in texts:
+        found.update(mentions(text))
+    return [code for code in JURISDICTIONS if code in found]
+
+
+def document_jurisdiction(file_path: str, text: str) -> str:
+    """
+    The jurisdiction a regulation document belongs to: the one named in its file name, or
+    else the one its opening text mentions most. GLOBAL if neither names one.
+    """
+    title = os.path.splitext(os.path.basename(file_path))[0].replace("_", " ")
+    for counts in (mentions(title), mentions(text)):
+        if counts:
+            # Most mentions first; among equals the most specific (a state over its country)
+            return max(counts, key=lambda code: (counts[code], code.count("-")))
+    return GLOBAL
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_ollama import ChatOllama
+
+LATENCY_WINDOW = 500 # Number of recent calls per endpoint used for latency percentiles
+KEEPALIVE_EXPIRY_SECONDS = 120 # Idle pooled connections are closed after this long
+
+
+@dataclass
+class OllamaEndpoint:
+    """An Ollama server with its own connection pool size, in-flight limit and timeout."""
+    name: str
+    base_url: str
+    max_in_flight: int
+    timeout: float
+    _slots: threading.BoundedSemaphore = field(init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW), init=False, repr=False)
+    in_flight: int = field(default=0, init=False)
+    requests: int = field(default=0, init=False)
+    errors: int = field(default=0, init=False)
+    last_error: Optional[str] = field(default=None, init=False)
+
+    def __post_init__(self):
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    def record(self, latency: float, error: Optional[BaseException]) -> None:
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            if error is not None:
+                self.errors += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight, requests, errors, last_error = self.in_flight, self.requests, self.errors, self.last_error
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "base_url": self.base_url,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": in_flight,
+            "requests": requests,
+            "errors": errors,
+            "error_rate": round(errors / requests, 4) if requests else 0.0,
+            "latency_p50_s": percentile(0.50),
+            "latency_p95_s": percentile(0.95),
+            "last_error": last_error,
+        }
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of Ollama clients and chains.
+
+    Each (endpoint, model, temperature) pair gets one ChatOllama whose httpx client keeps a
+    pool of keep-alive connections sized to the endpoint's in-flight limit, and each
+    (template, schema, ...) gets one compiled structured-output chain. `callbacks` are attached
+    to every chat model (e.g. token accounting). Calls should be wrapped
+    in `slot(endpoint)` so the per-endpoint concurrency limit and latency stats apply.
+    """
+
+    def __init__(self, endpoints: Dict[str, OllamaEndpoint], chat_options: Dict, keep_alive: str,
+                 callbacks: Optional[List] = None):
+        self.endpoints = endpoints
+        self.chat_options = chat_options
+        self.keep_alive = keep_alive
+        self.callbacks = callbacks or []
+        self._lock = threading.Lock()
+        self._clients: Dict[tuple, ChatOllama] = {}
+        self._chains: Dict[tuple, object] = {}
+
+    def http_client_kwargs(self, endpoint_name: str) -> Dict:
+        """httpx settings for an endpoint: its timeout and a keep-alive pool of max_in_flight connections."""
+        endpoint = self.endpoints[endpoint_name]
+        return {
+            "timeout": endpoint.timeout,
+            "limits": httpx.Limits(max_connections=endpoint.max_in_flight,
+                                   max_keepalive_connections=endpoint.max_in_flight,
+                                   keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS),
+        }
+
+    @contextmanager
+    def slot(self, endpoint_name: str):
+        """Waits for a free in-flight slot on the endpoint and records the call's latency and outcome."""
+        endpoint = self.endpoints[endpoint_name]
+        with endpoint._slots:
+            with endpoint._lock:
+                endpoint.in_flight += 1
+            start = time.perf_counter()
+            error = None
+            try:
+                yield
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                with endpoint._lock:
+                    endpoint.in_flight -= 1
+                endpoint.record(time.perf_counter() - start, error)
+
+    def chat_client(self, endpoint_name: str, model: str, temperature: Optional[float] = None) -> ChatOllama:
+        key = (endpoint_name, model, temperature)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = ChatOllama(
+                    model=model,
+                    base_url=self.endpoints[endpoint_name].base_url,
+                    temperature=temperature,
+                    keep_alive=self.keep_alive,
+                    client_kwargs=self.http_client_kwargs(endpoint_name),
+                    callbacks=self.callbacks,
+                    **self.chat_options,
+                )
+            return self._clients[key]
+
+    def structured_chain(self, template: str, schema: type, endpoint_name: str, model: str,
+                         temperature: Optional[float] = None):
+        """Returns a shared `prompt | llm.with_structured_output(schema)` chain."""
+        key = (template, schema, endpoint_name, model, temperature)
+        client = self.chat_client(endpoint_name, model, temperature)
+        with self._lock:
+            if key not in self._chains:
+                self._chains[key] = (ChatPromptTemplate.from_template(template)
+                                     | client.with_structured_output(schema, method='json_schema'))
+            return self._chains[key]
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: endpoint.stats() for name, endpoint in self.endpoints.items()}
+
+    def check_health(self, timeout: float = 5.0) -> Dict[str, Dict]:
+        """Probes every endpoint's /api/version and reports reachability and round-trip time."""
+        health = {}
+        for name, endpoint in self.endpoints.items():
+            start = time.perf_counter()
+            try:
+                response = httpx.get(f"{endpoint.base_url}/api/version", timeout=timeout)
+                response.raise_for_status()
+                health[name] = {"ok": True, "version": response.json().get("version"),
+                                "latency_s": round(time.perf_counter() - start, 3)}
+            except Exception as e:
+                health[name] = {"ok": False, "error": f"{type(e).__name__}: {e}",
+                                "latency_s": round(time.perf_counter() - start, 3)}
+        return health
@@ -0,0 +1,123 @@
+import hashlib
+
+# Prompt templates shared by the LangGraph nodes (and anything else that needs to build
+# the same prompts, such as training-data generation). PROMPT_VERSION changes whenever
+# any template changes, which invalidates cached pipeline results.
+
+REWRITE_PROMPT = (
+    "You are an AI-powered geo-regulation checker. Your task is to analyze a given feature description and determine if it requires geo-specific compliance actions. \n\n"
+    "If it does not seem like a feature, there is no need for a specific area of concern, just state that. \n\n"
+    "Based on the following feature description, determine if there are any potential geo-compliance issues, requirements, or areas of concern that would be related. If there is none, just state that. Focus on high-level concepts rather than specific laws. \n\n"
+    "---FEATURE DESCRIPTION---"
+    "{question}"
+    "---TERMINOLOGY---"
+    "{terminology}"
+    "---ADDITIONAL CONTEXT---"
+    "{memory}"
+    "\n\n"
+    "Answer in a detailed, bulleted list. Each bullet point should start with a specific area of concern (e.g., 'Age Verification', 'Data Privacy', 'Parental Consent') followed by a brief explanation of why this feature might be at risk."
+)
+
+GENERATE_INSTRUCTIONS = (
+    "You are an AI-powered geo-regulation checker. Your task is to analyze "
+    "the provided context to determine if a feature requires geo-specific compliance actions to meet legal requirement. "
+    "If the feature is business driven, select 'No Compliance Logic Needed'. If uncertain, select 'Requires Further Review'. "
+    "If it is a feature and no intention is specified, select 'Requires Further Review'. "
+    "Your final answer MUST be in the specified JSON format."
+    "\n\n"
+    "---EXAMPLES---"
+    "'Feature reads user location to enforce France's copyright rules (download blocking)' - 'Compliance Logic Needed'"
+    "'Geofences feature rollout in US for market testing' - 'No Compliance Logic Needed' (Business decision, not regulatory)'"
+    "'A video filter feature is available globally except KR' - 'Requires Further Review' (didn't specify the intention, need human evaluation)"
+)
+
+GENERATE_PROMPT = GENERATE_INSTRUCTIONS + (
+    "---CONTEXT---"
+    "{context}"
+    "\n\n"
+    "---TERMINOLOGY---"
+    "{terminology}"
+    "\n\n"
+    "---ADDITIONAL CONTEXT---"
+    "{memory}"
+    "\n\n"
+    "---USER QUESTION---"
+    "Here is the feature and feature description to validate:"
+    "{question}"
+    "\n\n"
+    "{feedback}"
+)
+
+VALIDATOR_INSTRUCTIONS = (
+    "You are a validation assistant. Your task is to analyze a 'Generated Answer' against 'Provided Documents' and a 'User Question' based on the following criteria:"
+    "Ensure that the reasoning and supporting regulations in the Generated Answer can be found in the Provided Documents."
+    "Ensure that there is no hallucination or fabrication of facts in the Generated Answer and no repetition of the User Question."
+    "Your final answer MUST be in the specified JSON format with a verdict ('Supported', 'Not Supported', or 'Requires Review') and a confidence score from 0.0 to 1.0. where 1.0 means completely certain."
+    "\n\n"
+)
+
+VALIDATOR_PROMPT = VALIDATOR_INSTRUCTIONS + (
+    "---USER QUESTION---"
+    "{question}"
+    "\n\n"
+    "---PROVIDED DOCUMENTS---"
+    "{documents}"
+    "\n\n"
+    "---GENERATED ANSWER---"
+    "{generation}"
+    "\n\n"
+)
+
+# Batched variants for bulk runs: the instructions once, then one block per feature. The
+# model must return one result per block, in order.
+BATCH_GENERATE_PROMPT = GENERATE_INSTRUCTIONS + (
+    "\n\n"
+    "---ADDITIONAL CONTEXT---"
+    "{memory}"
+    "\n\n"
+    "Below are {count} features, each with its own context. Analyze each feature only against its own context. "
+    "Return exactly {count} results, one per feature, in the order the features are given."
+    "\n\n"
+    "{features}"
+)
+
+BATCH_GENERATE_ITEM = (
+    "---FEATURE {number}---"
+    "\n"
+    "---CONTEXT---"
+    "{context}"
+    "\n\n"
+    "---TERMINOLOGY---"
+    "{terminology}"
+    "\n\n"
+    "---USER QUESTION---"
+    "Here is the feature and feature description to validate:"
+    "{question}"
+    "\n\n"
+)
+
+BATCH_VALIDATOR_PROMPT = VALIDATOR_INSTRUCTIONS + (
+    "Below are {count} items, each with its own question, documents and generated answer. Judge each item only against its own documents. "
+    "Return exactly {count} results, one per item, in the order the items are given."
+    "\n\n"
+    "{items}"
+)
+
+BATCH_VALIDATOR_ITEM = (
+    "---ITEM {number}---"
+    "\n"
+    "---USER QUESTION---"
+    "{question}"
+    "\n\n"
+    "---PROVIDED DOCUMENTS---"
+    "{documents}"
+    "\n\n"
+    "---GENERATED ANSWER---"
+    "{generation}"
+    "\n\n"
+)
+
+PROMPT_VERSION = hashlib.sha256(
+    "\x00".join([REWRITE_PROMPT, GENERATE_PROMPT, VALIDATOR_PROMPT, BATCH_GENERATE_PROMPT, BATCH_GENERATE_ITEM,
+                 BATCH_VALIDATOR_PROMPT, BATCH_VALIDATOR_ITEM]).encode("utf-8")
+).hexdigest()[:16]
@@ -1,29 +1,85 @@
+import asyncio
+import contextvars
+import hashlib
 import json
 import os
-import pandas as pd
-from typing import TypedDict, List, Literal
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader
-from langchain_community.vectorstores import FAISS
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import AsyncIterator, TypedDict, List, Literal
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import OllamaEmbeddings
-from langchain_ollama import ChatOllama
 from langgraph.graph import StateGraph, END
+from context_budget import count_tokens, cap_memory, fit_to_budgets
+from corpus import Corpus
+from fast_path import FastPathClassifier, IntentModel, FAST_PATH_TAG, load_calibration, regulation_title
+from ingestion import Ingestor
+from jurisdictions import TAGGER_VERSION, extract as extract_jurisdictions
+from index_store import configure_search
+from prompts import (REWRITE_PROMPT, GENERATE_PROMPT, VALIDATOR_PROMPT, BATCH_GENERATE_PROMPT, BATCH_GENERATE_ITEM,
+                     BATCH_VALIDATOR_PROMPT, BATCH_VALIDATOR_ITEM, PROMPT_VERSION)
+from batching import MicroBatcher
+from result_cache import ResultCache
+from embedding_backend import create_embeddings
+from llm_clients import LLMClientRegistry, OllamaEndpoint
+from retrieval import HybridRetriever, CrossEncoderReranker
+from terminology import load_terminology
+from tracing import traced, log_event, annotate, record_validation, record_cache_lookup, record_context_budget, record_fast_path, record_batch, record_retrieval_scope, TokenUsageCallback
+import tracing
+from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 import logging
 
 # --- 1. CONFIGURATION ---
-# Define all configurations in one place for easy modification
-OLLAMA_BASE_URL = "http://25.1.81.74:8080"
-OLLAMA_VERIFICATION_BASE_URL = "http://25.1.81.74:8001"
-LLM_MODEL = "qwen3:8b"
-LLM_VALIDATOR = "qwen3:1.7b"  # Specific model for the validation step
-EMBEDDING_MODEL = "nomic-embed-text"
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
-MAX_RETRIES = 3 # Maximum number of retries for the generation step
+# Define all configurations in one place for easy modification.
+# Deployment-specific values can be overridden with environment variables or a .env file.
+load_dotenv()
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://25.1.81.74:8080")
+OLLAMA_VERIFICATION_BASE_URL = os.getenv("OLLAMA_VERIFICATION_BASE_URL", "http://25.1.81.74:8001")
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_TIMEOUT_SECONDS", "300")) # Per-request timeout against OLLAMA_BASE_URL
+OLLAMA_VERIFICATION_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_VERIFICATION_TIMEOUT_SECONDS", "120")) # Per-request timeout against OLLAMA_VERIFICATION_BASE_URL
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen3:8b")
+LLM_VALIDATOR = os.getenv("LLM_VALIDATOR", "qwen3:1.7b")  # Specific model for the validation step
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama") # "ollama" (remote server) or "sentence-transformers" (local CPU)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text" if EMBEDDING_BACKEND == "ollama" else "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64")) # Texts sent to the embedding backend per request
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000")) # Characters per regulation chunk; changing it re-chunks and re-embeds the corpus
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))) # Processes parsing and chunking regulation files; 1 parses in the server process
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8")) # PDF pages handed to a worker at a time
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3")) # Maximum number of retries for the generation step
+SPECULATIVE_FANOUT = int(os.getenv("SPECULATIVE_FANOUT", "1")) # Candidate answers generated and validated in parallel per round; 1 keeps the serial generate/check loop
+SPECULATIVE_BUDGET = int(os.getenv("SPECULATIVE_BUDGET", str(MAX_RETRIES * SPECULATIVE_FANOUT))) # Most candidates generated for one question across all rounds
 HALLUCINATION_CONFIDENCE_THRESHOLD = 0.7 # Minimum confidence score to pass the hallucination check
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "0") == "1" # Answer obviously legal or business-driven rows without the LLMs
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.9")) # Rule/model confidence needed to skip the graph
+CACHE_DIR = os.getenv("CACHE_DIR", "cache") # Root directory for on-disk caches
+INDEX_CACHE_DIR = os.path.join(CACHE_DIR, "index") # Content-addressed FAISS shards and merged indexes
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite") # Vectors keyed by a hash of model and text
+FAST_PATH_MODEL_PATH = os.getenv("FAST_PATH_MODEL_PATH", os.path.join(CACHE_DIR, "fast_path_model.npz")) # Optional classifier from `python -m fast_path train`; rules only if absent
+FAST_PATH_CALIBRATION_PATH = os.getenv("FAST_PATH_CALIBRATION_PATH", "") # `python -m benchmarks.evaluate` report the rule confidences are measured in; rules never skip the graph without one
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat") # "flat" (exact), "hnsw", "ivfpq", "sq8", or any FAISS index_factory string
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16")) # IVF lists scanned per query; higher trades speed for recall
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64")) # HNSW candidate list size per query; higher trades speed for recall
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4")) # Chunks passed to the generate/check prompts
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20")) # Candidates taken from each of BM25 and FAISS before fusion
+RETRIEVAL_RRF_K = 60 # Reciprocal rank fusion constant
+GENERATION_CONTEXT_TOKENS = int(os.getenv("GENERATION_CONTEXT_TOKENS", "1500")) # Retrieved-context budget in the LLM_MODEL prompt; 0 sends every chunk whole
+VALIDATOR_CONTEXT_TOKENS = int(os.getenv("VALIDATOR_CONTEXT_TOKENS", str(GENERATION_CONTEXT_TOKENS))) # Retrieved-context budget in the LLM_VALIDATOR prompt; below GENERATION_CONTEXT_TOKENS it keeps the generator's most relevant sentences; 0 sends the generator's context whole
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "500")) # Most recent memory entries kept in prompts; 0 keeps all
+JURISDICTION_ROUTING_ENABLED = os.getenv("JURISDICTION_ROUTING_ENABLED", "1") == "1" # Only search the regulations of the jurisdictions a question names (with their parents and untagged ones)
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "") # Optional CPU cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+OLLAMA_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "4")) # Concurrent requests allowed against OLLAMA_BASE_URL
+OLLAMA_VERIFICATION_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_VERIFICATION_MAX_IN_FLIGHT", "4")) # Concurrent requests allowed against OLLAMA_VERIFICATION_BASE_URL
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "8")) # Rows processed at once by the bulk engine
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1")) # Bulk rows answered by one generate call and checked by one validation call; 1 sends each row alone
+BULK_BATCH_WAIT_SECONDS = float(os.getenv("BULK_BATCH_WAIT_SECONDS", "0.5")) # Longest a bulk row waits for others to fill its batch
+BULK_STREAM_WINDOW = int(os.getenv("BULK_STREAM_WINDOW", str(BULK_MAX_CONCURRENCY * 4))) # Rows read ahead of the oldest unfinished one when /excel streams; bounds its reorder buffer
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1" # Reuse answers for repeated feature descriptions
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, "results.sqlite")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "20000")) # Least recently used entries are evicted above this
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600))) # Cached answers expire after a week
+RESULT_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESULT_CACHE_SIMILARITY_THRESHOLD", "0")) # Cosine similarity for near-duplicate hits; 0 disables
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -33,19 +89,36 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
 
-# Document paths for loading
-DOCUMENT_PATHS = [
-    "regulations/18_US_Code_2258A.pdf",
-    "regulations/Cali_State_Law_Social_Media_Addication_Act.pdf",
-    "regulations/EU_DSA.pdf",
-    "regulations/Florida_Online_Protections_Minors.pdf",
-    "regulations/Utah_Social_Media_Regulation_Act.pdf",
-    "terminologies/terminologies.xlsx"
-]
+# Every .pdf/.txt/.docx file in this directory is indexed. Files can be added, replaced or
+# removed at runtime through the /admin/documents endpoints or by the directory watcher.
+REGULATIONS_DIR = os.getenv("REGULATIONS_DIR", "regulations")
+CORPUS_WATCH_INTERVAL_SECONDS = float(os.getenv("CORPUS_WATCH_INTERVAL_SECONDS", "30")) # How often the API polls REGULATIONS_DIR for changes; 0 disables
+
+# Internal jargon glossary. It is matched directly against feature descriptions instead of
+# being embedded, so glossary rows no longer compete with statute text for retrieval slots.
+TERMINOLOGY_PATH = "terminologies/terminologies.xlsx"
 
 OLLAMA_CHAT_OPTIONS = {
     "num_predict": 2048, # Sets the max tokens to generate
 }
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m") # Keeps models (and their prompt KV cache) loaded between calls
+GENERATION_TEMPERATURE = 0.6 # Temperature for the first generation attempt
+GENERATION_RETRY_TEMPERATURE_STEP = 0.15 # Added per retry so a rejected answer is not simply reproduced
+GENERATION_MAX_TEMPERATURE = 1.0
+
+# Shared Ollama clients. Each endpoint gets its own in-flight limit so bulk runs cannot
+# overload the smaller verification box while the generation box still has capacity.
+GENERATION_ENDPOINT = "generation"
+VERIFICATION_ENDPOINT = "verification"
+llm_clients = LLMClientRegistry(
+    endpoints={
+        GENERATION_ENDPOINT: OllamaEndpoint(GENERATION_ENDPOINT, OLLAMA_BASE_URL, OLLAMA_MAX_IN_FLIGHT, OLLAMA_TIMEOUT_SECONDS),
+        VERIFICATION_ENDPOINT: OllamaEndpoint(VERIFICATION_ENDPOINT, OLLAMA_VERIFICATION_BASE_URL, OLLAMA_VERIFICATION_MAX_IN_FLIGHT, OLLAMA_VERIFICATION_TIMEOUT_SECONDS),
+    },
+    chat_options=OLLAMA_CHAT_OPTIONS,
+    keep_alive=OLLAMA_KEEP_ALIVE,
+    callbacks=[TokenUsageCallback()],
+)
 
 class ComplianceStatus(BaseModel):
     """
@@ -68,6 +141,15 @@ class ComplianceStatus(BaseModel):
         description="A brief explanation of why this compliance status was determined. If the feature is business driven, explain why no compliance logic is needed. If unsure or does not look like a feature, explain why it was classified as such. If no intention for the feature is specified, explain that it requires further review."
     )
 
+class ComplianceStatusBatch(BaseModel):
+    """
+    Answers for a batch of features, in the order the features were given.
+    """
+    results: List[ComplianceStatus] = Field(
+        ...,
+        description="One answer per feature, in the same order as the features."
+    )
+
 class HallucinationCheckResult(BaseModel):
     """
     Structured output for the hallucination check.
@@ -80,59 +162,87 @@ class HallucinationCheckResult(BaseModel):
         ...,
         description="A confidence score from 0.0 to 1.0 indicating the certainty of the verdict. 1.0 means completely certain."
     )
+    reason: str = Field(
+        "",
+        description="If the answer is not fully supported, a short note on which claims or regulations are missing from the documents."
+    )
+
+class HallucinationCheckBatch(BaseModel):
+    """
+    Hallucination checks for a batch of generated answers, in the order the items were given.
+    """
+    results: List[HallucinationCheckResult] = Field(
+        ...,
+        description="One check per item, in the same order as the items."
+    )
 
 # --- 2. DOCUMENT LOADING AND PROCESSING ---
-def load_excel_as_documents(excel_path: str) -> List[Document]:
-    """Loads an Excel file and converts each row into a LangChain Document."""
-    try:
-        df = pd.read_excel(excel_path)
-        documents = []
-        for index, row in df.iterrows():
-            # Create a combined string from all row values
-            content = ", ".join([f"{col}: {value}" for col, value in row.items()])
-            # Store the entire row as metadata
-            metadata = row.to_dict()
-            documents.append(Document(page_content=content, metadata=metadata))
-        return documents
-    except Exception as e:
-        print(f"Error loading Excel file {excel_path}: {e}")
-        return []
+# Load, split, and create vector store. Only files whose content or index settings
+# changed since the last start are re-embedded; otherwise the saved index is memory-mapped.
+# New files are parsed across a process pool and embedded in batches as their chunks arrive.
+# Queries read `corpus.snapshot`, which ingestion replaces atomically.
+embeddings = create_embeddings(EMBEDDING_BACKEND, EMBEDDING_MODEL, OLLAMA_BASE_URL,
+                               cache_path=EMBEDDING_CACHE_PATH, batch_size=EMBEDDING_BATCH_SIZE,
+                               client_kwargs=llm_clients.http_client_kwargs(GENERATION_ENDPOINT))
+
+INDEX_SETTINGS = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "embedding_model": f"{EMBEDDING_BACKEND}:{EMBEDDING_MODEL}",
+                  "jurisdiction_tagger": TAGGER_VERSION}
+ingestor = Ingestor(embeddings, INDEX_CACHE_DIR, CHUNK_SIZE, CHUNK_OVERLAP, batch_size=EMBEDDING_BATCH_SIZE,
+                    workers=INGEST_WORKERS, pages_per_task=INGEST_PAGES_PER_TASK)
+term_matcher = load_terminology(TERMINOLOGY_PATH)
+fast_path = None
+
+# Hybrid retrieval: BM25 over chunk text fused with FAISS hits, optionally reranked
+reranker = CrossEncoderReranker(RERANKER_MODEL) if RERANKER_MODEL else None
+
+def make_retriever(vectorstore) -> HybridRetriever:
+    configure_search(vectorstore.index, VECTOR_INDEX_NPROBE, VECTOR_INDEX_EF_SEARCH)
+    return HybridRetriever(vectorstore, k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K, rrf_k=RETRIEVAL_RRF_K, reranker=reranker)
+
+def on_corpus_swap(snapshot) -> None:
+    """Answers cached against the previous corpus are stale once a new snapshot is live."""
+    logger.info(f"Corpus updated to revision {snapshot.revision} (index {snapshot.version[:12]}, {len(snapshot.documents)} documents)")
+    if result_cache is not None:
+        result_cache.invalidate_other_namespaces(result_cache_namespace())
+    if fast_path is not None:
+        fast_path.set_titles(regulation_title(doc_id) for doc_id in snapshot.documents)
+
+corpus = Corpus(
+    REGULATIONS_DIR, embeddings, ingestor.build_shards,
+    index_settings=INDEX_SETTINGS, cache_dir=INDEX_CACHE_DIR,
+    make_retriever=make_retriever, on_swap=on_corpus_swap, index_type=VECTOR_INDEX_TYPE,
+)
 
-def load_documents_from_paths(file_paths: List[str]) -> List[Document]:
-    """Loads documents from a list of file paths based on file extension."""
-    all_documents = []
-    for file_path in file_paths:
-        _, extension = os.path.splitext(file_path)
-        extension = extension.lower()
-        
-        try:
-            if extension == ".xlsx":
-                documents = load_excel_as_documents(file_path)
-                all_documents.extend(documents)
-            else:
-                if extension == ".txt":
-                    loader = TextLoader(file_path)
-                elif extension == ".pdf":
-                    loader = PyPDFLoader(file_path)
-                elif extension == ".docx":
-                    loader = Docx2txtLoader(file_path)
-                else:
-                    print(f"Unsupported file type: {extension} for path: {file_path}")
-                    continue
-                all_documents.extend(loader.load())
-        except Exception as e:
-            print(f"Error loading {file_path}: {e}")
-    return all_documents
-
-# Load, split, and create vector store
-all_documents = load_documents_from_paths(DOCUMENT_PATHS)
-
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-texts = text_splitter.split_documents(all_documents)
-
-embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
-vectorstore = FAISS.from_documents(texts, embeddings)
-retriever = vectorstore.as_retriever()
+# Rules drawn from the regulation titles and the glossary, plus the trained model if there is one
+if FAST_PATH_ENABLED:
+    print("---LOADING FAST-PATH CLASSIFIER---")
+    fast_path = FastPathClassifier((regulation_title(doc_id) for doc_id in corpus.snapshot.documents), term_matcher,
+                                   IntentModel.load(FAST_PATH_MODEL_PATH) if os.path.exists(FAST_PATH_MODEL_PATH) else None,
+                                   FAST_PATH_MIN_CONFIDENCE,
+                                   load_calibration(FAST_PATH_CALIBRATION_PATH) if FAST_PATH_CALIBRATION_PATH else None)
+
+# Answers depend on the models, the indexed corpus, the prompts and the output schemas.
+# Anything cached under a different combination is stale.
+def result_cache_namespace() -> str:
+    schemas = json.dumps([ComplianceStatus.model_json_schema(), HallucinationCheckResult.model_json_schema()], sort_keys=True)
+    glossary = json.dumps(term_matcher.glossary, sort_keys=True)
+    retrieval = (f"k={RETRIEVAL_K},fetch_k={RETRIEVAL_FETCH_K},rrf_k={RETRIEVAL_RRF_K},reranker={RERANKER_MODEL},"
+                 f"nprobe={VECTOR_INDEX_NPROBE},ef_search={VECTOR_INDEX_EF_SEARCH},"
+                 f"budgets={GENERATION_CONTEXT_TOKENS}/{VALIDATOR_CONTEXT_TOKENS}/{MEMORY_MAX_TOKENS},"
+                 f"jurisdictions={JURISDICTION_ROUTING_ENABLED}")
+    return "|".join([LLM_MODEL, LLM_VALIDATOR, str(HALLUCINATION_CONFIDENCE_THRESHOLD), corpus.snapshot.version, PROMPT_VERSION,
+                     retrieval, hashlib.sha256((schemas + glossary).encode("utf-8")).hexdigest()[:16]])
+
+result_cache = None
+if RESULT_CACHE_ENABLED:
+    result_cache = ResultCache(
+        RESULT_CACHE_PATH,
+        max_entries=RESULT_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        similarity_threshold=RESULT_CACHE_SIMILARITY_THRESHOLD or None,
+        embed_fn=embeddings.embed_query,
+    )
+    result_cache.invalidate_other_namespaces(result_cache_namespace())
 
 # --- 3. LANGGRAPH SETUP ---
 class GraphState(TypedDict):
@@ -145,158 +255,219 @@ class GraphState(TypedDict):
     is_supported: bool
     hallucination_verdict: str
     hallucination_confidence: float
+    terminology: List[str]
+    jurisdictions: List[str]
+    # Artifacts computed once per question and reused by every generate/check retry
+    context: str
+    validator_context: str
+    prompt_prefix_tokens: int
+    validation_feedback: str
+    candidates: int
+    fast_path: bool
+    batched: bool
+
+def format_terminology(state: GraphState) -> str:
+    return "\n".join(state.get("terminology") or []) or "None"
+
+def classify_fast_path(state: GraphState) -> GraphState:
+    """
+    Answers the feature straight from the fast-path classifier when it is confident, without
+    calling the LLMs. Requests with memory always take the full graph, since memory may
+    overrule what the rules would say.
+    """
+    decision = None if any(str(entry).strip() for entry in state["memory"]) else fast_path.classify(state["question"])
+    if decision is None:
+        record_fast_path("graph")
+        return {"fast_path": False}
+
+    record_fast_path("bypass", decision.source, decision.label)
+    log_event("fast_path_answered", label=decision.label, source=decision.source, confidence=round(decision.confidence, 3))
+    answer = ComplianceStatus(**decision.answer())
+    return {"fast_path": True, "generation": answer.model_dump_json(indent=2), "is_supported": True}
+
+def route_fast_path(state: GraphState):
+    return "end" if state["fast_path"] else "graph"
+
+def expand_terminology(state: GraphState) -> GraphState:
+    """Looks up internal abbreviations used in the feature description in the glossary."""
+    terminology = term_matcher.expand(state["question"])
+    log_event("terminology_expanded", terms=terminology)
+    return {"terminology": terminology}
 
 def rewrite_question(state: GraphState) -> GraphState:
     """
     Analyzes the user's feature description and generates a list of
     potential geo-compliance areas for investigation.
     """
-    print("---ANALYZING FEATURE FOR COMPLIANCE CONCEPTS---")
     question = state["question"]
     memory = state["memory"]
     
-    analysis_prompt = ChatPromptTemplate.from_template(
-        "You are an AI-powered geo-regulation checker. Your task is to analyze a given feature description and determine if it requires geo-specific compliance actions. \n\n"
-        "If it does not seem like a feature, there is no need for a specific area of concern, just state that. \n\n"
-        "Based on the following feature description, determine if there are any potential geo-compliance issues, requirements, or areas of concern that would be related. If there is none, just state that. Focus on high-level concepts rather than specific laws. \n\n"
-        "---FEATURE DESCRIPTION---"
-        "{question}"
-        "---ADDITIONAL CONTEXT---"
-        "{memory}"
-        "\n\n"
-        "Answer in a detailed, bulleted list. Each bullet point should start with a specific area of concern (e.g., 'Age Verification', 'Data Privacy', 'Parental Consent') followed by a brief explanation of why this feature might be at risk."
-    )
+    analysis_prompt = ChatPromptTemplate.from_template(REWRITE_PROMPT)
+    analysis_chain = analysis_prompt | llm_clients.chat_client(GENERATION_ENDPOINT, LLM_MODEL)
 
-    rewrite_llm = ChatOllama(model=LLM_MODEL, base_url=OLLAMA_BASE_URL,
-        )
-    analysis_chain = analysis_prompt | rewrite_llm
-
-    compliance_concepts_response = analysis_chain.invoke({"question": question, "memory": memory})
+    with llm_clients.slot(GENERATION_ENDPOINT):
+        compliance_concepts_response = analysis_chain.invoke({"question": question, "memory": memory,
+                                                              "terminology": format_terminology(state)})
 
     rewritten_question_str = compliance_concepts_response.content.strip()
     
-    print(f"Original question: '{question}'")
-    print(f"Generated compliance concepts:\n{rewritten_question_str}")
+    log_event("question_rewritten", original=question, concepts=rewritten_question_str)
+
+    # Jurisdictions named in the feature itself, its glossary terms, or the rewrite narrow retrieval
+    jurisdictions = extract_jurisdictions(question, format_terminology(state), rewritten_question_str)
+    log_event("jurisdictions_detected", jurisdictions=jurisdictions)
 
-    return {"question": rewritten_question_str, "documents": None, "generation": None, "retries": 0, "is_supported": False, "hallucination_verdict": "", "hallucination_confidence": 0.0}
+    return {"question": rewritten_question_str, "jurisdictions": jurisdictions, "documents": None, "generation": None, "retries": 0, "is_supported": False, "hallucination_verdict": "", "hallucination_confidence": 0.0, "validation_feedback": "", "candidates": 0}
+
+def fit_context(documents: List[Document], question: str) -> tuple:
+    """The retrieved chunks as they appear in the generate and check prompts, each within its model's budget."""
+    return fit_to_budgets(documents, question, CHUNK_OVERLAP, GENERATION_CONTEXT_TOKENS, VALIDATOR_CONTEXT_TOKENS)
 
 def retrieve_documents(state: GraphState) -> GraphState:
     """Retrieves documents based on the question and updates the state."""
-    print("---RETRIEVING DOCUMENTS---")
     question = state["question"]
 
-    documents = retriever.invoke(question)
+    retriever = corpus.snapshot.retriever
+    jurisdictions = state.get("jurisdictions") or []
+    scope = retriever.scope(jurisdictions) if JURISDICTION_ROUTING_ENABLED else None
+    if scope is not None:
+        record_retrieval_scope("narrowed", jurisdictions, scope.size, len(retriever.ids))
+    else:
+        routed = JURISDICTION_ROUTING_ENABLED and jurisdictions
+        record_retrieval_scope("fallback" if routed else "all", jurisdictions, len(retriever.ids), len(retriever.ids))
+
+    # Query embeddings only hit the Ollama server when it is the embedding backend
+    with llm_clients.slot(GENERATION_ENDPOINT) if EMBEDDING_BACKEND == "ollama" else nullcontext():
+        documents = retriever.invoke(question, scope)
 
-    return {"documents": documents, "question": question}
+    # Fit the context to each model's budget once; every generate/check retry reuses it. The
+    # generate prompt is laid out so everything up to the question is identical across
+    # retries, letting Ollama reuse the KV cache for that prefix. Neighbouring chunks share
+    # CHUNK_OVERLAP characters, which are sent only once.
+    retrieved_tokens = count_tokens("\n\n".join(doc.page_content for doc in documents))
+    context_str, validator_context = fit_context(documents, question)
+    record_context_budget("context", LLM_MODEL, retrieved_tokens, count_tokens(context_str))
+    record_context_budget("validator_context", LLM_VALIDATOR, retrieved_tokens, count_tokens(validator_context))
+
+    prefix = GENERATE_PROMPT.split("{question}")[0].format(context=context_str, memory=state["memory"],
+                                                           terminology=format_terminology(state))
+
+    annotate(documents=len(documents), prompt_prefix_tokens=count_tokens(prefix))
+    return {"documents": documents, "question": question, "context": context_str, "validator_context": validator_context,
+            "prompt_prefix_tokens": count_tokens(prefix)}
 
 def generate_answer(state: GraphState) -> GraphState:
     """Generates a structured answer using retrieved documents and updates the state."""
-    print("---GENERATING STRUCTURED ANSWER---")
     question = state["question"]
-    documents = state["documents"]
     memory = state["memory"]
+    retries = state.get("retries", 0)
 
-    prompt_template = (
-        "You are an AI-powered geo-regulation checker. Your task is to analyze "
-        "the provided context to determine if a feature requires geo-specific compliance actions to meet legal requirement. "
-        "If the feature is business driven, select 'No Compliance Logic Needed'. If uncertain, select 'Requires Further Review'. "
-        "If it is a feature and no intention is specified, select 'Requires Further Review'. "
-        "Your final answer MUST be in the specified JSON format."
-        "\n\n"
-        "---EXAMPLES---"
-        "'Feature reads user location to enforce France's copyright rules (download blocking)' - 'Compliance Logic Needed'"
-        "'Geofences feature rollout in US for market testing' - 'No Compliance Logic Needed' (Business decision, not regulatory)'"
-        "'A video filter feature is available globally except KR' - 'Requires Further Review' (didn't specify the intention, need human evaluation)"
-        "---CONTEXT---"
-        "{context}"
-        "\n\n"
-        "---ADDITIONAL CONTEXT---"
-        "{memory}"
-        "\n\n"
-        "---USER QUESTION---"
-        "Here is the feature and feature description to validate:"
-        "{question}"
-        "\n\n"
-    )
-
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    llm = ChatOllama(model=LLM_MODEL, base_url=OLLAMA_BASE_URL,
-        **OLLAMA_CHAT_OPTIONS)
-    
-    structured_llm = llm.with_structured_output(ComplianceStatus, method='json_schema')
-    rag_chain = prompt | structured_llm
-    context_str = "\n\n".join([doc.page_content for doc in documents])
-    
-    generation = rag_chain.invoke({"context": context_str, "question": question, "memory": memory})
+    # Retries only change the trailing feedback and the sampling temperature; the shared
+    # prefix (instructions, examples, context, memory) stays cached on the server.
+    temperature = min(GENERATION_TEMPERATURE + retries * GENERATION_RETRY_TEMPERATURE_STEP, GENERATION_MAX_TEMPERATURE)
+    rag_chain = llm_clients.structured_chain(GENERATE_PROMPT, ComplianceStatus, GENERATION_ENDPOINT, LLM_MODEL, temperature)
+
+    annotate(attempt=retries + 1, temperature=round(temperature, 2))
+    generation = None
+    if state.get("batched") and retries == 0:
+        # A bulk row's first attempt shares one call with other rows; retries and rows the
+        # batch could not answer are generated on their own below
+        generation, size = generation_batcher.submit(json.dumps(memory, default=str), {
+            "context": state["context"], "question": question, "memory": memory, "terminology": format_terminology(state)})
+        record_batch("generate", size, generation is not None)
+    if generation is None:
+        with llm_clients.slot(GENERATION_ENDPOINT):
+            generation = rag_chain.invoke({"context": state["context"], "question": question, "memory": memory,
+                                           "terminology": format_terminology(state),
+                                           "feedback": state.get("validation_feedback", "")})
     generation_str = generation.model_dump_json(indent=2)
 
-    return {"documents": documents, "question": question, "generation": generation_str}
+    return {"generation": generation_str}
 
 def check_hallucination(state: GraphState) -> GraphState:
     """
     Validates the generated answer against the retrieved documents using a smaller LLM.
     Returns a structured output with a verdict and confidence.
     """
-    print("---CHECKING FOR HALLUCINATIONS WITH VALIDATOR LLM---")
     question = state["question"]
     generation_str = state["generation"]
-    documents = state["documents"]
 
     retries = state.get("retries", 0) + 1
-    
-    validator_llm = ChatOllama(model=LLM_VALIDATOR, base_url=OLLAMA_VERIFICATION_BASE_URL,
-        )
-
-    validator_prompt = ChatPromptTemplate.from_template(
-        "You are a validation assistant. Your task is to analyze a 'Generated Answer' against 'Provided Documents' and a 'User Question' based on the following criteria:"
-        "Ensure that the reasoning and supporting regulations in the Generated Answer can be found in the Provided Documents."
-        "Ensure that there is no hallucination or fabrication of facts in the Generated Answer and no repetition of the User Question."
-        "Your final answer MUST be in the specified JSON format with a verdict ('Supported', 'Not Supported', or 'Requires Review') and a confidence score from 0.0 to 1.0. where 1.0 means completely certain."
-        "\n\n"
-        "---USER QUESTION---"
-        "{question}"
-        "\n\n"
-        "---PROVIDED DOCUMENTS---"
-        "{documents}"
-        "\n\n"
-        "---GENERATED ANSWER---"
-        "{generation}"
-        "\n\n"
-    )
-
-    structured_validator = validator_llm.with_structured_output(HallucinationCheckResult, method='json_schema')
-    validator_chain = validator_prompt | structured_validator
+    validator_chain = llm_clients.structured_chain(VALIDATOR_PROMPT, HallucinationCheckResult, VERIFICATION_ENDPOINT, LLM_VALIDATOR)
+    reason = ""
 
     try:
         # Check if the generated string is valid JSON before invoking the validator
         json.loads(generation_str)
 
-        validation_response = validator_chain.invoke({
-            "question": question,
-            "documents": "\n\n".join([doc.page_content for doc in documents]),
-            "generation": generation_str
-        })
+        validation_response = None
+        if state.get("batched") and retries == 1:
+            validation_response, size = validation_batcher.submit(None, {
+                "question": question, "documents": state["validator_context"], "generation": generation_str})
+            record_batch("check", size, validation_response is not None)
+        if validation_response is None:
+            with llm_clients.slot(VERIFICATION_ENDPOINT):
+                validation_response = validator_chain.invoke({
+                    "question": question,
+                    "documents": state["validator_context"],
+                    "generation": generation_str
+                })
         is_supported = validation_response.confidence >= HALLUCINATION_CONFIDENCE_THRESHOLD
         verdict = validation_response.verdict
         confidence = validation_response.confidence
-        print(f"Hallucination check result (using {LLM_VALIDATOR}): {verdict} with confidence {confidence:.2f}")
+        reason = validation_response.reason
 
     except json.JSONDecodeError as e:
-        print(f"JSON parsing failed for generated answer: {e}")
+        log_event("generation_not_json", level=logging.WARNING, error=str(e))
         is_supported = False
         verdict = "Not Supported"
         confidence = 0.0
     except Exception as e:
-        print(f"Error during validation: {e}")
+        log_event("validation_failed", level=logging.ERROR, error=f"{type(e).__name__}: {e}")
         is_supported = False
         verdict = "Requires Review"
         confidence = 0.0
 
-    return {"is_supported": is_supported, "retries": retries, "hallucination_verdict": verdict, "hallucination_confidence": confidence}
+    record_validation(verdict, confidence)
+    annotate(supported=is_supported, attempt=retries)
+    feedback = ""
+    if not is_supported:
+        feedback = (f"A previous answer was rejected by the validator ({verdict}, confidence {confidence:.2f}). "
+                    f"{reason} Only cite regulations and facts that appear in the context.")
+
+    return {"is_supported": is_supported, "retries": retries, "hallucination_verdict": verdict, "hallucination_confidence": confidence, "validation_feedback": feedback}
+
+def generate_batch(items: List[dict]) -> List[ComplianceStatus]:
+    """One generate call for several features (same memory); answers come back in order."""
+    rag_chain = llm_clients.structured_chain(BATCH_GENERATE_PROMPT, ComplianceStatusBatch, GENERATION_ENDPOINT, LLM_MODEL,
+                                             GENERATION_TEMPERATURE)
+    features = "".join(BATCH_GENERATE_ITEM.format(number=number, **{key: item[key] for key in ("context", "terminology", "question")})
+                       for number, item in enumerate(items, 1))
+    with llm_clients.slot(GENERATION_ENDPOINT):
+        response = rag_chain.invoke({"memory": items[0]["memory"], "count": len(items), "features": features})
+    return _match_batch("generate", response.results, len(items))
+
+def check_batch(items: List[dict]) -> List[HallucinationCheckResult]:
+    """One validation call for several generated answers; checks come back in order."""
+    validator_chain = llm_clients.structured_chain(BATCH_VALIDATOR_PROMPT, HallucinationCheckBatch, VERIFICATION_ENDPOINT, LLM_VALIDATOR)
+    blocks = "".join(BATCH_VALIDATOR_ITEM.format(number=number, **item) for number, item in enumerate(items, 1))
+    with llm_clients.slot(VERIFICATION_ENDPOINT):
+        response = validator_chain.invoke({"count": len(items), "items": blocks})
+    return _match_batch("check", response.results, len(items))
+
+def _match_batch(stage: str, results: list, expected: int) -> list:
+    # Results can only be matched to items by position, so a miscount voids the whole batch
+    if len(results) != expected:
+        log_event("batch_miscounted", level=logging.WARNING, batch=stage, expected=expected, returned=len(results))
+        return []
+    return results
+
+generation_batcher = MicroBatcher("generate", generate_batch, BULK_BATCH_SIZE, BULK_BATCH_WAIT_SECONDS)
+validation_batcher = MicroBatcher("check", check_batch, BULK_BATCH_SIZE, BULK_BATCH_WAIT_SECONDS)
 
 def no_solution(state: GraphState) -> GraphState:
     """Provides a structured message when a solution cannot be found after retries."""
-    print("---NO SOLUTION FOUND AFTER RETRIES---")
+    log_event("no_solution", level=logging.WARNING, retries=state.get("retries", 0))
     
     # Create a structured output for a "no solution" scenario
     no_solution_result = ComplianceStatus(
@@ -308,6 +479,65 @@ def no_solution(state: GraphState) -> GraphState:
     
     return {"generation": no_solution_result.model_dump_json(indent=2)}
 
+# Candidates of concurrent questions share one pool; the per-endpoint slots still cap
+# what reaches each Ollama server.
+_speculative_executor = None
+if SPECULATIVE_FANOUT > 1:
+    _speculative_executor = ThreadPoolExecutor(max_workers=BULK_MAX_CONCURRENCY * SPECULATIVE_FANOUT,
+                                               thread_name_prefix="speculative")
+
+def generate_candidate(state: GraphState, attempt: int, cancelled: threading.Event):
+    """Generates and validates one candidate answer. Skips validation once another candidate was accepted."""
+    # The attempt number sets the sampling temperature, so parallel candidates differ
+    candidate_state = {**state, "retries": attempt}
+    with tracing.span("generate"):
+        update = generate_answer(candidate_state)
+    if cancelled.is_set():
+        return None
+    with tracing.span("check"):
+        return {**update, **check_hallucination({**candidate_state, **update})}
+
+def speculative_generate(state: GraphState) -> GraphState:
+    """
+    Generates up to SPECULATIVE_FANOUT candidates at once and validates each as soon as it
+    is ready. The first candidate that passes the hallucination check is accepted and the
+    rest are cancelled; if none passes, the most confident rejection's feedback is kept
+    for the next round.
+    """
+    start = state.get("candidates", 0)
+    count = max(min(SPECULATIVE_FANOUT, SPECULATIVE_BUDGET - start), 1)
+    cancelled = threading.Event()
+    # Each candidate runs in a copy of this context so its spans join the current trace
+    futures = [_speculative_executor.submit(contextvars.copy_context().run, generate_candidate, state, start + i, cancelled)
+               for i in range(count)]
+
+    best = None
+    try:
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                log_event("candidate_failed", level=logging.WARNING, error=f"{type(e).__name__}: {e}")
+                continue
+            if outcome is None:
+                continue
+            if outcome["is_supported"]:
+                best = outcome
+                break
+            if best is None or outcome["hallucination_confidence"] > best["hallucination_confidence"]:
+                best = outcome
+    finally:
+        # Queued candidates never start; running ones stop before their validation call
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+    if best is None:
+        best = {"generation": None, "is_supported": False, "hallucination_verdict": "Requires Review",
+                "hallucination_confidence": 0.0, "validation_feedback": ""}
+    annotate(candidates=count, accepted=best["is_supported"])
+    return {**best, "retries": state.get("retries", 0) + 1, "candidates": start + count}
+
 # --- 4. BUILD AND COMPILE THE GRAPH ---
 def route_check(state: GraphState):
     """Conditional router based on validation check and retry count."""
@@ -316,42 +546,176 @@ def route_check(state: GraphState):
     
     if is_supported:
         return "end"
-    elif retries >= MAX_RETRIES:
+    elif retries >= MAX_RETRIES or (SPECULATIVE_FANOUT > 1 and state.get("candidates", 0) >= SPECULATIVE_BUDGET):
         return "no_solution"
     else:
-        print(f"---RETRYING GENERATION, ATTEMPT {retries} OF {MAX_RETRIES}---")
+        log_event("retrying_generation", attempt=retries + 1, max_retries=MAX_RETRIES)
         return "generate"
 
 workflow = StateGraph(GraphState)
 
-workflow.add_node("rewrite", rewrite_question)
-workflow.add_node("retrieve", retrieve_documents)
-workflow.add_node("generate", generate_answer)
-workflow.add_node("check", check_hallucination)
-workflow.add_node("no_solution", no_solution)
-
-workflow.set_entry_point("rewrite")
+workflow.add_node("expand_terms", traced("expand_terms", expand_terminology))
+workflow.add_node("rewrite", traced("rewrite", rewrite_question))
+workflow.add_node("retrieve", traced("retrieve", retrieve_documents))
+workflow.add_node("no_solution", traced("no_solution", no_solution))
+
+if fast_path is not None:
+    workflow.add_node("fast_path", traced("fast_path", classify_fast_path))
+    workflow.set_entry_point("fast_path")
+    workflow.add_conditional_edges("fast_path", route_fast_path, {"end": END, "graph": "expand_terms"})
+else:
+    workflow.set_entry_point("expand_terms")
+workflow.add_edge("expand_terms", "rewrite")
 workflow.add_edge("rewrite", "retrieve")
-workflow.add_edge("retrieve", "generate")
-workflow.add_edge("generate", "check")
-
-workflow.add_conditional_edges(
-    "check",
-    route_check,
-    {
-        "end": END,
-        "no_solution": "no_solution",
-        "generate": "generate"
-    }
-)
+
+if SPECULATIVE_FANOUT > 1:
+    # Each round generates and validates several candidates in parallel
+    workflow.add_node("speculate", traced("speculate", speculative_generate))
+    workflow.add_edge("retrieve", "speculate")
+    workflow.add_conditional_edges(
+        "speculate",
+        route_check,
+        {
+            "end": END,
+            "no_solution": "no_solution",
+            "generate": "speculate"
+        }
+    )
+else:
+    workflow.add_node("generate", traced("generate", generate_answer))
+    workflow.add_node("check", traced("check", check_hallucination))
+    workflow.add_edge("retrieve", "generate")
+    workflow.add_edge("generate", "check")
+
+    workflow.add_conditional_edges(
+        "check",
+        route_check,
+        {
+            "end": END,
+            "no_solution": "no_solution",
+            "generate": "generate"
+        }
+    )
 workflow.add_edge("no_solution", END)
 
 app_pipeline = workflow.compile()
 
-def run_rag_pipeline(question: str, memory: list) -> str:
-    """Function to encapsulate running the langgraph pipeline."""
-    inputs = {"question": question, "memory": memory, "retries": 0, "is_supported": False, "hallucination_verdict": "", "hallucination_confidence": 0.0}
-    final_state = app_pipeline.invoke(inputs)
+PIPELINE_NODES = {"fast_path", "expand_terms", "rewrite", "retrieve", "generate", "check", "speculate", "no_solution"}
+
+def initial_state(question: str, memory: list, batched: bool = False) -> GraphState:
+    # Results are cached under the caller's full memory; only the prompts see the capped copy
+    capped = cap_memory(memory, MEMORY_MAX_TOKENS)
+    record_context_budget("memory", LLM_MODEL, count_tokens(str(memory)), count_tokens(str(capped)))
+    return {"question": question, "memory": capped, "retries": 0, "is_supported": False, "hallucination_verdict": "", "hallucination_confidence": 0.0, "validation_feedback": "", "candidates": 0, "fast_path": False,
+            "jurisdictions": [], "batched": batched and BULK_BATCH_SIZE > 1}
+
+def lookup_cached_answer(question: str, memory: list, namespace: str, trace: tracing.Trace):
+    """Returns a cached answer for the question, if any, and records the lookup."""
+    if result_cache is None:
+        return None
+    cached = result_cache.get(question, memory, namespace)
+    record_cache_lookup("result", hits=int(cached is not None), misses=int(cached is None))
+    if cached is not None:
+        tracing.finish(trace, "cached")
+        logger.info(f"Feature: {question}, Answer (cached): {json.dumps(cached, indent=2)}")
+    return cached
+
+def record_final_state(question: str, memory: list, namespace: str, trace: tracing.Trace, final_state: GraphState) -> None:
+    """Closes the trace, caches a validated answer and writes the audit log line."""
+    if final_state.get("fast_path"):
+        # Not cached: the classifier reproduces the answer without any LLM call
+        tracing.finish(trace, "fast_path")
+        logger.info(f"Feature: {question}, Answer ({FAST_PATH_TAG}): {json.dumps(final_state['generation'], indent=2)}")
+        return
+
+    # `retries` counts generate/check rounds; every round after the first is a retry
+    tracing.finish(trace, "supported" if final_state["is_supported"] else "no_solution",
+                   retries=max(final_state["retries"] - 1, 0))
+
+    # Only validated answers are cached; a "no solution" result may succeed on a later run
+    if result_cache is not None and final_state["is_supported"]:
+        result_cache.put(question, memory, namespace, final_state['generation'])
 
     logger.info(f"Feature: {question}, Answer: {json.dumps(final_state['generation'], indent=2)}")
-    return final_state['generation']
+
+def run_rag_pipeline(question: str, memory: list, trace_id: str = None, batched: bool = False) -> str:
+    """
+    Function to encapsulate running the langgraph pipeline. With `batched`, the first
+    generate and check calls are shared with concurrent batched runs (BULK_BATCH_SIZE).
+    """
+    with tracing.trace(trace_id) as trace:
+        namespace = result_cache_namespace()
+        cached = lookup_cached_answer(question, memory, namespace, trace)
+        if cached is not None:
+            return cached
+
+        try:
+            final_state = app_pipeline.invoke(initial_state(question, memory, batched))
+        except Exception:
+            tracing.finish(trace, "error")
+            raise
+        record_final_state(question, memory, namespace, trace, final_state)
+        return final_state['generation']
+
+async def stream_rag_pipeline(question: str, memory: list, trace_id: str = None) -> AsyncIterator[dict]:
+    """
+    Runs the pipeline and yields events as they happen:
+      {"type": "stage", "stage": ..., "status": "start" | "end"} around every graph node,
+      {"type": "token", "stage": ..., "content": ...} for each streamed LLM chunk,
+      {"type": "check", "verdict": ..., "confidence": ..., "supported": ...} after each validation,
+    and finally {"type": "result", "answer": ..., "supported": ..., "cached": ...} or
+    {"type": "error", "message": ...}. Closing the iterator cancels the run.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def produce() -> None:
+        # Runs in its own task so the trace context is entered and left in one place,
+        # however the consumer stops iterating
+        with tracing.trace(trace_id) as trace:
+            try:
+                namespace = result_cache_namespace()
+                cached = await asyncio.to_thread(lookup_cached_answer, question, memory, namespace, trace)
+                if cached is not None:
+                    await queue.put({"type": "result", "answer": json.loads(cached), "supported": True,
+                                     "cached": True, "trace_id": trace.trace_id})
+                    return
+
+                final_state = None
+                async for event in app_pipeline.astream_events(initial_state(question, memory), version="v2"):
+                    kind, node = event["event"], event.get("metadata", {}).get("langgraph_node")
+                    if kind == "on_chain_end" and not event.get("parent_ids"):
+                        final_state = event["data"]["output"]
+                    elif kind in ("on_chain_start", "on_chain_end") and event["name"] in PIPELINE_NODES and node == event["name"]:
+                        await queue.put({"type": "stage", "stage": node,
+                                         "status": "start" if kind == "on_chain_start" else "end"})
+                        if kind == "on_chain_end" and node in ("check", "speculate"):
+                            output = event["data"].get("output") or {}
+                            await queue.put({"type": "check", "verdict": output.get("hallucination_verdict"),
+                                             "confidence": output.get("hallucination_confidence"),
+                                             "supported": output.get("is_supported"), "attempt": output.get("retries")})
+                    elif kind == "on_chat_model_stream" and event["data"]["chunk"].content:
+                        await queue.put({"type": "token", "stage": node, "content": event["data"]["chunk"].content})
+
+                await asyncio.to_thread(record_final_state, question, memory, namespace, trace, final_state)
+                await queue.put({"type": "result", "answer": json.loads(final_state["generation"]),
+                                 "supported": final_state["is_supported"], "cached": False, "trace_id": trace.trace_id})
+            except asyncio.CancelledError:
+                tracing.finish(trace, "cancelled")
+                raise
+            except Exception as e:
+                tracing.finish(trace, "error")
+                logger.error(f"Streaming pipeline failed for feature: {question}: {str(e)}", exc_info=True)
+                await queue.put({"type": "error", "message": str(e), "trace_id": trace.trace_id})
+            finally:
+                queue.put_nowait(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await queue.get()
+            if event is done:
+                break
+            yield event
+    finally:
+        producer.cancel()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases and collapses whitespace so trivially different copies of a feature share a key."""
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+class ResultCache:
+    """
+    On-disk cache of final pipeline answers.
+
+    Entries are keyed by the normalized question and memory plus a namespace string that
+    identifies everything else the answer depends on (models, corpus version, prompts).
+    Entries from any other namespace are stale and can be dropped with `invalidate_other_namespaces`.
+
+    When `similarity_threshold` and `embed_fn` are set, a miss on the exact key falls back to
+    the most similar cached question with the same memory and namespace, if its cosine
+    similarity reaches the threshold. Eviction is least-recently-used above `max_entries`,
+    and entries older than `ttl_seconds` are never returned.
+    """
+
+    def __init__(self, db_path: str, max_entries: int, ttl_seconds: float,
+                 similarity_threshold: Optional[float] = None,
+                 embed_fn: Optional[Callable[[str], List[float]]] = None):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embed_fn = embed_fn
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    embedding BLOB,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS results_scope ON results (scope);
+                CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+            """)
+
+    @property
+    def near_duplicates_enabled(self) -> bool:
+        return bool(self.similarity_threshold) and self.embed_fn is not None
+
+    @staticmethod
+    def _scope(memory: list, namespace: str) -> str:
+        """Entries that may answer for each other: same memory, same namespace."""
+        payload = json.dumps([[normalize_text(item) for item in memory], namespace])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(question: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\x00{normalize_text(question)}".encode("utf-8")).hexdigest()
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(normalize_text(question)), dtype="float32")
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, question: str, memory: list, namespace: str) -> Optional[str]:
+        """Returns the cached answer for an identical or (optionally) near-duplicate question."""
+        scope = self._scope(memory, namespace)
+        now = time.time()
+        oldest = now - self.ttl_seconds
+
+        with self._lock:
+            row = self._conn.execute("SELECT key, value FROM results WHERE key = ? AND created_at >= ?",
+                                     (self._key(question, scope), oldest)).fetchone()
+        if row is None and self.near_duplicates_enabled:
+            row = self._nearest(question, scope, oldest)
+        if row is None:
+            return None
+
+        key, value = row
+        with self._lock:
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+        return value
+
+    def _nearest(self, question: str, scope: str, oldest: float):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, embedding FROM results WHERE scope = ? AND created_at >= ? AND embedding IS NOT NULL",
+                (scope, oldest)).fetchall()
+        if not rows:
+            return None
+
+        matrix = np.stack([np.frombuffer(embedding, dtype="float32") for _, _, embedding in rows])
+        similarities = matrix @ self._embed(question)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return rows[best][0], rows[best][1]
+
+    def put(self, question: str, memory: list, namespace: str, value: str) -> None:
+        scope = self._scope(memory, namespace)
+        embedding = self._embed(question).tobytes() if self.near_duplicates_enabled else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, namespace, scope, value, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(question, scope), namespace, scope, value, embedding, now, now))
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def invalidate_other_namespaces(self, namespace: str) -> int:
+        """Drops every entry that was produced under a different corpus, prompt or model setup."""
+        with self._lock:
+            return self._conn.execute("DELETE FROM results WHERE namespace != ?", (namespace,)).rowcount
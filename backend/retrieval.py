@@ -0,0 +1,204 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from index_store import filtered_search_parameters
+from jurisdictions import GLOBAL, with_parents
+
+# Keeps statute identifiers together ("2258a", "13-63-102", "sb976") while still splitting prose.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or such that the their "
+    "then there these this to was were will with which who whom any all may shall must not no".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms for BM25. Compound identifiers are kept whole and also split into parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "-" in token or "." in token:
+            tokens.extend(part for part in re.split(r"[-.]", token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index scored with Okapi BM25."""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths = np.zeros(len(texts), dtype="float32")
+        for doc_idx, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths[doc_idx] = sum(counts.values())
+            for term, tf in counts.items():
+                self.postings[term].append((doc_idx, tf))
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(texts) else 0.0
+        n = len(texts)
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()}
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Returns up to k (document position, score) pairs, best first, among the `allowed` positions (a mask) if given."""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, tf in self.postings[term]:
+                if allowed is not None and not allowed[doc_idx]:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / (self.avg_doc_length or 1.0))
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = 60) -> List[int]:
+    """Fuses ranked lists of document positions: score(d) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_idx in enumerate(ranking):
+            scores[doc_idx] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class CrossEncoderReranker:
+    """Optional CPU cross-encoder reranker. Requires the sentence-transformers package."""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "RERANKER_MODEL requires the sentence-transformers package (pip install sentence-transformers)."
+            ) from e
+        self._model = CrossEncoder(model_name, device="cpu")
+        self._lock = threading.Lock()
+
+    def rerank(self, query: str, documents: List[Document], top_n: int) -> List[Document]:
+        if not documents:
+            return documents
+        with self._lock:
+            scores = self._model.predict([(query, doc.page_content) for doc in documents])
+        order = np.argsort(-np.asarray(scores))[:top_n]
+        return [documents[i] for i in order]
+
+
+@dataclass(frozen=True)
+class SearchScope:
+    """The chunks a jurisdiction-scoped query may return, as a FAISS selector and a BM25 mask."""
+    jurisdictions: Tuple[str, ...] # Requested jurisdictions and their parents
+    size: int # Chunks in scope
+    mask: np.ndarray
+    params: Any # faiss.SearchParameters; reads `selector`, which must outlive it
+    selector: Any
+
+
+class HybridRetriever:
+    """
+    Retrieves regulation chunks by fusing dense FAISS hits with BM25 keyword hits, which
+    catches exact acronyms and section numbers that embeddings tend to miss. The fused
+    candidates are optionally reranked by a cross-encoder before the top k are returned.
+
+    Chunks carry the jurisdiction of their document (tagged at ingestion). A query given a
+    SearchScope only searches that jurisdiction's chunks, its parents' and untagged ones.
+    """
+
+    def __init__(self, vectorstore: FAISS, k: int = 4, fetch_k: int = 20, rrf_k: int = 60,
+                 reranker: Optional[CrossEncoderReranker] = None):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        # Chunks are looked up per hit rather than held here, so a memory-mapped docstore stays shared
+        mapping = vectorstore.index_to_docstore_id
+        self.ids = [mapping[i] for i in range(len(mapping))]
+        texts = []
+        partitions: Dict[str, List[int]] = defaultdict(list)
+        for i in range(len(self.ids)):
+            document = self.document(i)
+            texts.append(document.page_content)
+            partitions[document.metadata.get("jurisdiction", GLOBAL)].append(i)
+        self.bm25 = BM25Index(texts)
+        self.partitions = {code: np.asarray(positions, dtype="int64") for code, positions in partitions.items()}
+        self._scopes: Dict[Tuple[str, ...], Optional[SearchScope]] = {}
+        self._scopes_lock = threading.Lock()
+
+    def document(self, position: int) -> Document:
+        return self.vectorstore.docstore.search(self.ids[position])
+
+    def scope(self, jurisdictions: Sequence[str]) -> Optional[SearchScope]:
+        """
+        The scope for a question naming `jurisdictions`, or None to search every chunk: when
+        none are named, none of them has any chunks, or the scope would cover everything.
+        """
+        requested = tuple(sorted(with_parents(jurisdictions)))
+        if not any(code in self.partitions for code in requested):
+            return None
+        with self._scopes_lock:
+            if requested not in self._scopes:
+                positions = np.concatenate([self.partitions[code] for code in (*requested, GLOBAL) if code in self.partitions])
+                scope = None
+                if len(positions) < len(self.ids):
+                    mask = np.zeros(len(self.ids), dtype=bool)
+                    mask[positions] = True
+                    selector = faiss.IDSelectorBatch(positions)
+                    scope = SearchScope(requested, len(positions), mask,
+                                        filtered_search_parameters(self.vectorstore.index, selector), selector)
+                self._scopes[requested] = scope
+            return self._scopes[requested]
+
+    def _search(self, vectors: np.ndarray, k: int, scope: Optional[SearchScope]) -> List[List[int]]:
+        if scope is None:
+            _, positions = self.vectorstore.index.search(vectors, k)
+        else:
+            _, positions = self.vectorstore.index.search(vectors, k, params=scope.params)
+        return [[int(i) for i in row if i != -1] for row in positions]
+
+    def dense_search(self, query: str, k: int, scope: Optional[SearchScope] = None) -> List[int]:
+        vector = np.asarray([self.vectorstore.embedding_function.embed_query(query)], dtype="float32")
+        return self._search(vector, k, scope)[0]
+
+    def invoke(self, query: str, scope: Optional[SearchScope] = None) -> List[Document]:
+        return self._fuse(query, self.dense_search(query, self.fetch_k, scope), scope)
+
+    def invoke_batch(self, queries: Sequence[str], scopes: Optional[Sequence[Optional[SearchScope]]] = None) -> List[List[Document]]:
+        """
+        Same as `invoke` for each query (with the matching entry of `scopes`), with one
+        embedding call for all of them and one FAISS search per distinct scope.
+        """
+        if not queries:
+            return []
+        scopes = list(scopes) if scopes is not None else [None] * len(queries)
+        vectors = np.asarray(self.vectorstore.embedding_function.embed_documents(list(queries)), dtype="float32")
+        groups: Dict[Optional[Tuple[str, ...]], List[int]] = defaultdict(list)
+        for i, scope in enumerate(scopes):
+            groups[scope.jurisdictions if scope is not None else None].append(i)
+        dense: List[List[int]] = [[] for _ in queries]
+        for members in groups.values():
+            for i, row in zip(members, self._search(vectors[members], self.fetch_k, scopes[members[0]])):
+                dense[i] = row
+        return [self._fuse(query, row, scope) for query, row, scope in zip(queries, dense, scopes)]
+
+    def _fuse(self, query: str, dense: List[int], scope: Optional[SearchScope] = None) -> List[Document]:
+        sparse = [doc_idx for doc_idx, _ in self.bm25.search(query, self.fetch_k, scope.mask if scope is not None else None)]
+        fused = reciprocal_rank_fusion([dense, sparse], k=self.rrf_k)
+
+        if self.reranker is not None:
+            candidates = [self.document(i) for i in fused[:self.fetch_k]]
+            return self.reranker.rerank(query, candidates, self.k)
+        return [self.document(i) for i in fused[:self.k]]
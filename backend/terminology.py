@@ -0,0 +1,92 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton over glossary terms. A single pass over the text finds every
+    term occurrence; matches must sit on word boundaries. Short or all-caps terms (ASL,
+    GH, T5, Glow) match case-sensitively so ordinary words are not mistaken for jargon;
+    longer terms (ShadowMode, Softblock) match in any case.
+    """
+
+    def __init__(self, glossary: Dict[str, str]):
+        self.glossary = glossary
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        for term in glossary:
+            state = 0
+            for char in term.lower():
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(term)
+
+        # Breadth-first construction of failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    @staticmethod
+    def _case_sensitive(term: str) -> bool:
+        return len(term) <= 4 or term.isupper()
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Returns (start, end, term) for every glossary term in the text, in order of appearance."""
+        matches = []
+        state = 0
+        for i, char in enumerate(text.lower()):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for term in self._output[state]:
+                start, end = i - len(term) + 1, i + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if end < len(text) and _is_word_char(text[end]):
+                    continue
+                if self._case_sensitive(term) and text[start:end] != term:
+                    continue
+                matches.append((start, end, term))
+        return sorted(matches)
+
+    def expand(self, text: str) -> List[str]:
+        """Glossary entries ("TERM: explanation") for the terms used in the text, first use first."""
+        seen = []
+        for _, _, term in self.find(text):
+            if term not in seen:
+                seen.append(term)
+        return [f"{term}: {self.glossary[term]}" for term in seen]
+
+
+def load_terminology(excel_path: str) -> TermMatcher:
+    """Builds the matcher from the glossary sheet's 'term' and 'explanation' columns."""
+    try:
+        df = pd.read_excel(excel_path)
+        glossary = {
+            str(row["term"]).strip(): str(row["explanation"]).strip()
+            for _, row in df.iterrows()
+            if pd.notna(row.get("term")) and pd.notna(row.get("explanation"))
+        }
+    except Exception as e:
+        print(f"Error loading terminology file {excel_path}: {e}")
+        glossary = {}
+    return TermMatcher(glossary)
@@ -0,0 +1,51 @@
+from langchain_core.documents import Document
+
+from context_budget import count_tokens, fit_to_budgets
+
+TOPICS = ["age verification", "parental consent", "data retention", "content moderation", "location data", "advertising"]
+QUESTION = "- Does the feature need age verification for minors?\n- How long is data retention allowed?\n- Is parental consent required?"
+
+
+def regulation_documents():
+    documents = []
+    for section, topic in enumerate(TOPICS):
+        sentences = [f"Section {section}.{n} requires platforms to apply {topic} rule number {n} to every account holder."
+                     for n in range(12)]
+        documents.append(Document(page_content=" ".join(sentences), metadata={"source": f"act_{section}.pdf"}))
+    return documents
+
+
+def cited_sentences(context: str, documents):
+    """Sentences of the documents that appear in the context, as a generated answer could cite them."""
+    sentences = [s.strip() for doc in documents for s in doc.page_content.split(". ")]
+    return [s for s in sentences if s.rstrip(".") in context]
+
+
+def check(claim: str, validator_context: str) -> bool:
+    """A validator that supports a claim only when its evidence is in front of it."""
+    return claim.rstrip(".") in validator_context
+
+
+def test_claim_grounded_in_generation_context_passes_the_check():
+    documents = regulation_documents()
+    context, validator_context = fit_to_budgets(documents, QUESTION, 0, generation_budget=300, validator_budget=300)
+    claims = cited_sentences(context, documents)
+    assert claims and count_tokens(context) <= 300
+    assert all(check(claim, validator_context) for claim in claims)
+
+
+def test_smaller_validator_budget_keeps_the_generators_first_picks():
+    documents = regulation_documents()
+    context, validator_context = fit_to_budgets(documents, QUESTION, 0, generation_budget=400, validator_budget=120)
+    shown = cited_sentences(validator_context, documents)
+    assert shown and count_tokens(validator_context) <= 120
+    # Everything the validator sees was in the generator's context, and every concern is still covered
+    assert all(check(sentence, context) for sentence in shown)
+    for topic in ("age verification", "data retention", "parental consent"):
+        assert topic in validator_context
+
+
+def test_context_within_budget_is_shared_whole():
+    documents = regulation_documents()[:1]
+    context, validator_context = fit_to_budgets(documents, QUESTION, 0, generation_budget=1500, validator_budget=800)
+    assert context == validator_context == documents[0].page_content
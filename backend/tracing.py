@@ -0,0 +1,233 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Wall time of each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "Wall time of a whole pipeline run", ["outcome"], buckets=LATENCY_BUCKETS)
+LLM_CALLS = Counter("rag_llm_calls_total", "LLM calls that returned a response", ["model"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens reported by Ollama", ["model", "kind"])
+GENERATION_RETRIES = Histogram("rag_generation_retries", "Extra generate/check rounds per pipeline run", buckets=(0, 1, 2, 3, 4, 5))
+VALIDATOR_VERDICTS = Counter("rag_validator_verdicts_total", "Hallucination check verdicts", ["verdict"])
+VALIDATOR_CONFIDENCE = Histogram("rag_validator_confidence", "Hallucination check confidence",
+                                 buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+CACHE_LOOKUPS = Counter("rag_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+FAST_PATH_DECISIONS = Counter("rag_fast_path_decisions_total", "Rows answered by the fast-path classifier or sent to the graph",
+                              ["route", "source", "label"])
+BATCHED_ITEMS = Counter("rag_batched_items_total", "Rows sent in batched generate/check calls, by whether the batch answered them",
+                        ["stage", "outcome"])
+RETRIEVAL_SCOPES = Counter("rag_retrieval_scopes_total", "Retrievals narrowed to the jurisdictions a question names, or searching every chunk",
+                           ["scope"])
+PROMPT_CONTEXT_TOKENS = Counter("rag_prompt_context_tokens_total", "Estimated tokens of retrieved context and memory before and after budgeting",
+                                ["section", "model", "stage"])
+
+
+@dataclass
+class Trace:
+    """One pipeline run: its id, the request it belongs to, and a span per executed stage."""
+    trace_id: str
+    request_id: Optional[str] = None
+    spans: List[Dict] = field(default_factory=list)
+    start: float = field(default_factory=time.perf_counter)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("current_span", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, tagged with the active request and trace ids."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        active_trace = _current_trace.get()
+        active_span = _current_span.get()
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+            "request_id": _request_id.get(),
+            "trace_id": active_trace.trace_id if active_trace else None,
+            "stage": active_span["stage"] if active_span else None,
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+# Pipeline progress goes to stdout as JSON lines; the audit trail in app.log is unchanged.
+trace_logger = logging.getLogger("trace")
+trace_logger.setLevel(logging.INFO)
+trace_logger.propagate = False
+stream_handler = logging.StreamHandler(sys.stdout)
+stream_handler.setFormatter(JsonFormatter())
+trace_logger.addHandler(stream_handler)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def log_event(event: str, level: int = logging.INFO, **fields) -> None:
+    """Writes a structured log line with the given fields."""
+    trace_logger.log(level, event, extra={"fields": fields})
+
+
+@contextmanager
+def request_context(request_id: str):
+    """Tags everything logged inside the block (including pipeline runs) with a request id."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None):
+    """Starts a trace for one pipeline run; stages executed inside the block add spans to it."""
+    current = Trace(trace_id or new_trace_id(), request_id=_request_id.get())
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage: str):
+    """Times a stage and collects the token usage and attributes recorded while it runs."""
+    current = {"stage": stage, "prompt_tokens": 0, "completion_tokens": 0, "llm_calls": 0}
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current["duration_s"] = round(time.perf_counter() - start, 4)
+        STAGE_SECONDS.labels(stage).observe(current["duration_s"])
+        active_trace = _current_trace.get()
+        if active_trace is not None:
+            active_trace.spans.append(current)
+        log_event("stage_end", **{k: v for k, v in current.items() if k != "stage"})
+        _current_span.reset(token)
+
+
+def traced(stage: str, node):
+    """Wraps a graph node in a span named after the stage."""
+    @wraps(node)
+    def wrapper(state):
+        with span(stage):
+            return node(state)
+    return wrapper
+
+
+def annotate(**fields) -> None:
+    """Attaches attributes (verdict, confidence, retry number...) to the active span."""
+    current = _current_span.get()
+    if current is not None:
+        current.update(fields)
+
+
+def record_cache_lookup(cache: str, hits: int, misses: int = 0) -> None:
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+
+def record_validation(verdict: str, confidence: float) -> None:
+    VALIDATOR_VERDICTS.labels(verdict).inc()
+    VALIDATOR_CONFIDENCE.observe(confidence)
+    annotate(verdict=verdict, confidence=round(confidence, 3))
+
+
+def record_context_budget(section: str, model: str, before: int, after: int) -> None:
+    PROMPT_CONTEXT_TOKENS.labels(section, model, "before").inc(before)
+    PROMPT_CONTEXT_TOKENS.labels(section, model, "after").inc(after)
+    annotate(**{f"{section}_tokens": after, f"{section}_tokens_saved": before - after})
+
+
+def record_fast_path(route: str, source: str = "", label: str = "") -> None:
+    FAST_PATH_DECISIONS.labels(route, source, label).inc()
+    annotate(route=route, **({"source": source, "label": label} if source else {}))
+
+
+def record_batch(stage: str, size: int, answered: bool) -> None:
+    BATCHED_ITEMS.labels(stage, "answered" if answered else "fallback").inc()
+    annotate(batch_size=size, batch_answered=answered)
+
+
+def record_retrieval_scope(scope: str, jurisdictions: List[str], searched: int, total: int) -> None:
+    """
+    `scope` is "narrowed", "all" (no jurisdiction named, or routing disabled) or "fallback"
+    (jurisdictions were named, but none of them has documents or they cover the whole corpus).
+    """
+    RETRIEVAL_SCOPES.labels(scope).inc()
+    annotate(retrieval_scope=scope, jurisdictions=jurisdictions, searched_chunks=searched, indexed_chunks=total)
+
+
+def finish(current: Trace, outcome: str, retries: int = 0) -> Dict:
+    """Records request-level metrics and logs the trace summary. Returns the summary."""
+    duration = time.perf_counter() - current.start
+    REQUEST_SECONDS.labels(outcome).observe(duration)
+    if outcome not in ("cached", "fast_path"):
+        GENERATION_RETRIES.observe(retries)
+    summary = {
+        "outcome": outcome,
+        "duration_s": round(duration, 4),
+        "retries": retries,
+        "prompt_tokens": sum(s["prompt_tokens"] for s in current.spans),
+        "completion_tokens": sum(s["completion_tokens"] for s in current.spans),
+        "llm_calls": sum(s["llm_calls"] for s in current.spans),
+        "spans": current.spans,
+    }
+    log_event("pipeline_end", **summary)
+    return summary
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Adds the prompt/completion token counts Ollama reports on every chat response to the
+    active span and to the token counters. Attach it to the chat models.
+    """
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                model = (getattr(message, "response_metadata", None) or {}).get("model", "unknown")
+                prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+                LLM_CALLS.labels(model).inc()
+                LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+                LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+                current = _current_span.get()
+                if current is not None:
+                    current["prompt_tokens"] += prompt_tokens
+                    current["completion_tokens"] += completion_tokens
+                    current["llm_calls"] += 1
+
+
+def metrics_payload():
+    """Prometheus exposition of every metric in the default registry, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,97 +1,239 @@
-import json
-import pandas as pd
-
-def generate_conversation_from_excel(file_path):
-    """
-    Reads an Excel file, combines data from specific columns, and returns
-    a dictionary in a conversational format.
-
-    Args:
-        file_path (str): The path to the Excel file.
-        prompt_prefix (str): A string to prepend to the 'problem' content.
-
-    Returns:
-        dict: A dictionary with a list of conversations.
-              Example: {"conversations": [{"role": "user", "content": ...}, ...]}
-    """
-
-    try:
-        df = pd.read_excel(file_path)
-
-        required_columns = ["feature_name", "feature_description", "feature_type", "compliance_status", "reasoning"]
-        if not all(col in df.columns for col in required_columns):
-            print(f"Error: The Excel file must contain the following columns: {required_columns}")
-            return {"conversations": []}
-
-        conversations = []
-
-        for index, row in df.iterrows():
-            feature_name = row["feature_name"]
-            feature_description = row["feature_description"]
-
-            prompt = f"""
-/no_think
-You are an AI-powered geo-regulation checker. Your task is to analyze 
-the provided context to determine if a feature requires geo-specific compliance actions to meet legal requirement. 
-If the feature is business driven, select 'No Compliance Logic Needed'. If uncertain, select 'Requires Further Review'. 
-Only use the information provided in the context to make your determination. 
-Your final answer MUST be in the specified JSON format.
-\n\n
----EXAMPLES---
-'Feature reads user location to enforce France's copyright rules (download blocking)' - 'Compliance Logic Needed'
-'Geofences feature rollout in US for market testing' - 'No Compliance Logic Needed' (Business decision, not regulatory)'
-'A video filter feature is available globally except KR' - 'Requires Further Review' (didn't specify the intention, need human evaluation)
----CONTEXT---
-\n\n
----USER QUESTION---
-Here is the feature and feature description to validate:
-{feature_name}, {feature_description}
-\n\n
 """
+Builds the supervised fine-tuning set from labelled feature sheets.
 
-            problem_content = prompt
-            solution_content = {
-                "feature_type": row["feature_type"],
-                "compliance_status": row["compliance_status"],
-                # "supporting_regulations": row["supporting_regulations"],
-                "reasoning": row["reasoning"]
-            }
-
-            # Create the conversation pair as a list of dictionaries.
-            conversation_pair = [
-                {"role": "user", "content": problem_content},
-                {"role": "assistant", "content": json.dumps(solution_content)}
-            ]
-
-            # Append the conversation pair to the list.
-            conversations.append(conversation_pair)
-
-        # Return the final dictionary.
-        return {"conversations": conversations}
+Every example is the exact prompt the live `generate` step sends (shared template from
+backend/prompts.py, filled with the rewrite step's concepts and with context retrieved from
+the backend's own index and fitted to the same token budget) paired with the labelled answer
+in the `ComplianceStatus` schema. Rows are streamed from any number of sheets in shards. This
+process rewrites each feature with the backend's LLM_MODEL and retrieves its context in
+batches; worker processes, which only load the prompt templates and the context budgeting,
+build the prompts and write each shard as one JSONL file.
 
-    except FileNotFoundError:
-        print(f"Error: The file at path '{file_path}' was not found.")
-        return {"conversations": []}
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return {"conversations": []}
+    python generate_training_data.py data/synthetic_feature_data100.xlsx more/*.csv --output-dir data/training
 
-# --- Example Usage ---
-
-excel_file_path = "data/synthetic_feature_data100.xlsx"
-
-result = generate_conversation_from_excel(excel_file_path)
-
-print(result)
-
-output_json_file_path = "data/conversations_output.json"
-
-if result["conversations"]:
+Each line of a shard is {"conversations": [{"role": "user", ...}, {"role": "assistant", ...}]}.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import get_context
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+REQUIRED_COLUMNS = ["feature_name", "feature_description", "feature_type", "compliance_status", "reasoning"]
+SHARD_PATTERN = "part-*.jsonl"
+
+pipeline = None
+row_to_question = None
+
+
+def use_backend(backend_dir: str) -> None:
+    """Makes the backend's modules importable. The backend resolves its caches relative to its own directory."""
+    backend_dir = os.path.abspath(backend_dir)
+    os.chdir(backend_dir)
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+
+
+def load_backend(backend_dir: str) -> None:
+    """Imports the backend pipeline, which loads the regulation index, glossary, models and prompt templates."""
+    global pipeline, row_to_question
+    if pipeline is not None:
+        return
+    use_backend(backend_dir)
+    import rag_pipeline
+    from bulk_engine import row_to_question as to_question
+    pipeline = rag_pipeline
+    row_to_question = to_question
+
+
+def _regulations(value) -> list:
+    if value is None or (isinstance(value, float) and value != value):
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
+def label(row: dict):
+    """The row's answer as the generate step would return it, or None if the labels are missing or invalid."""
     try:
-        with open(output_json_file_path, 'w') as json_file:
-            json.dump(result, json_file, indent=4)
-        print(f"Successfully saved conversation data to '{output_json_file_path}'")
-    except Exception as e:
-        print(f"An error occurred while saving the file: {e}")
-else:
-    print("No conversations were generated. Nothing to save.")
+        answer = pipeline.ComplianceStatus(
+            feature_type=row.get("feature_type"),
+            compliance_status=row.get("compliance_status"),
+            supporting_regulations=_regulations(row.get("supporting_regulations")),
+            reasoning=row.get("reasoning"),
+        )
+    except ValueError:
+        return None
+    return answer.model_dump_json(indent=2)
+
+
+def rewrite(question: str) -> dict:
+    """The state the rewrite step hands to retrieval: the rewritten concepts, glossary terms and jurisdictions."""
+    state = {"question": question, "memory": []}
+    state.update(pipeline.expand_terminology(state))
+    state.update(pipeline.rewrite_question(state))
+    return state
+
+
+def prepare_shard(rows: list, retrieval_batch: int, rewriter) -> list:
+    """
+    Per row, None if its labels are missing or invalid, else (question, terminology,
+    retrieved documents, answer) as the generate step would see them. `rewriter` maps
+    rewrite over the questions, or is None to use the feature text as the question.
+    """
+    labelled = []
+    for row in rows:
+        answer = label(row)
+        question = row_to_question(row).strip()
+        labelled.append((question, answer) if answer is not None and question else None)
+
+    prepared = [None] * len(rows)
+    positions = [i for i, item in enumerate(labelled) if item is not None]
+    retriever = pipeline.corpus.snapshot.retriever
+    for start in range(0, len(positions), retrieval_batch):
+        batch = positions[start:start + retrieval_batch]
+        features = [labelled[i][0] for i in batch]
+        if rewriter is not None:
+            states = list(rewriter(rewrite, features))
+        else:
+            states = []
+            for feature in features:
+                terminology = pipeline.term_matcher.expand(feature)
+                states.append({"question": feature, "terminology": terminology,
+                               "jurisdictions": pipeline.extract_jurisdictions(feature, "\n".join(terminology))})
+        scopes = [retriever.scope(state["jurisdictions"]) if pipeline.JURISDICTION_ROUTING_ENABLED else None for state in states]
+        retrieved = retriever.invoke_batch([state["question"] for state in states], scopes)
+        for i, state, documents in zip(batch, states, retrieved):
+            prepared[i] = (state["question"], pipeline.format_terminology(state), documents, labelled[i][1])
+    return prepared
+
+
+def write_shard(backend_dir: str, path: str, prepared: list, budgets: dict):
+    """
+    Writes one shard and returns (examples written, rows skipped). The file only appears once
+    complete. Runs in the worker processes, so it only imports the prompt templates and the
+    context budgeting, not the pipeline.
+    """
+    use_backend(backend_dir)
+    from context_budget import fit_to_budgets
+    from prompts import GENERATE_PROMPT
+
+    written = skipped = 0
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for item in prepared:
+            if item is None:
+                skipped += 1
+                continue
+            question, terminology, documents, answer = item
+            context, _ = fit_to_budgets(documents, question, **budgets)
+            prompt = GENERATE_PROMPT.format(context=context, terminology=terminology, memory=[], question=question, feedback="")
+            conversation = [{"role": "user", "content": prompt}, {"role": "assistant", "content": answer}]
+            f.write(json.dumps({"conversations": conversation}, ensure_ascii=False) + "\n")
+            written += 1
+    os.replace(path + ".tmp", path)
+    return written, skipped
+
+
+def iter_input_rows(paths: list):
+    """Streams the rows of every input sheet in turn."""
+    from bulk_io import detect_format, iter_rows
+    for path in paths:
+        fmt = detect_format(path)
+        if fmt is None:
+            raise SystemExit(f"Unsupported input format: {path}")
+        with open(path, "rb") as f:
+            first = True
+            for row in iter_rows(f, fmt):
+                if first:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+                    if missing:
+                        raise SystemExit(f"{path} is missing the columns {missing}")
+                    first = False
+                yield row
+
+
+def iter_shards(rows, shard_size: int):
+    shard = []
+    for row in rows:
+        shard.append(row)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate fine-tuning conversations from labelled feature sheets.")
+    parser.add_argument("inputs", nargs="+", help="Sheets (.xlsx, .xls, .csv, .ndjson) with the columns " + ", ".join(REQUIRED_COLUMNS))
+    parser.add_argument("--output-dir", default="data/training", help=f"Directory for the {SHARD_PATTERN} shards")
+    parser.add_argument("--shard-size", type=int, default=5000, help="Examples per shard, and per task handed to a worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes building shards' prompts; 1 builds them in this process")
+    parser.add_argument("--retrieval-batch", type=int, default=64, help="Rows whose queries are embedded and searched together")
+    parser.add_argument("--rewrite-concurrency", type=int, default=4, help="Rewrite calls to the backend's LLM_MODEL in flight")
+    parser.add_argument("--no-rewrite", action="store_true",
+                        help="Use the feature text as the prompt's question instead of the rewrite step's concepts. Needs no "
+                             "LLM, but the prompts then differ from the ones the pipeline sends, which fills {question} with the rewrite")
+    parser.add_argument("--backend", default=BACKEND_DIR, help="Backend directory whose index, glossary and prompts are used")
+    args = parser.parse_args()
+
+    inputs = [os.path.abspath(path) for path in args.inputs]
+    output_dir = os.path.abspath(args.output_dir)
+    backend_dir = os.path.abspath(args.backend)
+    os.makedirs(output_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(output_dir, SHARD_PATTERN)):
+        os.remove(stale)
+
+    # The pipeline (index, glossary, models) is only loaded here; rewriting and retrieval happen in this process
+    load_backend(backend_dir)
+    budgets = {"max_overlap": pipeline.CHUNK_OVERLAP, "generation_budget": pipeline.GENERATION_CONTEXT_TOKENS,
+               "validator_budget": pipeline.VALIDATOR_CONTEXT_TOKENS}
+    rewrites = None if args.no_rewrite else ThreadPoolExecutor(max_workers=args.rewrite_concurrency)
+    rewriter = rewrites.map if rewrites is not None else None
+    print(f"---GENERATING TRAINING DATA FROM {len(inputs)} SHEET(S) WITH {args.workers} WORKER(S)"
+          f"{', WITHOUT THE REWRITE STEP' if args.no_rewrite else ''}---")
+
+    started = time.perf_counter()
+    written = skipped = 0
+    shards = (prepare_shard(rows, args.retrieval_batch, rewriter)
+              for rows in iter_shards(iter_input_rows(inputs), args.shard_size))
+
+    def report(path, result):
+        nonlocal written, skipped
+        written += result[0]
+        skipped += result[1]
+        print(f"Wrote {os.path.basename(path)} ({result[0]} examples, {result[1]} rows skipped)")
+
+    if args.workers <= 1:
+        for number, prepared in enumerate(shards):
+            path = os.path.join(output_dir, f"part-{number:05d}.jsonl")
+            report(path, write_shard(backend_dir, path, prepared, budgets))
+    else:
+        # Workers build and write one shard while the next is rewritten and retrieved here; at
+        # most two shards per worker are held in memory
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn")) as executor:
+            pending = {}
+            for number, prepared in enumerate(shards):
+                path = os.path.join(output_dir, f"part-{number:05d}.jsonl")
+                pending[executor.submit(write_shard, backend_dir, path, prepared, budgets)] = path
+                while len(pending) >= args.workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(pending.pop(future), future.result())
+            for future in wait(pending).done:
+                report(pending.pop(future), future.result())
+
+    if rewrites is not None:
+        rewrites.shutdown()
+    elapsed = time.perf_counter() - started
+    print(f"Generated {written} examples ({skipped} rows skipped) into {output_dir} "
+          f"in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} examples/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-import React, { useState, useCallback } from "react";
+import React, { useState, useCallback, useEffect, useRef } from "react";
 import FileUpload from "./FileUpload";
 import Spinner from "./Spinner";
-import { uploadAndProcessFile } from "../service/service";
+import {
+  submitBulkJob,
+  subscribeToJob,
+  downloadJobResult,
+} from "../service/service";
 import { ManualValidatorProps } from "../props";
 
 const BulkProcessor: React.FC<ManualValidatorProps> = ({ memory }) => {
@@ -12,6 +16,13 @@ const BulkProcessor: React.FC<ManualValidatorProps> = ({ memory }) => {
     null
   );
   const [excelError, setExcelError] = useState<string | null>(null);
+  const [jobId, setJobId] = useState<string | null>(null);
+  const [progress, setProgress] = useState<{ completed: number; total: number } | null>(null);
+  const [rowErrors, setRowErrors] = useState(0);
+  const unsubscribeRef = useRef<(() => void) | null>(null);
+
+  // Close the event stream if the component unmounts mid-job
+  useEffect(() => () => unsubscribeRef.current?.(), []);
 
   // --- Handlers for Excel Analyser ---
   const handleExcelSelect = useCallback(
@@ -26,6 +37,18 @@ const BulkProcessor: React.FC<ManualValidatorProps> = ({ memory }) => {
     [processedExcelUrl]
   );
 
+  const finishJob = async (id: string) => {
+        try {
+          const processedBlob = await downloadJobResult(id);
+          const url = URL.createObjectURL(processedBlob);
+          setProcessedExcelUrl(url);
+        } catch (err) {
+          setExcelError(err instanceof Error ? err.message : 'Excel processing failed.');
+        } finally {
+          setIsProcessingExcel(false);
+        }
+  };
+
   const handleExcelProcessing = async () => {
         if (!excelFile) {
           setExcelError('Please upload an Excel file.');
@@ -33,18 +56,53 @@ const BulkProcessor: React.FC<ManualValidatorProps> = ({ memory }) => {
         }
         setIsProcessingExcel(true);
         setExcelError(null);
+        setRowErrors(0);
         try {
-          const processedBlob = await uploadAndProcessFile(excelFile, memory);
-          const url = URL.createObjectURL(processedBlob);
-          setProcessedExcelUrl(url);
+          const job = await submitBulkJob(excelFile, memory);
+          setJobId(job.job_id);
+          setProgress({ completed: job.completed, total: job.total });
+          unsubscribeRef.current = subscribeToJob(job.job_id, (event) => {
+            setProgress({ completed: event.completed, total: event.total });
+            if (event.type === 'row' && event.error) {
+              setRowErrors((count) => count + 1);
+            }
+            if (event.type === 'status' && event.status === 'completed') {
+              finishJob(job.job_id);
+            }
+            if (event.type === 'status' && event.status === 'failed') {
+              setExcelError(event.error || 'Excel processing failed.');
+              setIsProcessingExcel(false);
+            }
+          });
         } catch (err) {
           setExcelError(err instanceof Error ? err.message : 'Excel processing failed.');
-        } finally {
           setIsProcessingExcel(false);
         }
   };
 
+  const handlePartialDownload = async () => {
+        if (!jobId) {
+          return;
+        }
+        try {
+          const partialBlob = await downloadJobResult(jobId);
+          const url = URL.createObjectURL(partialBlob);
+          const link = document.createElement('a');
+          link.href = url;
+          link.download = `partial_${excelFile?.name || "features.xlsx"}`;
+          link.click();
+          URL.revokeObjectURL(url);
+        } catch (err) {
+          setExcelError(err instanceof Error ? err.message : 'Partial download failed.');
+        }
+  };
+
   const resetExcelAnalyser = () => {
+    unsubscribeRef.current?.();
+    unsubscribeRef.current = null;
+    setJobId(null);
+    setProgress(null);
+    setRowErrors(0);
     setExcelFile(null);
     if (processedExcelUrl) {
       URL.revokeObjectURL(processedExcelUrl);
@@ -99,6 +157,31 @@ const BulkProcessor: React.FC<ManualValidatorProps> = ({ memory }) => {
             >
               {isProcessingExcel ? <Spinner /> : "Analyse Excel File"}
             </button>
+            {isProcessingExcel && progress && (
+              <div className="mt-4">
+                <div className="flex justify-between text-sm text-slate-400">
+                  <span>
+                    Processed {progress.completed} of {progress.total} rows
+                    {rowErrors > 0 && ` (${rowErrors} failed)`}
+                  </span>
+                  <button
+                    onClick={handlePartialDownload}
+                    disabled={progress.completed === 0}
+                    className="text-cyan-400 hover:underline disabled:text-slate-600 disabled:no-underline disabled:cursor-not-allowed"
+                  >
+                    Download partial results
+                  </button>
+                </div>
+                <div className="mt-2 h-2 w-full bg-slate-700 rounded-full overflow-hidden">
+                  <div
+                    className="h-full bg-cyan-400 transition-all"
+                    style={{
+                      width: `${progress.total ? (progress.completed / progress.total) * 100 : 0}%`,
+                    }}
+                  />
+                </div>
+              </div>
+            )}
           </div>
         )}
 
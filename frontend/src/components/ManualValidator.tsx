@@ -1,15 +1,33 @@
-import React, { useState, useCallback } from 'react';
-import type { AnalysisResult } from '../types/types';
+import React, { useState, useCallback, useEffect, useRef } from 'react';
+import type { AnalysisResult, AskStreamEvent, PipelineStage } from '../types/types';
 import ResultCard from './ResultCard';
 import Spinner from './Spinner';
-import { askQuestion } from '../service/service';
+import { askQuestionStream } from '../service/service';
 import { ManualValidatorProps } from '../props';
 
+const STAGE_LABELS: Record<PipelineStage, string> = {
+  expand_terms: 'Expanding internal terminology',
+  rewrite: 'Identifying compliance concepts',
+  retrieve: 'Retrieving regulations',
+  generate: 'Generating answer',
+  check: 'Validating answer against regulations',
+  speculate: 'Generating and validating candidate answers',
+  no_solution: 'Finalising',
+};
+
 const ManualValidator: React.FC<ManualValidatorProps> = ({ memory }) => {
   const [description, setDescription] = useState<string>('');
   const [result, setResult] = useState<AnalysisResult | null>(null);
   const [isLoading, setIsLoading] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
+  const [stage, setStage] = useState<PipelineStage | null>(null);
+  const [attempt, setAttempt] = useState<number>(0);
+  const [streamedText, setStreamedText] = useState<string>('');
+  const [lastCheck, setLastCheck] = useState<string | null>(null);
+  const abortRef = useRef<AbortController | null>(null);
+
+  // Cancel the pipeline run if the component unmounts mid-request
+  useEffect(() => () => abortRef.current?.abort(), []);
   
   const exampleTexts = [
     "Curfew login blocker with ASL and GH for Utah minors, To comply with the Utah Social Media Regulation Act, we are implementing a curfew-based login restriction for users under 18. The system uses ASL to detect minor accounts and routes enforcement through GH to apply only within Utah boundaries. The feature activates during restricted night hours and logs activity using EchoTrace for auditability. This allows parental control to be enacted without user-facing alerts, operating in ShadowMode during initial rollout.",
@@ -27,14 +45,38 @@ const ManualValidator: React.FC<ManualValidatorProps> = ({ memory }) => {
     setIsLoading(true);
     setError(null);
     setResult(null);
+    setStage(null);
+    setAttempt(0);
+    setStreamedText('');
+    setLastCheck(null);
+
+    const controller = new AbortController();
+    abortRef.current = controller;
+    const handleEvent = (event: AskStreamEvent) => {
+      if (event.type === 'stage' && event.status === 'start') {
+        setStage(event.stage);
+        setStreamedText('');
+        if (event.stage === 'generate' || event.stage === 'speculate') {
+          setAttempt((previous) => previous + 1);
+        }
+      } else if (event.type === 'token') {
+        setStreamedText((previous) => previous + event.content);
+      } else if (event.type === 'check' && !event.supported) {
+        setLastCheck(`Previous answer rejected (${event.verdict}, confidence ${event.confidence.toFixed(2)}), retrying`);
+      }
+    };
+
     try {
-      const analysis = await askQuestion(description, memory);
+      const analysis = await askQuestionStream(description, memory, handleEvent, controller.signal);
       console.log('Analysis Result:', analysis);
       setResult(analysis);
     } catch (err) {
-      setError(err instanceof Error ? err.message : "An unknown error occurred.");
+      if (!controller.signal.aborted) {
+        setError(err instanceof Error ? err.message : "An unknown error occurred.");
+      }
     } finally {
       setIsLoading(false);
+      setStage(null);
     }
   }, [description, memory]);
   
@@ -85,6 +127,21 @@ const ManualValidator: React.FC<ManualValidatorProps> = ({ memory }) => {
       </div>
 
       <div className="mt-6">
+        {isLoading && stage && (
+          <div className="p-4 bg-slate-800 rounded-md border border-slate-700">
+            <p className="text-sm font-medium text-cyan-400">
+              {STAGE_LABELS[stage]}
+              {(stage === 'generate' || stage === 'speculate') && attempt > 1 && ` (attempt ${attempt})`}
+              ...
+            </p>
+            {lastCheck && <p className="mt-1 text-xs text-amber-300">{lastCheck}</p>}
+            {streamedText && (
+              <pre className="mt-2 max-h-60 overflow-y-auto whitespace-pre-wrap text-xs text-slate-300">
+                {streamedText}
+              </pre>
+            )}
+          </div>
+        )}
         {error && <div className="text-red-300 bg-red-900/50 p-3 rounded-md border border-red-500/50">{error}</div>}
         {result && <ResultCard result={result} />}
       </div>
@@ -1,4 +1,5 @@
 // apiService.js
+import type { AnalysisResult, AskStreamEvent, BulkJob, JobEvent } from '../types/types';
 
 // Define the base URL of your FastAPI backend.
 // This should be the address where your FastAPI server is running.
@@ -47,6 +48,71 @@ export const askQuestion = async (question: string, memory: string[]) => {
   }
 };
 
+/**
+ * Sends a question to the streaming RAG pipeline endpoint.
+ * EventSource only supports GET, so the server-sent events are read from a fetch body.
+ * @param {string} question - The question to be processed by the pipeline.
+ * @param {(event: AskStreamEvent) => void} onEvent - Called for every stage, token and check event.
+ * @param {AbortSignal} signal - Optional signal that cancels the request (and the pipeline run).
+ * @returns {Promise<AnalysisResult>} The validated answer from the terminal 'result' event.
+ * @throws {Error} If the request fails, the pipeline reports an error, or the stream ends early.
+ */
+export const askQuestionStream = async (
+  question: string,
+  memory: string[],
+  onEvent: (event: AskStreamEvent) => void,
+  signal?: AbortSignal
+): Promise<AnalysisResult> => {
+  const url = `${BASE_URL}/ask/stream`;
+
+  try {
+    const response = await fetch(url, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ question: question, memory: memory }),
+      signal,
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Network response was not ok');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += decoder.decode(value, { stream: true });
+      // Events are separated by a blank line; keep any incomplete event in the buffer
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop() || '';
+      for (const message of messages) {
+        const data = message.split('\n').find((line) => line.startsWith('data: '));
+        if (!data) {
+          continue;
+        }
+        const event: AskStreamEvent = JSON.parse(data.slice('data: '.length));
+        if (event.type === 'error') {
+          throw new Error(event.message);
+        }
+        onEvent(event);
+        if (event.type === 'result') {
+          return event.answer;
+        }
+      }
+    }
+    throw new Error('The stream ended before a result was received.');
+  } catch (error) {
+    console.error('Error in askQuestionStream:', error);
+    throw error;
+  }
+};
+
 /**
  * Uploads a file for processing by the RAG pipeline.
  * @param {File} file - The file object to upload.
@@ -93,6 +159,87 @@ export const uploadAndProcessFile = async (file: any, memory: string[]) => {
   }
 };
 
+/**
+ * Submits a file as a background bulk job.
+ * @param {File} file - The Excel file to process.
+ * @returns {Promise<BulkJob>} The created job, including its id and row count.
+ * @throws {Error} If the network request fails or the response is not ok.
+ */
+export const submitBulkJob = async (file: File, memory: string[]): Promise<BulkJob> => {
+  const url = `${BASE_URL}/jobs`;
+
+  const formData = new FormData();
+  formData.append('file', file);
+  formData.append('memory', JSON.stringify(memory));
+
+  try {
+    const response = await fetch(url, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.detail || 'Network response was not ok');
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error in submitBulkJob:', error);
+    throw error;
+  }
+};
+
+/**
+ * Subscribes to a bulk job's server-sent events.
+ * @param {string} jobId - The id returned by submitBulkJob.
+ * @param {(event: JobEvent) => void} onEvent - Called for every status and row event.
+ * @returns {() => void} A function that closes the subscription.
+ */
+export const subscribeToJob = (jobId: string, onEvent: (event: JobEvent) => void) => {
+  const source = new EventSource(`${BASE_URL}/jobs/${jobId}/events`);
+  const handle = (message: MessageEvent) => {
+    const event: JobEvent = JSON.parse(message.data);
+    onEvent(event);
+    if (event.type === 'status' && (event.status === 'completed' || event.status === 'failed')) {
+      source.close();
+    }
+  };
+  source.addEventListener('status', handle as EventListener);
+  source.addEventListener('row', handle as EventListener);
+  return () => source.close();
+};
+
+/**
+ * Downloads the processed Excel file for a job. While the job is still running this
+ * contains only the rows finished so far.
+ * @param {string} jobId - The id returned by submitBulkJob.
+ * @returns {Promise<Blob>} The processed Excel file as a Blob.
+ * @throws {Error} If the network request fails or the response is not ok.
+ */
+export const downloadJobResult = async (jobId: string) => {
+  const url = `${BASE_URL}/jobs/${jobId}/result`;
+
+  try {
+    const response = await fetch(url);
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.detail || 'Network response was not ok');
+    }
+
+    const errorCount = response.headers.get('X-Errors-Count');
+    if (errorCount && parseInt(errorCount) > 0) {
+      console.warn(`The backend reported ${errorCount} errors during processing.`);
+    }
+
+    return await response.blob();
+  } catch (error) {
+    console.error('Error in downloadJobResult:', error);
+    throw error;
+  }
+};
+
 const hexToBlob = (hex: string) => {
   const matches = hex.match(/[\da-f]{2}/gi);
   if (!matches) {
@@ -10,3 +10,34 @@ export interface AnalysisResult {
   reasoning: string;
   supporting_regulations: string[];
 }
+
+export type JobStatus = 'queued' | 'running' | 'completed' | 'failed';
+
+export interface BulkJob {
+  job_id: string;
+  filename: string;
+  total: number;
+  completed: number;
+  status: JobStatus;
+  error: string | null;
+}
+
+export type JobEvent =
+  | ({ type: 'status' } & BulkJob)
+  | {
+      type: 'row';
+      position: number;
+      result: AnalysisResult | null;
+      error: string | null;
+      completed: number;
+      total: number;
+    };
+
+export type PipelineStage = 'expand_terms' | 'rewrite' | 'retrieve' | 'generate' | 'check' | 'speculate' | 'no_solution';
+
+export type AskStreamEvent =
+  | { type: 'stage'; stage: PipelineStage; status: 'start' | 'end' }
+  | { type: 'token'; stage: PipelineStage; content: string }
+  | { type: 'check'; verdict: string; confidence: number; supported: boolean; attempt: number }
+  | { type: 'result'; answer: AnalysisResult; supported: boolean; cached: boolean; trace_id: string }
+  | { type: 'error'; message: string; trace_id: string };